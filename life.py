@@ -6,17 +6,43 @@ Created on Mon Feb 21 09:17:10 2011
 Released under the LGPL (or most other licenses on demand) - contact me if you
 need appropriate headers stuck on.
 """
+import array
+import collections
 import copy
+import gc
+import json
 import math
-import pygame
-from pygame.locals import *  # Gives names like K_DOWN for key presses.
+import optparse
+import os
 import sys
+import threading
 import time
+import weakref
+# pygame is imported where it is used, so that the engine and the headless mode
+# of main() work without a display and without paying to start pygame.
 
 # Global variables for tracking various counts.
 numNodesConstructed=0
 numAlreadyInCache=0
 numNodeObjectsSaved=0
+numForwardCacheHits=0
+numForwardComputed=0
+# The same counts by the level of the node (see life_stats): nodes constructed,
+# lookups in the node store that found a canonical node and that added one, and
+# _Forward() results found cached and worked out.
+nodesConstructedByLevel = collections.defaultdict(int)
+canonicalHitsByLevel = collections.defaultdict(int)
+canonicalMissesByLevel = collections.defaultdict(int)
+forwardHitsByLevel = collections.defaultdict(int)
+forwardComputedByLevel = collections.defaultdict(int)
+# Seconds spent in, and calls to, World.Iterate() ('forward'), World.Draw()
+# ('draw') and World.FillNode() ('fill_node').
+timings = collections.defaultdict(float)
+timedCalls = collections.defaultdict(int)
+
+# Nodes at this level and below are Leaf objects, holding their cells packed
+# into an integer: 8x8 cells in a single 64 bit value.
+LEAF_LEVEL = 3
 
 # Global cache for a spare node, to reduce object churn when looking up
 # canonical nodes.
@@ -26,15 +52,201 @@ class UsageError(RuntimeError):
   pass
 
 ################################################################################
-class Node:
+# Statistics recorded for a single garbage collection of the node store.
+CollectionStats = collections.namedtuple(
+    'CollectionStats', ['nodes_before', 'nodes_after', 'freed', 'seconds'])
+
+class NodeStore:
+  """Owns the canonical copy of every Node, and keeps it within a budget.
+
+  Without a budget the store grows forever, since every node ever built is
+  remembered. With one (see SetBudget) the store is garbage collected whenever
+  it grows past the budget: every node reachable from a live root is kept, and
+  everything else is dropped. Live roots are the Zero chain, the roots of every
+  registered root source (normally each World, see AddRootSource), and any
+  extra roots the caller is currently holding.
+
+  Nodes that are collected remain valid objects, but are no longer canonical -
+  a new node with the same cells will be a different object. Only hold on to
+  Nodes that are reachable from a root across calls that may collect.
+  """
+  def __init__(self, max_nodes=None):
+    self._nodes = {}
+    # Node.Zero(level) is self._zeros[level-1].
+    self._zeros = []
+    # Leaves are kept apart from the other nodes, keyed by their bits, with
+    # one table per level: self._leaves[level][bits].
+    self._leaves = [None] + [{} for level in range(LEAF_LEVEL)]
+    self._root_sources = weakref.WeakKeyDictionary()
+    self._max_nodes = None
+    self._next_collection = None
+    self.SetBudget(max_nodes)
+
+    # Counters across all collections, and the most recent ones in detail.
+    self.num_collections = 0
+    self.total_freed = 0
+    self.total_seconds = 0.0
+    self.history = collections.deque(maxlen=100)
+
+  def __len__(self):
+    return len(self._nodes) + sum(map(len, self._leaves[1:]))
+
+  def Budget(self):
+    return self._max_nodes
+
+  def SetBudget(self, max_nodes):
+    """Sets the number of nodes to keep before collecting, or None to never
+    collect."""
+    if max_nodes is not None and max_nodes < 1:
+      raise UsageError("The node budget must be positive, got %r" % max_nodes)
+    self._max_nodes = max_nodes
+    self._next_collection = max_nodes
+
+  def AddRootSource(self, source):
+    """Registers an object whose LiveRoots() method returns Nodes that must
+    survive collection. Only a weak reference is kept."""
+    self._root_sources[source] = True
+
+  def Canonical(self, node):
+    """Returns the canonical Node with the same cells as node, adding node if
+    there isn't one yet."""
+    global numAlreadyInCache
+    cache = self._nodes
+    canonical = cache.get(node)
+    if canonical is None:
+      cache[node] = node
+      canonicalMissesByLevel[node._level] += 1
+      return node
+    if id(canonical) != id(node):
+      numAlreadyInCache += 1
+      canonicalHitsByLevel[node._level] += 1
+    return canonical
+
+  def CanonicalLeaf(self, level, bits):
+    """Returns the canonical Leaf at level with the given bits, creating it if
+    there isn't one yet."""
+    global numAlreadyInCache
+    leaves = self._leaves[level]
+    leaf = leaves.get(bits)
+    if leaf is None:
+      leaf = Leaf(level, bits, really_use_constructor=True)
+      leaves[bits] = leaf
+      canonicalMissesByLevel[level] += 1
+    else:
+      numAlreadyInCache += 1
+      canonicalHitsByLevel[level] += 1
+    return leaf
+
+  def ForgetResults(self):
+    """Drops every cached _Forward() result, e.g. to time a cold run."""
+    for nodes in [self._nodes] + self._leaves[1:]:
+      for node in nodes.itervalues():
+        node._next = None
+        node._nextByLevel = None
+
+  def MemoryUsage(self):
+    """Estimates the bytes used by the store's table and all of its nodes."""
+    total = sys.getsizeof(self._nodes)
+    for node in self._nodes:
+      total += node.SizeOf()
+    for leaves in self._leaves[1:]:
+      total += sys.getsizeof(leaves)
+      for leaf in leaves.itervalues():
+        total += leaf.SizeOf()
+    return total
+
+  def BytesPerNode(self):
+    """The average cost of a node in the store, including its table entry."""
+    if not len(self):
+      return 0.0
+    return float(self.MemoryUsage()) / len(self)
+
+  def MaybeCollect(self, extra_roots=()):
+    """Collects if the store has grown past its budget. Returns the
+    CollectionStats if a collection happened, None otherwise."""
+    if (self._next_collection is None or
+        len(self) <= self._next_collection):
+      return None
+    return self.Collect(extra_roots)
+
+  def Collect(self, extra_roots=()):
+    """Mark-and-sweep collection, keeping only the nodes reachable from the live
+    roots and extra_roots. Cached forward results that point at dropped nodes
+    are forgotten too, so nothing kept refers to a non-canonical node.
+
+    Leaves below LEAF_LEVEL are never collected; there are at most 65536 of
+    them.
+    """
+    start = time.time()
+    before = len(self)
+
+    stack = list(extra_roots)
+    stack.extend(self._zeros)
+    for source in list(self._root_sources.keys()):
+      stack.extend(source.LiveRoots())
+    marked = set()
+    while stack:
+      node = stack.pop()
+      if node is None or id(node) in marked:
+        continue
+      marked.add(id(node))
+      if node._level > LEAF_LEVEL:
+        stack.extend((node._nw, node._ne, node._sw, node._se))
+
+    def Sweep(nodes):
+      for node in nodes:
+        if node._next is not None and id(node._next) not in marked:
+          node._next = None
+        if node._nextByLevel is not None:
+          for atLevel, result in node._nextByLevel.items():
+            if id(result) not in marked:
+              del node._nextByLevel[atLevel]
+          if not node._nextByLevel:
+            node._nextByLevel = None
+    kept = {}
+    for node in self._nodes:
+      if id(node) in marked:
+        kept[node] = node
+    self._nodes = kept
+    Sweep(kept)
+    leaves = self._leaves[LEAF_LEVEL]
+    self._leaves[LEAF_LEVEL] = dict(
+        (bits, leaf) for (bits, leaf) in leaves.iteritems()
+        if id(leaf) in marked)
+    Sweep(self._leaves[LEAF_LEVEL].itervalues())
+
+    after = len(self)
+    stats = CollectionStats(before, after, before - after, time.time() - start)
+    self.num_collections += 1
+    self.total_freed += stats.freed
+    self.total_seconds += stats.seconds
+    self.history.append(stats)
+    # If most of the budget is live, give it room to grow before collecting
+    # again rather than collecting on every call.
+    if self._max_nodes is not None:
+      self._next_collection = max(self._max_nodes, 2 * after)
+    return stats
+
+# World.FillNode() sorts sets of at least this many positions into blocks with
+# NumPy, when it is there.
+NUMPY_FILL_MIN = 4096
+
+# The store used by Node.CanonicalNode(). The default budget keeps a few hundred
+# megabytes of nodes at most.
+DEFAULT_MAX_NODES = 1 << 21
+node_store = NodeStore(DEFAULT_MAX_NODES)
+
+################################################################################
+class Node(object):
   """A Node represents a square 2^N x 2^N cluster of cells.
 
   The Node class is based on the description of the HashLife algorithm found
   at http://drdobbs.com/high-performance-computing/184406478. It is a hash tree
   with agressive caching and de-duplication. In particular:
   * Nodes are defined recursively, with _nw, _ne, _sw, and _se being Nodes
-    representing the 2^(N-1) x 2^(N-1) cells in a particular corner ([0|1] at
-    the leaves).
+    representing the 2^(N-1) x 2^(N-1) cells in a particular corner. Nodes at
+    LEAF_LEVEL and below are Leaf objects, which pack their cells into a single
+    integer; see Leaf for details.
   * Nodes are immutable. Once a Node is returned from Node.CanonicalNode(), the
     cells represented are guaranteed not to change.
   * Nodes are unique. They are constructed in such a way that no two Node
@@ -46,13 +258,22 @@ class Node:
     wherever possible, and, along with identical nodes being shared due to their
     uniqueness, means calculating the future inner core of a Node is usually far
     cheaper than the worst case 2^(2N) operation.
+  * Nodes use __slots__ rather than a per-instance __dict__, since the number
+    of nodes is what limits the size of the patterns we can run. See
+    NodeStore.BytesPerNode() for what they cost.
     """
+  __slots__ = ('_level', '_nw', '_ne', '_sw', '_se', '_next', '_nextByLevel',
+               '_population')
+
   @classmethod
   def CanonicalNode(cls, level, nw, ne, sw, se):
     """Returns a canonical version of a new node. Should always be used, never
-    the base constructor."""
+    the base constructor. At LEAF_LEVEL and below this returns a Leaf, and
+    level 1 children are the cells themselves (0 or 1)."""
     global spare_node
     global numNodeObjectsSaved
+    if level <= LEAF_LEVEL:
+      return Leaf.FromQuadrants(level, nw, ne, sw, se)
     if spare_node is not None:
       spare_node._level = level
       spare_node._nw = nw
@@ -60,7 +281,8 @@ class Node:
       spare_node._sw = sw
       spare_node._se = se
       assert spare_node._next is None
-      assert spare_node._nextLevel is None
+      assert spare_node._nextByLevel is None
+      assert spare_node._population is None
     else:
       spare_node = Node(level, nw, ne, sw, se, really_use_constructor=True)
     canonical = spare_node.Canonical()
@@ -78,16 +300,10 @@ class Node:
                        "enormously.")
     global numNodesConstructed
     numNodesConstructed += 1
+    nodesConstructedByLevel[level] += 1
     self._level = level
-    if (level == 1):
-      assert nw is 1 or nw is 0
-      assert ne is 1 or ne is 0
-      assert sw is 1 or sw is 0
-      assert se is 1 or se is 0
-      pass
-    else:
-      assert nw._level == ne._level == sw._level == se._level == level - 1
-      pass
+    assert level > LEAF_LEVEL
+    assert nw._level == ne._level == sw._level == se._level == level - 1
 
     # Recursive sub-nodes:
     self._nw = nw
@@ -95,22 +311,29 @@ class Node:
     self._sw = sw
     self._se = se
 
-    # Cached values. _next and _nextLevel are the cached inner core and the
-    # level at which exponential speedups were started (see Forward() for more
-    # information about the level).
+    # Cached values. _next is the cached inner core 2^(level-2) generations
+    # forward, the result of _Forward() at full speed. _nextByLevel holds the
+    # results for slower steps, keyed by the level at which exponential
+    # speedups were started (see _Forward() for more information about the
+    # level), and is only created when one is needed.
     self._next = None
-    self._nextLevel = None
+    self._nextByLevel = None
+    # The number of live cells, worked out when first asked for (see
+    # Population()).
+    self._population = None
 
-  def Canonical(self, cache_dont_touch={}):
+  def Canonical(self):
     """Returns the canonical variant of a node, hopefully with a cached center.
     """
-    cache = cache_dont_touch
-    global numAlreadyInCache
-    if self not in cache:
-      cache[self] = self
-    if id(cache[self]) != id(self):
-      numAlreadyInCache += 1
-    return cache[self]
+    return node_store.Canonical(self)
+
+  def SizeOf(self):
+    """Bytes used by this node object and its cached results, not counting the
+    nodes it refers to."""
+    size = sys.getsizeof(self)
+    if self._nextByLevel is not None:
+      size += sys.getsizeof(self._nextByLevel)
+    return size
 
   def IsCanonical(self):
     return id(self) == id(self.Canonical())
@@ -133,10 +356,9 @@ class Node:
     return not self.__eq__(other)
 
   @classmethod
-  def Zero(cls, level,
-           cache_dont_touch=[]):
+  def Zero(cls, level):
     """Returns a node tree of all zeroes at the specified level."""
-    cache = cache_dont_touch
+    cache = node_store._zeros
 
     if level == 0:
       return 0
@@ -155,8 +377,118 @@ class Node:
     return ret
 
   def IsZero(self):
-    zero = Node.Zero(self._level)
-    return zero == self
+    """Are all the cells dead? The empty node of each level is unique like any
+    other, so this is an identity check against Node.Zero()."""
+    zeros = node_store._zeros
+    if self._level <= len(zeros):
+      return zeros[self._level - 1] is self
+    return Node.Zero(self._level) is self
+
+  def Population(self):
+    """Returns the number of live cells. Worked out the first time it is asked
+    for and remembered, so it costs one addition per node ever asked about."""
+    if self._population is None:
+      if self.IsZero():
+        self._population = 0
+      else:
+        self._population = (self._nw.Population() + self._ne.Population() +
+                            self._sw.Population() + self._se.Population())
+    return self._population
+
+  def Bounds(self):
+    """Returns (min_x, min_y, max_x, max_y) of the live cells in the
+    coordinates Draw() uses, or None if there are none. Only the nodes along
+    each edge of the pattern are visited, and each of those only once."""
+    if self.IsZero():
+      return None
+    half = 1 << (self._level - 1)
+    return tuple(self._Edge(side, {}) - half for side in range(4))
+
+  # For each side in Bounds() order, the quadrants (by Raw() index) nearest that
+  # side, the ones furthest from it, and whether it is a max rather than a min.
+  _EDGE_QUADRANTS = [((0, 2), (1, 3), False), ((2, 3), (0, 1), False),
+                     ((1, 3), (0, 2), True), ((0, 1), (2, 3), True)]
+
+  def _Edge(self, side, memo):
+    """Returns one of the bounds of the live cells (see Bounds()) of this
+    non-empty node, measured from its south west corner. memo holds the
+    answers for the nodes already visited."""
+    edge = memo.get(id(self))
+    if edge is not None:
+      return edge
+    (near, far, is_max) = Node._EDGE_QUADRANTS[side]
+    half = 1 << (self._level - 1)
+    for quadrants in (near, far):
+      edges = []
+      for index in quadrants:
+        child = self.Raw(index)
+        if child.IsZero():
+          continue
+        offset = half if index in (1, 3) else 0  # East.
+        if side & 1:
+          offset = half if index in (0, 1) else 0  # North.
+        edges.append(child._Edge(side, memo) + offset)
+      if edges:
+        edge = max(edges) if is_max else min(edges)
+        break
+    memo[id(self)] = edge
+    return edge
+
+  def GetCell(self, x, y):
+    """Returns 1 if the cell at (x, y), in the coordinates of Draw(), is alive
+    and 0 if not. Follows a single path down to a leaf, so the time is in
+    proportion to the level."""
+    half = 1 << (self._level - 1)
+    if not (-half <= x < half and -half <= y < half):
+      return 0
+    node = self
+    while node._level > LEAF_LEVEL:
+      half >>= 1
+      if y >= 0:
+        (node, y) = (node._ne if x >= 0 else node._nw, y - half)
+      else:
+        (node, y) = (node._se if x >= 0 else node._sw, y + half)
+      x += -half if x >= 0 else half
+    return (node._bits >> ((half - 1 - y) * 2 * half + x + half)) & 1
+
+  def SetCell(self, x, y, alive=True):
+    """Returns this node with the cell at (x, y) set; see SetCells()."""
+    return self.SetCells([(x, y)], alive)
+
+  def SetCells(self, positions, alive=True):
+    """Returns this node with the cells at positions, in the coordinates of
+    Draw(), made alive (or dead, without alive). Only the nodes on the paths
+    down to those cells are rebuilt, each once however many cells it holds,
+    and the rest - with their cached results - are shared with this node."""
+    half = 1 << (self._level - 1)
+    positions = list(positions)
+    for (x, y) in positions:
+      if not (-half <= x < half and -half <= y < half):
+        raise UsageError('(%d, %d) is outside a node of level %d' %
+                         (x, y, self._level))
+    if not positions:
+      return self
+    return self._SetCells(positions, alive)
+
+  def _SetCells(self, positions, alive):
+    """SetCells() for positions known to be within the node."""
+    quarter = 1 << (self._level - 2)
+    quadrants = ([], [], [], [])
+    for (x, y) in positions:
+      if y >= 0:
+        (index, y) = (0, y - quarter)
+      else:
+        (index, y) = (2, y + quarter)
+      if x >= 0:
+        (index, x) = (index + 1, x - quarter)
+      else:
+        x += quarter
+      quadrants[index].append((x, y))
+    return Node.CanonicalNode(
+        self._level, *[child._SetCells(cells, alive) if cells else child
+                       for (child, cells) in zip(
+                           (self._nw, self._ne, self._sw, self._se),
+                           quadrants)])
 
   def Expand(self):
     """Returns a node one level deeper, with the center being this node."""
@@ -171,31 +503,37 @@ class Node:
     """Returns the smallest node (level >= 1) that will contain all the cells
     (without shifting the center).
     """
-    if self._level == 1:
-      return self
     cur = self
-    zero = Node.Zero(cur._level - 2)
     while (
-        cur._level >= 2 and
-        cur._nw._nw == zero and cur._nw._ne == zero and cur._nw._sw == zero and
-        cur._ne._nw == zero and cur._ne._ne == zero and cur._ne._se == zero and
-        cur._sw._nw == zero and cur._sw._sw == zero and cur._sw._se == zero and
-        cur._se._ne == zero and cur._se._sw == zero and cur._se._se == zero):
-      cur = self.CanonicalNode(cur._level - 1, cur._nw._se, cur._ne._sw, cur._sw._ne,
-                 cur._se._nw)
-      zero = Node.Zero(cur._level - 2)
+        cur._level > LEAF_LEVEL and
+        cur._nw._nw.IsZero() and cur._nw._ne.IsZero() and
+        cur._nw._sw.IsZero() and cur._ne._nw.IsZero() and
+        cur._ne._ne.IsZero() and cur._ne._se.IsZero() and
+        cur._sw._nw.IsZero() and cur._sw._sw.IsZero() and
+        cur._sw._se.IsZero() and cur._se._ne.IsZero() and
+        cur._se._sw.IsZero() and cur._se._se.IsZero()):
+      cur = self.CanonicalNode(cur._level - 1, cur._nw._se, cur._ne._sw,
+                               cur._sw._ne, cur._se._nw)
+    if cur._level <= LEAF_LEVEL:
+      return cur.Compact()
     return cur
 
   @classmethod
   def MergeHorizontal(cls, l, r):
     assert l._level == r._level
+    if l._level <= LEAF_LEVEL:
+      return Leaf.MergeHorizontal(l, r)
     return cls.CanonicalNode(l._level, nw=l._ne, ne=r._nw, sw=l._se, se=r._sw)
   @classmethod
   def MergeVertical(cls, t, b):
     assert t._level == b._level
+    if t._level <= LEAF_LEVEL:
+      return Leaf.MergeVertical(t, b)
     return cls.CanonicalNode(t._level, nw=t._sw, ne=t._se, sw=b._nw, se=b._ne)
   @classmethod
   def MergeCenter(cls, nw, ne, sw, se):
+    if nw._level <= LEAF_LEVEL:
+      return Leaf.MergeCenter(nw, ne, sw, se)
     return cls.CanonicalNode(nw._level, nw._se, ne._sw, sw._ne, se._nw)
 
   def _Forward(self, atLevel=None):
@@ -205,35 +543,38 @@ class Node:
     exponential speedup to start at the specified level, being linear up till
     that point.
     """
+    global numForwardCacheHits
+    global numForwardComputed
     if atLevel is None or atLevel > self._level:
       atLevel = self._level
     assert self._level > 1
-    if self._next and self._nextLevel != atLevel:
-      # Wipe the cache for now.
-      # TODO(ericburnett): Test cache array instead.
-      self._next = None
-      self._nextLevel = None
-    if self._next:
-      return self._next
+    if atLevel == self._level:
+      if self._next is not None:
+        numForwardCacheHits += 1
+        forwardHitsByLevel[self._level] += 1
+        return self._next
+    elif self._nextByLevel is not None and atLevel in self._nextByLevel:
+      numForwardCacheHits += 1
+      forwardHitsByLevel[self._level] += 1
+      return self._nextByLevel[atLevel]
+    numForwardComputed += 1
+    forwardComputedByLevel[self._level] += 1
 
-    if self._level == 2:
-      assert atLevel == 2
-      countNW = (self._nw.Sum(3) + self._ne.SumLeft() + self._sw.SumTop() +
-                 self._se._nw)
-      countNE = (self._ne.Sum(2) + self._nw.SumRight() + self._se.SumTop() +
-                 self._sw._ne)
-      countSW = (self._sw.Sum(1) + self._se.SumLeft() + self._nw.SumBottom() +
-                 self._ne._sw)
-      countSE = (self._se.Sum(0) + self._sw.SumRight() + self._ne.SumBottom() +
-                 self._nw._se)
-      self._next = Node.CanonicalNode(
-          1,
-          (countNW == 3 or (countNW == 2 and self._nw._se)) and 1 or 0,
-          (countNE == 3 or (countNE == 2 and self._ne._sw)) and 1 or 0,
-          (countSW == 3 or (countSW == 2 and self._sw._ne)) and 1 or 0,
-          (countSE == 3 or (countSE == 2 and self._se._nw)) and 1 or 0)
-      self._nextLevel = atLevel
-      return self._next
+    if self._level <= LEAF_LEVEL + 1:
+      # The base cases. The square is small enough to run forward as a single
+      # packed board (see _StepBoard()), keeping the center.
+      if self._level == 2:
+        bits = _level2_table[self._bits]
+      else:
+        if self._level == LEAF_LEVEL + 1:
+          board = _JoinQuadrants(self._level, self._nw._bits, self._ne._bits,
+                                 self._sw._bits, self._se._bits)
+        else:
+          board = self._bits
+        for i in xrange(1 << (atLevel - 2)):
+          board = _StepBoard(board, self._level)
+        bits = _CenterOfBoard(board, self._level)
+      result = node_store.CanonicalLeaf(self._level - 1, bits)
     else:
       n00 = self._nw._Forward(atLevel=atLevel)
       n01 = Node.MergeHorizontal(self._nw, self._ne)._Forward(atLevel=atLevel)
@@ -258,15 +599,139 @@ class Node:
         ne = self.CanonicalNode(self._level-1, n01, n02, n11, n12)._Forward()
         sw = self.CanonicalNode(self._level-1, n10, n11, n20, n21)._Forward()
         se = self.CanonicalNode(self._level-1, n11, n12, n21, n22)._Forward()
-      self._next = self.CanonicalNode(self._level-1, nw, ne, sw, se)
-      self._nextLevel = atLevel
+      result = self.CanonicalNode(self._level-1, nw, ne, sw, se)
+    self._CacheNext(atLevel, result)
+    return result
+
+  def _CacheNext(self, atLevel, result):
+    """Remembers result as the result of _Forward(atLevel)."""
+    if atLevel == self._level:
+      self._next = result
+    elif self._nextByLevel is None:
+      self._nextByLevel = {atLevel: result}
+    else:
+      self._nextByLevel[atLevel] = result
+
+  def _ForwardAnyDepth(self, atLevel=None):
+    """Returns _Forward(atLevel). _Forward() recurses once per level, so very
+    deep trees use the iterative version to stay inside the recursion limit."""
+    if self._level + 100 > sys.getrecursionlimit():
+      return self._ForwardIterative(atLevel)
+    return self._Forward(atLevel)
+
+  def _CachedForward(self, atLevel):
+    """Returns the cached result of _Forward(atLevel), or None. atLevel must
+    already be capped at the node's level."""
+    if atLevel == self._level:
       return self._next
+    if self._nextByLevel is not None:
+      return self._nextByLevel.get(atLevel)
+    return None
+
+  def _SubSquares(self):
+    """The nine overlapping squares one level down whose futures make up the
+    future of this node (see _Forward()), in rows from the top left."""
+    nw, ne, sw, se = self._nw, self._ne, self._sw, self._se
+    return [nw, Node.MergeHorizontal(nw, ne), ne,
+            Node.MergeVertical(nw, sw), Node.MergeCenter(nw, ne, sw, se),
+            Node.MergeVertical(ne, se),
+            sw, Node.MergeHorizontal(sw, se), se]
+
+  @classmethod
+  def _CenterSquares(cls, level, futures):
+    """The four squares at level that the futures of the nine sub-squares make
+    up, which are run forward again at full speed."""
+    (n00, n01, n02, n10, n11, n12, n20, n21, n22) = futures
+    return [cls.CanonicalNode(level, n00, n01, n10, n11),
+            cls.CanonicalNode(level, n01, n02, n11, n12),
+            cls.CanonicalNode(level, n10, n11, n20, n21),
+            cls.CanonicalNode(level, n11, n12, n21, n22)]
 
-  def ForwardN(self, n):
+  @classmethod
+  def _MergedCenters(cls, futures):
+    """The centers of the four squares that the futures of the nine sub-squares
+    make up, for steps slower than full speed."""
+    (n00, n01, n02, n10, n11, n12, n20, n21, n22) = futures
+    return [cls.MergeCenter(n00, n01, n10, n11),
+            cls.MergeCenter(n01, n02, n11, n12),
+            cls.MergeCenter(n10, n11, n20, n21),
+            cls.MergeCenter(n11, n12, n21, n22)]
+
+  def _ForwardIterative(self, atLevel=None):
+    """Returns the same result as _Forward(atLevel), filling in the same
+    caches, but uses an explicit work stack rather than Python recursion, so
+    there is no limit on the depth of the tree.
+
+    Each frame on the stack is [node, atLevel, inputs, results]: the nodes
+    whose futures the node is waiting on, and the futures found so far. The
+    inputs are first the nine sub-squares, all merged at once, and then at full
+    speed the four squares built from their futures.
+    """
+    global numForwardCacheHits
+    global numForwardComputed
+    if atLevel is None or atLevel > self._level:
+      atLevel = self._level
+    if self._level <= LEAF_LEVEL + 1:
+      # The base cases don't recurse.
+      return self._Forward(atLevel)
+    result = self._CachedForward(atLevel)
+    if result is not None:
+      numForwardCacheHits += 1
+      forwardHitsByLevel[self._level] += 1
+      return result
+    numForwardComputed += 1
+    forwardComputedByLevel[self._level] += 1
+
+    stack = [[self, atLevel, self._SubSquares(), []]]
+    while True:
+      frame = stack[-1]
+      (node, atLevel, inputs, results) = frame
+      if len(results) < len(inputs):
+        child = inputs[len(results)]
+        childLevel = child._level
+        if atLevel < childLevel:
+          childLevel = atLevel
+          nextByLevel = child._nextByLevel
+          result = nextByLevel and nextByLevel.get(atLevel)
+        else:
+          result = child._next
+        if result is not None:
+          numForwardCacheHits += 1
+          forwardHitsByLevel[child._level] += 1
+          results.append(result)
+        elif child._level <= LEAF_LEVEL + 1:
+          results.append(child._Forward(childLevel))
+        else:
+          numForwardComputed += 1
+          forwardComputedByLevel[child._level] += 1
+          stack.append([child, childLevel, child._SubSquares(), []])
+        continue
+
+      if len(inputs) == 9:
+        if atLevel != node._level:
+          result = Node.CanonicalNode(node._level-1,
+                                      *Node._MergedCenters(results))
+        else:
+          frame[2] = Node._CenterSquares(node._level-1, results)
+          frame[3] = []
+          continue
+      else:
+        result = Node.CanonicalNode(node._level-1, *results)
+
+      node._CacheNext(atLevel, result)
+      stack.pop()
+      if not stack:
+        return result
+      stack[-1][3].append(result)
+
+  def ForwardN(self, n, forward=None):
     """Returns a Node pointer, representing these cells forward n generations.
     It will automatically expand to be big enough to fit all cells.
     The most compact node centered at the appropriate location that contains
     all the cells is returned.
+
+    forward(node, atLevel), if given, is used in place of node._Forward() for
+    each step, so other engines (see life_parallel) can reuse this logic.
     """
     atLevel = 2
     cur = self
@@ -276,7 +741,12 @@ class Node:
           cur = cur.Expand()
         # Expand twice extra to ensure the expanded cells will fit within the
         # center forward one.
-        cur = cur.Expand().Expand()._Forward(atLevel=atLevel)
+        cur = cur.Expand().Expand()
+        if forward is not None:
+          cur = forward(cur, atLevel)
+        else:
+          cur = cur._ForwardAnyDepth(atLevel)
+      node_store.MaybeCollect(extra_roots=(self, cur))
       n >>= 1
       atLevel += 1
     return cur.Compact()
@@ -287,23 +757,6 @@ class Node:
     return str((self._level, str(self._nw), str(self._ne), str(self._sw),
                 str(self._se)))
 
-  # Various sum functions, for counting portions of a level-1 node.
-  def Sum(self, index):
-    # index is the value to skip (i.e. count 3 of 4 cells).
-    assert self._level == 1
-    return self._nw + self._ne + self._sw + self._se - self.Raw(index)
-  def SumLeft(self):
-    assert self._level == 1
-    return self._nw + self._sw
-  def SumTop(self):
-    assert self._level == 1
-    return self._nw + self._ne
-  def SumRight(self):
-    assert self._level == 1
-    return self._ne + self._se
-  def SumBottom(self):
-    assert self._level == 1
-    return self._sw + self._se
   def Raw(self, index):
     if index == 0:
       return self._nw
@@ -357,21 +810,765 @@ class Node:
         bounds[3] < -inner_size or bounds[2] >= inner_size):
       return
 
+    for i in range(4):
+      new_bounds, new_offset = Node._OffsetBounds(bounds, self._level, i)
+      self.Raw(i).Draw(new_bounds, draw_func,
+                       (offset[0]+new_offset[0], offset[1]+new_offset[1]))
+
+  def DrawBlocks(self, bounds, level, draw_func):
+    """Draw this Node at one point per 2^level x 2^level block of cells, for
+    level >= 1. Block (bx, by) holds the cells with bx*2^level <= x <
+    (bx+1)*2^level, and likewise for y, in the coordinates of Draw(); bounds
+    are in blocks. draw_func(bx, by, population) is called for each block with
+    live cells in it, and the recursion stops at nodes the size of a block, so
+    the work is bounded by the number of blocks drawn rather than cells.
+    """
+    assert level >= 1
     if self._level == 1:
-      if self._nw and bounds[0] <= -1 and bounds[3] >= 0:
-        draw_func(-1 + offset[0], 0 + offset[1])
-      if self._ne and bounds[1] >= 0 and bounds[3] >= 0:
-        draw_func(0 + offset[0], 0 + offset[1])
-      if self._sw and bounds[0] <= -1 and bounds[2] <= -1:
-        draw_func(-1 + offset[0], -1 + offset[1])
-      if self._se and bounds[1] >= 0 and bounds[2] <= -1:
-        draw_func(0 + offset[0], -1 + offset[1])
+      # Its cells are in four different blocks anyway.
+      self.Draw((-1, 0, -1, 0),
+                lambda x, y: draw_func(x >> level, y >> level, 1))
+      return
+    half = 1 << (self._level - 1)
+    self._nw._DrawBlocks(-half, 0, bounds, level, draw_func)
+    self._ne._DrawBlocks(0, 0, bounds, level, draw_func)
+    self._sw._DrawBlocks(-half, -half, bounds, level, draw_func)
+    self._se._DrawBlocks(0, -half, bounds, level, draw_func)
+
+  def _DrawBlocks(self, x, y, bounds, level, draw_func):
+    """DrawBlocks() for a node with its south west cell at (x, y)."""
+    if self.IsZero():
+      return
+    last = (1 << self._level) - 1
+    if ((x + last) >> level < bounds[0] or x >> level > bounds[1] or
+        (y + last) >> level < bounds[2] or y >> level > bounds[3]):
+      return
+    if self._level <= level:
+      draw_func(x >> level, y >> level, self.Population())
+      return
+    half = 1 << (self._level - 1)
+    self._nw._DrawBlocks(x, y + half, bounds, level, draw_func)
+    self._ne._DrawBlocks(x + half, y + half, bounds, level, draw_func)
+    self._sw._DrawBlocks(x, y, bounds, level, draw_func)
+    self._se._DrawBlocks(x + half, y, bounds, level, draw_func)
+
+
+################################################################################
+class Leaf(Node):
+  """A Leaf is a Node at LEAF_LEVEL or below, with its 2^N x 2^N cells packed
+  into the integer _bits rather than held in child nodes.
+
+  The cell in row r (counting down from the top) and column c (counting from
+  the left) is bit r * 2^N + c. Leaves are canonical like any other Node, and
+  _nw, _ne, _sw and _se are computed on demand (as 0 or 1 at level 1), so code
+  written for Nodes works on them unchanged. The hot paths - _Forward(), the
+  merges, Expand(), Compact() and Draw() - work on the bits directly instead.
+  """
+  __slots__ = ('_bits',)
+
+  @classmethod
+  def FromQuadrants(cls, level, nw, ne, sw, se):
+    """Returns the canonical leaf with the given quadrants."""
+    if level == 1:
+      bits = nw | ne << 1 | sw << 2 | se << 3
     else:
-      directions = self._nw, self._ne, self._sw, self._se
-      for i in range(4):
-        new_bounds, new_offset = Node._OffsetBounds(bounds, self._level, i)
-        self.Raw(i).Draw(new_bounds, draw_func,
-                         (offset[0]+new_offset[0], offset[1]+new_offset[1]))
+      bits = _JoinQuadrants(level, nw._bits, ne._bits, sw._bits, se._bits)
+    return node_store.CanonicalLeaf(level, bits)
+
+  def __init__(self, level, bits, really_use_constructor=False):
+    if not really_use_constructor:
+      raise UsageError("You should call Node.CanonicalNode rather than the "
+                       "constructor directly. This breaks assumptions used "
+                       "throughout the class and will slow down execution "
+                       "enormously.")
+    global numNodesConstructed
+    numNodesConstructed += 1
+    nodesConstructedByLevel[level] += 1
+    assert 1 <= level <= LEAF_LEVEL
+    self._level = level
+    self._bits = bits
+    self._next = None
+    self._nextByLevel = None
+    self._population = None
+
+  def _Quadrant(self, index):
+    bits = _Quadrant(self._bits, self._level, index)
+    if self._level == 1:
+      return bits
+    return node_store.CanonicalLeaf(self._level - 1, bits)
+
+  _nw = property(lambda self: self._Quadrant(0))
+  _ne = property(lambda self: self._Quadrant(1))
+  _sw = property(lambda self: self._Quadrant(2))
+  _se = property(lambda self: self._Quadrant(3))
+
+  def Canonical(self):
+    return node_store.CanonicalLeaf(self._level, self._bits)
+
+  def SizeOf(self):
+    return Node.SizeOf(self) + sys.getsizeof(self._bits)
+
+  def __hash__(self):
+    return hash((self._level, self._bits))
+
+  def __eq__(self, other):
+    if id(self) == id(other):
+      return True
+    return (isinstance(other, Leaf) and self._level == other._level and
+            self._bits == other._bits)
+
+  def IsZero(self):
+    return not self._bits
+
+  def Population(self):
+    if self._population is None:
+      self._population = bin(self._bits).count('1')
+    return self._population
+
+  def _Edge(self, side, memo):
+    """See Node._Edge(); worked out from the bits, so memo is not needed."""
+    width = 1 << self._level
+    row_mask = (1 << width) - 1
+    rows = [row for row in range(width)
+            if (self._bits >> (row*width)) & row_mask]
+    if side & 1:
+      # Rows count down from the top, y counts up from the bottom.
+      return width - 1 - (rows[-1] if side == 1 else rows[0])
+    columns = 0
+    for row in rows:
+      columns |= (self._bits >> (row*width)) & row_mask
+    if side == 0:
+      return (columns & -columns).bit_length() - 1
+    return columns.bit_length() - 1
+
+  def _SetCells(self, positions, alive):
+    """Node._SetCells(), setting the bits all at once."""
+    width = 1 << self._level
+    half = width >> 1
+    mask = 0
+    for (x, y) in positions:
+      mask |= 1 << ((half - 1 - y) * width + x + half)
+    bits = self._bits | mask if alive else self._bits & ~mask
+    return node_store.CanonicalLeaf(self._level, bits)
+
+  def _DrawBlocks(self, x, y, bounds, level, draw_func):
+    """Node._DrawBlocks(), counting the cells of blocks smaller than the leaf
+    straight from the bits rather than through smaller leaves."""
+    if not self._bits:
+      return
+    width = 1 << self._level
+    if ((x + width - 1) >> level < bounds[0] or x >> level > bounds[1] or
+        (y + width - 1) >> level < bounds[2] or y >> level > bounds[3]):
+      return
+    if self._level <= level:
+      draw_func(x >> level, y >> level, self.Population())
+      return
+    size = 1 << level
+    row_mask = (1 << size) - 1
+    for row in range(0, width, size):
+      by = (y + width - row - size) >> level
+      if by < bounds[2] or by > bounds[3]:
+        continue
+      for col in range(0, width, size):
+        bx = (x + col) >> level
+        if bx < bounds[0] or bx > bounds[1]:
+          continue
+        population = 0
+        for r in range(row, row + size):
+          population += bin((self._bits >> (r * width + col)) &
+                            row_mask).count('1')
+        if population:
+          draw_func(bx, by, population)
+
+  def Expand(self):
+    """Returns a node one level deeper, with the center being this node."""
+    if self._level == LEAF_LEVEL:
+      return Node.Expand(self)
+    width = 2 << self._level
+    quarter = width >> 2
+    return node_store.CanonicalLeaf(
+        self._level + 1,
+        _Spread(self._bits, self._level) << (quarter*width + quarter))
+
+  def Compact(self):
+    """Returns the smallest node (level >= 1) that will contain all the cells
+    (without shifting the center).
+    """
+    cur = self
+    while cur._level > 1 and not cur._bits & ~_center_mask[cur._level]:
+      cur = node_store.CanonicalLeaf(cur._level - 1,
+                                     _CenterOfBoard(cur._bits, cur._level))
+    return cur
+
+  @staticmethod
+  def MergeHorizontal(l, r):
+    return node_store.CanonicalLeaf(
+        l._level, _MergeHorizontalBits(l._bits, r._bits, l._level))
+  @staticmethod
+  def MergeVertical(t, b):
+    return node_store.CanonicalLeaf(
+        t._level, _MergeVerticalBits(t._bits, b._bits, t._level))
+  @staticmethod
+  def MergeCenter(nw, ne, sw, se):
+    level = nw._level
+    return node_store.CanonicalLeaf(level, _MergeVerticalBits(
+        _MergeHorizontalBits(nw._bits, ne._bits, level),
+        _MergeHorizontalBits(sw._bits, se._bits, level),
+        level))
+
+  def Draw(self, bounds, draw_func, offset=(0,0)):
+    """Draw the cells within this Leaf that fall within bounds. See
+    Node.Draw()."""
+    bits = self._bits
+    width = 1 << self._level
+    half = width >> 1
+    row_mask = (1 << width) - 1
+    for row in range(width):
+      row_bits = (bits >> (row*width)) & row_mask
+      if not row_bits:
+        continue
+      y = half - 1 - row
+      if y < bounds[2] or y > bounds[3]:
+        continue
+      for col in range(width):
+        x = col - half
+        if (row_bits >> col) & 1 and bounds[0] <= x <= bounds[1]:
+          draw_func(x + offset[0], y + offset[1])
+
+
+################################################################################
+# Helpers for working with packed leaves and boards. A board is a packed square
+# of cells laid out like a Leaf, but possibly one level bigger - LEAF_LEVEL + 1
+# is the biggest square the base case of Node._Forward() steps in one go.
+
+def _LevelMasks(level):
+  """Returns the masks for a packed square at level: every cell, every cell
+  but the first column, every cell but the last column, and the left half."""
+  width = 1 << level
+  row = (1 << width) - 1
+  rows = sum(1 << (r*width) for r in range(width))
+  return (row * rows, (row - 1) * rows, (row >> 1) * rows,
+          ((1 << (width >> 1)) - 1) * rows)
+
+def _CenterShift(level):
+  """How far the center of a square at level is from its top left corner."""
+  quarter = (1 << level) >> 2
+  return (quarter << level) + quarter
+
+def _SpreadSteps(level):
+  """Returns the (keep, move, shift) steps that move the rows of a square at
+  level from a stride of its width to a stride of twice its width. Rows move
+  in halves, largest first, so nothing moved lands on anything kept.
+  """
+  width = 1 << level
+  row = (1 << width) - 1
+  positions = [r*width for r in range(width)]
+  steps = []
+  bit = width >> 1
+  while bit:
+    keep = move = 0
+    for r in range(width):
+      if r & bit:
+        move |= row << positions[r]
+        positions[r] += width*bit
+      else:
+        keep |= row << positions[r]
+    steps.append((keep, move, width*bit))
+    bit >>= 1
+  return steps
+
+_masks = [None] + [_LevelMasks(level) for level in range(1, LEAF_LEVEL + 2)]
+_spread_steps = [_SpreadSteps(level) for level in range(LEAF_LEVEL + 1)]
+# The top left quadrant of a square at each level, and its center.
+_quadrant_mask = [None] + [
+    _masks[level][3] & ((1 << (1 << (2*level - 1))) - 1)
+    for level in range(1, LEAF_LEVEL + 2)]
+_center_mask = [None] + [_quadrant_mask[level] << _CenterShift(level)
+                          for level in range(1, LEAF_LEVEL + 2)]
+
+def _Spread(bits, level):
+  """Spreads a square at level out to the row stride of the level above."""
+  for (keep, move, shift) in _spread_steps[level]:
+    bits = (bits & keep) | ((bits & move) << shift)
+  return bits
+
+def _Gather(bits, level):
+  """The inverse of _Spread(): packs rows of a square at level from the row
+  stride of the level above back together."""
+  for (keep, move, shift) in reversed(_spread_steps[level]):
+    bits = (bits & keep) | ((bits & (move << shift)) >> shift)
+  return bits
+
+def _JoinQuadrants(level, nw, ne, sw, se):
+  """Returns the bits of the square at level with the given quadrants."""
+  half = 1 << (level - 1)
+  top = _Spread(nw, level - 1) | (_Spread(ne, level - 1) << half)
+  bottom = _Spread(sw, level - 1) | (_Spread(se, level - 1) << half)
+  return top | (bottom << (2*half*half))
+
+def _Quadrant(bits, level, index):
+  """Returns the bits of quadrant index (0-3 for nw, ne, sw, se) of the square
+  at level."""
+  half = 1 << (level - 1)
+  shift = (half << level if index >= 2 else 0) + (half if index & 1 else 0)
+  return _Gather((bits >> shift) & _quadrant_mask[level], level - 1)
+
+def _CenterOfBoard(bits, level):
+  """Returns the bits of the center half of the square at level."""
+  return _Gather((bits >> _CenterShift(level)) & _quadrant_mask[level],
+                 level - 1)
+
+def _MergeHorizontalBits(l, r, level):
+  """The right half of square l next to the left half of square r."""
+  (full, unused_first, unused_last, left) = _masks[level]
+  half = 1 << (level - 1)
+  return ((l >> half) & left) | ((r << half) & (full ^ left))
+
+def _MergeVerticalBits(t, b, level):
+  """The bottom half of square t above the top half of square b."""
+  full = _masks[level][0]
+  shift = 1 << (2*level - 1)
+  return (t >> shift) | ((b << shift) & full)
+
+def _StepBoard(board, level):
+  """Runs a packed square at level forward one generation, bitwise-parallel.
+  Cells beyond the edges count as dead, so only the cells at least one away
+  from the edge come out right; each step the good region shrinks by one.
+  """
+  (full, not_first, not_last, unused_left) = _masks[level]
+  width = 1 << level
+  # Each cell's left and right neighbours, lined up with the cell.
+  left = (board << 1) & not_first
+  right = (board >> 1) & not_last
+  # Two bit sums of each row of three (for the rows above and below a cell),
+  # and of the two neighbours beside the cell.
+  sum0 = left ^ right ^ board
+  sum1 = (left & right) | (board & (left ^ right))
+  side0 = left ^ right
+  side1 = left & right
+  above0 = (sum0 << width) & full
+  above1 = (sum1 << width) & full
+  below0 = sum0 >> width
+  below1 = sum1 >> width
+  # The neighbour count is ones + 2 * (twos), where twos is the number of bits
+  # set among above1, below1, side1 and carry.
+  ones = above0 ^ below0 ^ side0
+  carry = (above0 & below0) | (side0 & (above0 ^ below0))
+  a = above1 ^ below1
+  b = side1 ^ carry
+  exactly_one_two = (a ^ b) & ~((above1 & below1) | (side1 & carry) | (a & b))
+  # A count of 3 (ones set) gives birth or survival, 2 only survival.
+  return exactly_one_two & (ones | board)
+
+# The level-2 base case of Node._Forward() is answered from a table rather than
+# by stepping the board: the bits of each level-2 leaf index the bits of its
+# level-1 successor.
+_level2_table = array.array(
+    'B', [_CenterOfBoard(_StepBoard(bits, 2), 2) for bits in xrange(65536)])
+
+
+################################################################################
+def FlattenNodes(roots):
+  """Lists every node reachable from roots once, children before parents, as
+  plain tuples: (level, bits) for a Leaf and (level, nw, ne, sw, se) for other
+  nodes, where the children are positions in the list. Returns the list and
+  the position of each root. UnflattenNodes() turns it back into nodes, in
+  this process or another one.
+  """
+  positions = {}
+  entries = []
+  for root in roots:
+    stack = [root]
+    while stack:
+      node = stack[-1]
+      if id(node) in positions:
+        stack.pop()
+        continue
+      if node._level <= LEAF_LEVEL:
+        entry = (node._level, node._bits)
+      else:
+        children = (node._nw, node._ne, node._sw, node._se)
+        pending = [child for child in children if id(child) not in positions]
+        if pending:
+          stack.extend(pending)
+          continue
+        entry = (node._level,) + tuple(positions[id(child)]
+                                       for child in children)
+      stack.pop()
+      positions[id(node)] = len(entries)
+      entries.append(entry)
+  return (entries, [positions[id(root)] for root in roots])
+
+def UnflattenNodes(entries):
+  """Returns the canonical nodes for a list from FlattenNodes(), in order."""
+  nodes = []
+  for entry in entries:
+    if len(entry) == 2:
+      nodes.append(node_store.CanonicalLeaf(entry[0], entry[1]))
+    else:
+      (level, nw, ne, sw, se) = entry
+      nodes.append(Node.CanonicalNode(level, nodes[nw], nodes[ne], nodes[sw],
+                                      nodes[se]))
+  return nodes
+
+
+################################################################################
+# Converting between nodes and blocks of cells. A block is the 8x8 square of
+# cells held by a leaf at LEAF_LEVEL; block (bx, by) holds the cells with
+# 8*bx <= x < 8*bx + 8 and 8*by <= y < 8*by + 8, in the coordinates Node.Draw()
+# uses for a node centered on (0,0) (so y increases northward).
+
+def LeafBlocks(node, bounds=None):
+  """Returns ((bx, by), bits) for every non-empty block of node, where bits are
+  the block's cells packed as in a Leaf at LEAF_LEVEL. If bounds are given,
+  as (min_bx, max_bx, min_by, max_by) like those of Node.Draw(), only the
+  blocks within them are returned."""
+  (bxs, bys, bits) = LeafColumns(node, bounds)
+  return zip(zip(bxs, bys), bits)
+
+def LeafColumns(node, bounds=None):
+  """LeafBlocks() as three lists - the bx, the by and the bits of each block -
+  ready to be turned into NumPy arrays."""
+  (bxs, bys, leaves) = NodeColumns(node, LEAF_LEVEL, bounds)
+  return (bxs, bys, [leaf._bits for leaf in leaves])
+
+def NodeColumns(node, level, bounds=None):
+  """Finds the non-empty nodes at level within node, where node (nx, ny) at
+  level holds the cells with nx*2^level <= x < (nx+1)*2^level and likewise
+  for y. Returns three lists: the nx, the ny and the node. bounds work as for
+  LeafBlocks(), in units of 2^level cells."""
+  while node._level <= level:
+    node = node.Expand()
+  if bounds is None:
+    bounds = (-sys.maxint, sys.maxint, -sys.maxint, sys.maxint)
+  (min_nx, max_nx, min_ny, max_ny) = bounds
+  nxs = []
+  nys = []
+  nodes = []
+  # This is the inner loop of drawing, so IsZero() and the like are done
+  # inline.
+  Node.Zero(node._level)
+  zeros = node_store._zeros
+  zero = zeros[level - 1]
+  corner = -(1 << (node._level - level - 1))
+  stack = [(node, corner, corner)]
+  pop = stack.pop
+  push = stack.append
+  while stack:
+    (node, nx, ny) = pop()
+    node_level = node._level
+    if zeros[node_level - 1] is node:
+      continue
+    last = (1 << (node_level - level)) - 1
+    if nx + last < min_nx or nx > max_nx or ny + last < min_ny or ny > max_ny:
+      continue
+    if node_level > level + 1:
+      half = (last + 1) >> 1
+      push((node._nw, nx, ny + half))
+      push((node._ne, nx + half, ny + half))
+      push((node._sw, nx, ny))
+      push((node._se, nx + half, ny))
+      continue
+    # The children are at level; take them straight from here.
+    for (child, x, y) in ((node._nw, nx, ny + 1), (node._ne, nx + 1, ny + 1),
+                          (node._sw, nx, ny), (node._se, nx + 1, ny)):
+      if (child is not zero and min_nx <= x <= max_nx and
+          min_ny <= y <= max_ny):
+        nxs.append(x)
+        nys.append(y)
+        nodes.append(child)
+  return (nxs, nys, nodes)
+
+def ChangedNodes(old, new, level, bounds=None):
+  """Finds the nodes at level that differ between old and new, two nodes of
+  the same level centered on (0,0), numbered as by NodeColumns(). Returns
+  three lists: the nx, the ny and the node in new, which may be empty.
+
+  Nodes are canonical, so a subtree that is the same in both is the same
+  node, and is skipped without looking inside: the work follows what has
+  changed rather than the population. Builds no nodes. level is at least
+  LEAF_LEVEL, whose nodes have no children to compare."""
+  assert level >= LEAF_LEVEL
+  if old._level != new._level:
+    raise UsageError('Nodes of levels %d and %d can not be compared' %
+                     (old._level, new._level))
+  if bounds is None:
+    bounds = (-sys.maxint, sys.maxint, -sys.maxint, sys.maxint)
+  (min_nx, max_nx, min_ny, max_ny) = bounds
+  nxs = []
+  nys = []
+  nodes = []
+  if new._level <= level:
+    if old is not new:
+      nxs.append(0)
+      nys.append(0)
+      nodes.append(new)
+    return (nxs, nys, nodes)
+  corner = -(1 << (new._level - level - 1))
+  stack = [(old, new, corner, corner)]
+  pop = stack.pop
+  push = stack.append
+  while stack:
+    (old, new, nx, ny) = pop()
+    if old is new:
+      continue
+    node_level = new._level
+    last = (1 << (node_level - level)) - 1
+    if nx + last < min_nx or nx > max_nx or ny + last < min_ny or ny > max_ny:
+      continue
+    if node_level > level:
+      half = (last + 1) >> 1
+      push((old._nw, new._nw, nx, ny + half))
+      push((old._ne, new._ne, nx + half, ny + half))
+      push((old._sw, new._sw, nx, ny))
+      push((old._se, new._se, nx + half, ny))
+      continue
+    nxs.append(nx)
+    nys.append(ny)
+    nodes.append(new)
+  return (nxs, nys, nodes)
+
+def NodeFromLeafBlocks(blocks):
+  """The inverse of LeafBlocks(): builds the smallest node centered on (0,0)
+  holding the blocks in a dict of (bx, by) -> bits. Works bottom up, so each
+  node is built once and empty regions cost nothing."""
+  nodes = dict((key, node_store.CanonicalLeaf(LEAF_LEVEL, bits))
+               for (key, bits) in blocks.iteritems() if bits)
+  if not nodes:
+    return Node.Zero(1)
+  level = LEAF_LEVEL
+  # How far the farthest block is from the middle; each level up halves it.
+  extent = max(max(-1 - bx, bx, -1 - by, by) for (bx, by) in nodes)
+  while extent > 0:
+    # Group the nodes into their parents, a level up.
+    zero = Node.Zero(level)
+    quadrants = {}
+    get = quadrants.get
+    for ((bx, by), node) in nodes.iteritems():
+      key = (bx >> 1, by >> 1)
+      children = get(key)
+      if children is None:
+        children = quadrants[key] = [zero, zero, zero, zero]
+      children[(1 - (by & 1)) * 2 + (bx & 1)] = node
+    level += 1
+    # Sparse patterns repeat the same few nodes over and over; remembering
+    # them by their children's ids skips most of the trips to the store.
+    made = {}
+    nodes = {}
+    for (key, children) in quadrants.iteritems():
+      ids = (id(children[0]), id(children[1]), id(children[2]),
+             id(children[3]))
+      node = made.get(ids)
+      if node is None:
+        node = made[ids] = Node.CanonicalNode(level, *children)
+      nodes[key] = node
+    extent >>= 1
+  root = _NodeFromChildren(level + 1, [nodes.get((-1, 0)), nodes.get((0, 0)),
+                                       nodes.get((-1, -1)), nodes.get((0, -1))])
+  return root.Compact()
+
+def PositionBlocks(positions, offset_x=0, offset_y=0):
+  """Puts (x, y) positions, moved back by the offset, into a dict of
+  (bx, by) -> bits, as taken by NodeFromLeafBlocks()."""
+  blocks = {}
+  get = blocks.get
+  # Blocks are 8x8 (LEAF_LEVEL is 3), with rows counting down from the top.
+  for (x, y) in positions:
+    x -= offset_x
+    y -= offset_y
+    key = (x >> 3, y >> 3)
+    blocks[key] = get(key, 0) | (1 << (((7 - (y & 7)) << 3) + (x & 7)))
+  return blocks
+
+def _AddTiming(name, start):
+  """Adds the time since start to timings[name], as a call to name."""
+  timings[name] += time.time() - start
+  timedCalls[name] += 1
+
+def _NodeFromChildren(level, children):
+  """Builds a node from its [nw, ne, sw, se] children, None being empty."""
+  zero = Node.Zero(level - 1)
+  return Node.CanonicalNode(
+      level, *[zero if child is None else child for child in children])
+
+# Within a block moved east by s columns, the cells that stay in the block:
+# columns 0 to 7 - s of every row.
+_STAYING_COLUMNS = [sum(((1 << (8 - s)) - 1) << (8 * row) for row in range(8))
+                    for s in range(8)]
+
+def TranslatedNode(node, dx, dy):
+  """Returns node with every cell moved by (dx, dy), in the coordinates of
+  Node.Draw(), as a node centered on the same point. Works a block at a time
+  (see LeafBlocks()), so the time follows the live blocks, however far they
+  move."""
+  (qx, sx) = (dx >> 3, dx & 7)
+  (qy, sy) = (dy >> 3, dy & 7)
+  blocks = {}
+  get = blocks.get
+  for ((bx, by), bits) in LeafBlocks(node):
+    columns = [(bx, bits)]
+    if sx:
+      # The columns pushed past the east edge go to the next block east.
+      staying = _STAYING_COLUMNS[sx]
+      columns = [(bx, (bits & staying) << sx),
+                 (bx + 1, (bits & ~staying) >> (8 - sx))]
+    for (x, part) in columns:
+      # Rows count down from the top, so north is towards the low bits, and
+      # the top sy rows go to the next block north.
+      rows = [(by, part >> (8 * sy))]
+      if sy:
+        rows.append((by + 1, (part & ((1 << (8 * sy)) - 1)) << (8 * (8 - sy))))
+      for (y, moved) in rows:
+        if moved:
+          key = (x + qx, y + qy)
+          blocks[key] = get(key, 0) | moved
+  return NodeFromLeafBlocks(blocks)
+
+
+################################################################################
+# Cycle detection. Nodes are canonical, so the same cells in the same place are
+# the same root object, and the same cells anywhere are the same node once
+# moved to a fixed corner. A World that has settled into a still life, an
+# oscillator or a spaceship can then answer for any later generation by
+# arithmetic instead of stepping.
+
+def _PrimeFactors(n, limit=1 << 16):
+  """Returns the distinct prime factors of n, except that whatever is left
+  once those below limit are divided out is given as a single factor, which
+  may not be prime."""
+  factors = []
+  d = 2
+  while d < limit and d * d <= n:
+    if n % d == 0:
+      factors.append(d)
+      while n % d == 0:
+        n //= d
+    d += 1 if d == 2 else 2
+  if n > 1:
+    factors.append(n)
+  return factors
+
+# A world that repeats itself: from generation start on, every period
+# generations it is the same cells moved by (dx, dy).
+Cycle = collections.namedtuple('Cycle', ['start', 'period', 'dx', 'dy'])
+
+class CycleDetector:
+  """Remembers a fingerprint of the world at the last max_history generations
+  it has been seen, and spots a repeat.
+
+  Only numbers are kept, never the roots, so that the history costs nothing
+  at a node store collection: for each generation the size and corner of the
+  bounding box and the hash of the root (the same for the same cells in the
+  same place, nodes being canonical), and once asked for, the hash of its
+  shape - the root moved so its bounding box starts at (0,0) - which is the
+  same for the same cells anywhere. A changing pattern costs a Bounds() and a
+  dict lookup per generation seen; shapes are only worked out for roots the
+  size of one seen before, but elsewhere.
+
+  Equal fingerprints make a candidate period, which is confirmed by running
+  the root forward and comparing (see _Confirm()). Still lifes and oscillators are found when seen
+  twice, spaceships when seen three times: the first time a shape is seen
+  its hash isn't known yet. With a max_history of 0 nothing is kept or
+  found.
+  """
+
+  def __init__(self, max_history=128):
+    self._max_history = max_history
+    self.Reset()
+
+  def Reset(self):
+    """Forgets everything seen, e.g. after the cells were edited."""
+    self.cycle = None
+    # generation -> [(width, height), corner, hash of the root, hash of the
+    # shape or None]; and the generations in order, and by size.
+    self._entries = {}
+    self._generations = collections.deque()
+    self._by_size = {}
+
+  def Observe(self, generation, root):
+    """Records root as the world at generation, which must be later than any
+    seen before. Returns the Cycle if there is one now, also kept as cycle,
+    starting at generation."""
+    if (self.cycle is not None or not self._max_history or
+        generation in self._entries):
+      return self.cycle
+    bounds = root.Bounds()
+    if bounds is None:
+      entry = [(0, 0), (0, 0), hash(root), None]
+    else:
+      (min_x, min_y, max_x, max_y) = bounds
+      entry = [(max_x - min_x, max_y - min_y), (min_x, min_y), hash(root), None]
+    size = entry[0]
+    for earlier in reversed(self._by_size.get(size, ())):
+      seen = self._entries[earlier]
+      if seen[1] == entry[1]:
+        if seen[2] != entry[2]:
+          continue
+      else:
+        if entry[3] is None:
+          (x, y) = entry[1]
+          entry[3] = hash(TranslatedNode(root, -x, -y))
+        if seen[3] != entry[3]:
+          continue
+      self.cycle = self._Confirm(generation, root, generation - earlier)
+      if self.cycle is not None:
+        break
+    self._entries[generation] = entry
+    self._generations.append(generation)
+    self._by_size.setdefault(size, []).append(generation)
+    if len(self._generations) > self._max_history:
+      oldest = self._generations.popleft()
+      size = self._entries.pop(oldest)[0]
+      self._by_size[size].remove(oldest)
+      if not self._by_size[size]:
+        del self._by_size[size]
+    return self.cycle
+
+  def _Confirm(self, generation, root, period):
+    """Returns the Cycle with the smallest period starting from root at
+    generation, if period is one, and None if not.
+
+    The periods up to max_history (or up to period, if less) are tried first,
+    a generation at a time, the first that fits being the smallest. Only if
+    none does is the root run forward the whole period, which may be as long
+    as a step of the world, and then cut down by each of its prime factors
+    in turn while it still fits - a few runs forward, however big the step.
+    """
+    later = root
+    for d in xrange(1, min(period, self._max_history) + 1):
+      later = later.ForwardN(1)
+      moved = self._Moved(root, later)
+      if moved is not None:
+        return Cycle(generation, d, *moved)
+    if period <= self._max_history:
+      return None
+    moved = self._Moved(root, root.ForwardN(period))
+    if moved is None:
+      return None
+    for factor in _PrimeFactors(period):
+      while period % factor == 0:
+        shorter = self._Moved(root, root.ForwardN(period // factor))
+        if shorter is None:
+          break
+        (period, moved) = (period // factor, shorter)
+    return Cycle(generation, period, *moved)
+
+  @staticmethod
+  def _Moved(earlier, later):
+    """Returns (dx, dy) if the root later is the root earlier moved by (dx,
+    dy), and None if it isn't."""
+    (bounds, later_bounds) = (earlier.Bounds(), later.Bounds())
+    if bounds is None or later_bounds is None:
+      return (0, 0) if bounds == later_bounds else None
+    (min_x, min_y, max_x, max_y) = bounds
+    (later_x, later_y, later_max_x, later_max_y) = later_bounds
+    if (max_x - min_x, max_y - min_y) != (later_max_x - later_x,
+                                          later_max_y - later_y):
+      return None
+    if (TranslatedNode(earlier, -min_x, -min_y) is not
+        TranslatedNode(later, -later_x, -later_y)):
+      return None
+    return (later_x - min_x, later_y - min_y)
 
 
 ################################################################################
@@ -382,24 +1579,120 @@ class World:
   happening.
   """
 
-  def __init__(self, positions):
+  # Draw through a NumPy pixel buffer (see life_render) when NumPy is there.
+  # Without it, or with this False, each live cell is filled separately.
+  use_pixel_buffer = True
+  # With the pixel buffer, put the view together from cached tiles (see
+  # life_render.TileCache), so that views of nodes drawn before - when paused,
+  # panning, or looking at repeated structures - are mostly blits.
+  use_tile_cache = True
+  # How many of the generations seen as the world is stepped to remember, to
+  # spot it repeating itself (see CycleDetector); 0 turns that off.
+  cycle_history = 128
+
+  def __init__(self, positions, stepper=None):
     """Initialize the world. Positions is a list of coordinates in the world
-    that should be set to true, as (x,y) tuples."""
+    that should be set to true, as (x,y) tuples. stepper, if given, runs the
+    world forward in place of Node.ForwardN: stepper.ForwardN(node, n) (see
+    life_parallel.ParallelEngine)."""
     self._root = World.FillNode(set(positions))
+    self._stepper = stepper
     self._view_center = [0, 0]
     self._view_size = 5  # How many pixels across is each cell?
+    # Zoomed out past one pixel per cell, how many cells across is each pixel?
+    # Always a power of two, and only more than 1 when _view_size is 1.
+    self._cells_per_pixel = 1
     self._iteration_count = 0
+    # What the world looked like as it was stepped, to spot it repeating
+    # itself.
+    self._cycles = CycleDetector(self.cycle_history)
+    # The root last drawn from tiles and how (see DrawChanges()), or None.
+    self._drawn = None
+    node_store.AddRootSource(self)
+
+  def LiveRoots(self):
+    """The Nodes this world needs to survive a node store collection. The
+    root last drawn is one, so that DrawChanges() finds the parts that have
+    not changed to be the same nodes."""
+    drawn = self._drawn
+    roots = [self._root]
+    if drawn is not None:
+      roots.append(drawn[0])
+    return roots
+
+  @classmethod
+  def Load(cls, name, stepper=None):
+    """Returns a world holding the pattern in file name, read straight into a
+    node (see life_load) rather than through a list of positions. A macrocell
+    file, as from Save(), also sets the generation."""
+    import life_load
+    world = cls([], stepper)
+    (world._root, world._iteration_count) = life_load.Load(name)
+    return world
+
+  def Save(self, name, comments=()):
+    """Saves the world to file name in Golly's macrocell format, each unique
+    node once, however many cells they make up. Load() reads it back."""
+    import life_load
+    with open(name, 'w') as f:
+      life_load.WriteMacrocell(f, self._root, self._iteration_count, comments)
+
+  def Checkpoint(self, name, source=None, target=None):
+    """Saves the world, and every node and cached result in the node store, to
+    file name (see life_checkpoint), for Resume() to carry on from warm. source
+    and target identify the run: the pattern it started from and the
+    generation it is stepping to."""
+    import life_checkpoint
+    life_checkpoint.Save(name, self._root, self._iteration_count,
+                         source=source, target=target)
+
+  @classmethod
+  def Resume(cls, name, stepper=None, source=None, target=None):
+    """Returns the world saved by Checkpoint() to file name, with the results
+    cached when it was saved put back in the node store. Raises UsageError if
+    it was saved with a different source or target."""
+    import life_checkpoint
+    world = cls([], stepper)
+    (world._root, world._iteration_count) = life_checkpoint.Load(
+        name, source=source, target=target)
+    return world
 
   @classmethod
   def FillNode(cls, positions):
-    """Turns a set of positions into a node hierarchy."""
+    """Turns a set of positions into a node hierarchy; see _FillNode()."""
+    start = time.time()
+    try:
+      return cls._FillNode(positions)
+    finally:
+      _AddTiming('fill_node', start)
+
+  @classmethod
+  def _FillNode(cls, positions):
+    """Turns a set of positions into a node hierarchy.
+
+    The cells are put into the blocks of the leaves at LEAF_LEVEL, and the
+    node is built from those bottom up (see NodeFromLeafBlocks()), so the work
+    follows the number of cells rather than the area around them, and empty
+    regions cost nothing. With NumPy, big sets are sorted into their blocks,
+    and the nodes built from them, by life_dense.NodeFromBlockColumns().
+    """
     if not positions:
-      return ([0,0], Node.Zero(1))
+      return Node.Zero(1)
 
-    min_x = min(map(lambda a: a[0], positions))
-    max_x = max(map(lambda a: a[0], positions))
-    min_y = min(map(lambda a: a[1], positions))
-    max_y = max(map(lambda a: a[1], positions))
+    cells = None
+    if len(positions) >= NUMPY_FILL_MIN:
+      try:
+        import life_dense
+        cells = life_dense.PositionArray(positions)
+        (min_x, min_y) = [int(value) for value in cells.min(axis=0)]
+        (max_x, max_y) = [int(value) for value in cells.max(axis=0)]
+      except ImportError:
+        pass
+    if cells is None:
+      min_x = min(x for (x, y) in positions)
+      max_x = max(x for (x, y) in positions)
+      min_y = min(y for (x, y) in positions)
+      max_y = max(y for (x, y) in positions)
     center_x = (max_x + min_x) // 2
     center_y = (max_y + min_y) // 2
     width = max_x - min_x + 1
@@ -410,24 +1703,48 @@ class World:
               center_x + (node_size >> 1),
               center_y - (node_size >> 1) + 1,
               center_y + (node_size >> 1))
-    root = cls._NodeFromPositionsAndBounds(positions, levels, bounds)
+    if levels <= LEAF_LEVEL:
+      return cls._NodeFromPositionsAndBounds(positions, levels, bounds)
+    # In the coordinates of Node.Draw(), the node's cells run from -size/2 to
+    # size/2 - 1.
+    offset_x = center_x + 1
+    offset_y = center_y + 1
+    # Nodes never make cycles, and with hundreds of thousands of new ones the
+    # cycle collector would walk the growing store over and over.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+      if cells is None:
+        root = NodeFromLeafBlocks(
+            PositionBlocks(positions, offset_x, offset_y))
+      else:
+        root = life_dense.NodeFromBlockColumns(*life_dense.BlockColumns(
+            cells[:, 0] - offset_x, cells[:, 1] - offset_y))
+    finally:
+      if collecting:
+        gc.enable()
+    while root._level < levels:
+      root = root.Expand()
     return root
 
   @classmethod
   def _NodeFromPositionsAndBounds(cls, positions, level, bounds):
     """Builds a Node at the specified level using the cells in positions that
-    fall within the given bounds.
+    fall within the given bounds. Checks every cell in bounds, so FillNode()
+    only uses this for leaves.
     """
     inner_size = 2**(level-1)
     assert bounds[0] + 2*inner_size - 1 == bounds[1]
     assert bounds[2] + 2*inner_size - 1 == bounds[3]
-    if level == 1:
-      return Node.CanonicalNode(
-          1,
-          1 if (bounds[0], bounds[3]) in positions else 0,
-          1 if (bounds[1], bounds[3]) in positions else 0,
-          1 if (bounds[0], bounds[2]) in positions else 0,
-          1 if (bounds[1], bounds[2]) in positions else 0)
+    if level <= LEAF_LEVEL:
+      width = 2*inner_size
+      bits = 0
+      for row in range(width):
+        y = bounds[3] - row
+        for col in range(width):
+          if (bounds[0] + col, y) in positions:
+            bits |= 1 << (row*width + col)
+      return node_store.CanonicalLeaf(level, bits)
     else:
       return Node.CanonicalNode(
           level,
@@ -468,34 +1785,208 @@ class World:
       pass
 
   def Iterate(self, num_generations):
-    """Updates the state of the current world by n generations."""
-    self._root = self._root.ForwardN(num_generations)
+    """Updates the state of the current world by n generations. Once the world
+    has repeated itself (see Cycle()), whole periods are skipped by moving the
+    cells rather than stepping them, so any generation costs at most a period
+    of steps."""
+    start = time.time()
+    cycle = self._cycles.Observe(self._iteration_count, self._root)
     self._iteration_count += num_generations
+    if cycle is not None:
+      (laps, num_generations) = divmod(num_generations, cycle.period)
+      if laps and (cycle.dx or cycle.dy):
+        self._root = TranslatedNode(self._root, laps * cycle.dx,
+                                    laps * cycle.dy)
+    if num_generations:
+      if self._stepper is not None:
+        self._root = self._stepper.ForwardN(self._root, num_generations)
+      else:
+        self._root = self._root.ForwardN(num_generations)
+      self._cycles.Observe(self._iteration_count, self._root)
+    _AddTiming('forward', start)
+    node_store.MaybeCollect()
+
+  def Cycle(self):
+    """Returns the Cycle the world has been seen to repeat, or None."""
+    return self._cycles.cycle
+
+  def FindCycle(self, max_generations=1024):
+    """Steps the world a generation at a time, for up to max_generations,
+    until it repeats itself. Returns the Cycle, or None if it hasn't. Periods
+    up to cycle_history are found once they have been seen twice, or for a
+    spaceship three times (see CycleDetector)."""
+    for i in xrange(max_generations):
+      if self._cycles.cycle is not None:
+        break
+      self.Iterate(1)
+    return self._cycles.Observe(self._iteration_count, self._root)
+
+  def Cells(self):
+    """Returns the live cells as (x, y) positions, in the coordinates
+    Node.Draw() uses for the root."""
+    cells = []
+    size = 2**(self._root._level-1)
+    self._root.Draw((-size, size-1, -size, size-1),
+                    lambda x, y: cells.append((x, y)))
+    return cells
+
+  def Population(self):
+    """Returns the number of live cells."""
+    return self._root.Population()
+
+  def GetCell(self, x, y):
+    """Returns 1 if the cell at (x, y), in the coordinates of Cells(), is
+    alive and 0 if not, in time that follows the level of the root."""
+    return self._root.GetCell(x, y)
+
+  def SetCell(self, x, y, alive=True):
+    """Sets the cell at (x, y), in the coordinates of Cells(); see
+    SetCells()."""
+    self.SetCells([(x, y)], alive)
+
+  def SetCells(self, positions, alive=True):
+    """Makes the cells at positions, in the coordinates of Cells(), alive (or
+    dead, without alive). Only the paths from the root down to them are
+    rebuilt (see Node.SetCells()), and the root is expanded around its center
+    for cells beyond it, so the coordinates of the rest never move. Not while
+    a Simulation is stepping the world."""
+    positions = list(positions)
+    if not positions:
+      return
+    root = self._root
+    half = 1 << (root._level - 1)
+    if alive:
+      farthest = max(max(x, -1 - x, y, -1 - y) for (x, y) in positions)
+      while farthest >= half:
+        root = root.Expand()
+        half <<= 1
+    else:
+      # Cells beyond the root are dead already.
+      positions = [(x, y) for (x, y) in positions
+                   if -half <= x < half and -half <= y < half]
+    self._root = root.SetCells(positions, alive)
+    self._cycles.Reset()
+
+  def CellsIn(self, bounds):
+    """Yields the live cells within bounds, (min_x, max_x, min_y, max_y) in
+    the coordinates of Cells(), block by block. Only the leaves that overlap
+    bounds are visited."""
+    (min_x, max_x, min_y, max_y) = bounds
+    (bxs, bys, bits) = LeafColumns(self._root, (min_x >> 3, max_x >> 3,
+                                                min_y >> 3, max_y >> 3))
+    for (bx, by, block) in zip(bxs, bys, bits):
+      while block:
+        low = block & -block
+        block ^= low
+        cell = low.bit_length() - 1
+        x = (bx << 3) + (cell & 7)
+        y = (by << 3) + 7 - (cell >> 3)
+        if min_x <= x <= max_x and min_y <= y <= max_y:
+          yield (x, y)
+
+  def Region(self, bounds):
+    """Returns the cells within bounds, as for CellsIn(), as a NumPy array of
+    booleans indexed [x - min_x, y - min_y]. Needs NumPy."""
+    import life_dense
+    return life_dense.Rasterise(self._root, bounds)
+
+  def BoundingBox(self):
+    """Returns (min_x, min_y, max_x, max_y) of the live cells, in the
+    coordinates of Cells(), or None if there are none."""
+    return self._root.Bounds()
+
+  def Stats(self, exact_memory=False):
+    """Returns a life_stats.Stats: what the engine has done so far, and the
+    state of this world and the node store now."""
+    import life_stats
+    return life_stats.Stats(self, exact_memory=exact_memory)
 
   def ShiftView(self, direction, step_size):
     """Shifts the current view by a number of screen pixels."""
+    import pygame
     # view_center is in terms of cells, so shift by the corresponding number of
     # cells instead.
-    cells = step_size // self._view_size
-    if direction == K_UP:
+    cells = step_size * self._cells_per_pixel // self._view_size
+    if direction == pygame.K_UP:
       self._view_center[1] -= cells
-    elif direction == K_DOWN:
+    elif direction == pygame.K_DOWN:
       self._view_center[1] += cells
-    elif direction == K_RIGHT:
+    elif direction == pygame.K_RIGHT:
       self._view_center[0] += cells
-    elif direction == K_LEFT:
+    elif direction == pygame.K_LEFT:
       self._view_center[0] -= cells
 
   def ZoomOut(self):
-    self._view_size = max(1, self._view_size - 1)
+    if self._view_size > 1:
+      self._view_size -= 1
+    else:
+      self._cells_per_pixel <<= 1
 
   def ZoomIn(self):
-    self._view_size += 1
+    if self._cells_per_pixel > 1:
+      self._cells_per_pixel >>= 1
+    else:
+      self._view_size += 1
 
-  def Draw(self, screen_width, screen_height, screen):
+  def Draw(self, screen_width, screen_height, screen, root=None):
     """Draws the current world to the screen. Uses self._view_center and
-    self._view_size to specify the location and zoom level.
+    self._view_size to specify the location and zoom level. root, if given,
+    is drawn in place of the current root (see Simulation.Snapshot()).
     """
+    start = time.time()
+    self._Draw(screen_width, screen_height, screen, root)
+    _AddTiming('draw', start)
+
+  def DrawChanges(self, screen_width, screen_height, screen, root=None):
+    """Brings screen, as the last Draw() or DrawChanges() left it, up to date
+    with root (by default the current root), redrawing only the tiles that
+    have changed (see life_render.DrawChangedTiles()). Returns the rectangles
+    of the screen changed, for pygame.display.update(), or None if the whole
+    screen has to be drawn with Draw() instead: when there are no tiles, the
+    view or screen has changed since, or the root has grown or shrunk."""
+    start = time.time()
+    if root is None:
+      root = self._root
+    life_render = self._Renderer()
+    view = self._DrawnView(screen_width, screen_height, screen)
+    if (life_render is None or not self.use_tile_cache or
+        self._drawn is None or self._drawn[1] != view):
+      return None
+    rects = life_render.DrawChangedTiles(
+        screen, self._drawn[0], root, self._view_center, self._view_size,
+        self._cells_per_pixel.bit_length() - 1, (screen_width, screen_height))
+    if rects is not None:
+      self._drawn = (root, view)
+    _AddTiming('draw', start)
+    return rects
+
+  def _DrawnView(self, screen_width, screen_height, screen):
+    """What has to stay the same for DrawChanges() to build on a frame."""
+    return (tuple(self._view_center), self._view_size, self._cells_per_pixel,
+            (screen_width, screen_height), id(screen))
+
+  def _Draw(self, screen_width, screen_height, screen, root):
+    import pygame
+    if root is None:
+      root = self._root
+    self._drawn = None
+    life_render = self._Renderer()
+    if life_render is not None and self.use_tile_cache:
+      life_render.DrawTiles(screen, root, self._view_center,
+                            self._view_size,
+                            self._cells_per_pixel.bit_length() - 1,
+                            (screen_width, screen_height))
+      self._drawn = (root, self._DrawnView(screen_width, screen_height,
+                                           screen))
+      return
+    if self._cells_per_pixel > 1:
+      self._DrawZoomedOut(screen_width, screen_height, screen, root,
+                          life_render)
+      return
+    if life_render is not None:
+      self._DrawPixelBuffer(screen_width, screen_height, screen, root,
+                            life_render)
+      return
     # + 2 for rounding here and the // 2 that follows.
     view_width = screen_width // self._view_size + 2
     view_height = screen_height // self._view_size + 2
@@ -518,12 +2009,250 @@ class World:
 
     # The bounds passed in assume the Node is rooted at 0,0. DrawCell will take
     # care of translating back to screen space and applying the view offsets.
-    self._root.Draw(view_bounds, DrawCell)
+    root.Draw(view_bounds, DrawCell)
+
+  def _Renderer(self):
+    """Returns the life_render module, or None to draw cell by cell."""
+    if not self.use_pixel_buffer:
+      return None
+    try:
+      import life_render
+    except ImportError:
+      return None
+    return life_render
+
+  def _DrawPixelBuffer(self, screen_width, screen_height, screen, root,
+                       life_render):
+    """Draws the world by rasterising the cells in view into a buffer and
+    blitting it to the screen once, scaled up to _view_size."""
+    import life_dense
+    pixels = self._view_size
+    (center_x, center_y) = self._view_center
+    # Every cell at least partly on screen. Cell (center_x, center_y) has its
+    # top left corner at the middle of the screen.
+    half_width = screen_width // 2
+    half_height = screen_height // 2
+    bounds = (center_x - (half_width + pixels - 1) // pixels,
+              center_x + (screen_width - half_width - 1) // pixels,
+              center_y - (half_height + pixels - 1) // pixels,
+              center_y + (screen_height - half_height - 1) // pixels)
+    cells = life_dense.Rasterise(root, bounds)
+    life_render.DrawCells(screen, cells,
+                          (half_width + (bounds[0] - center_x) * pixels,
+                           half_height + (bounds[2] - center_y) * pixels),
+                          pixels)
+
+  def _DrawZoomedOut(self, screen_width, screen_height, screen, root,
+                     life_render=None):
+    """Draws the world at _cells_per_pixel cells across each pixel, with each
+    pixel shaded by how many of its cells are live."""
+    level = self._cells_per_pixel.bit_length() - 1
+    cells_per_block = 1 << (2 * level)
+    center_x = self._view_center[0] >> level
+    center_y = self._view_center[1] >> level
+    half_width = screen_width // 2
+    half_height = screen_height // 2
+    view_bounds = (center_x - half_width,
+                   center_x + screen_width - half_width - 1,
+                   center_y - half_height,
+                   center_y + screen_height - half_height - 1)
+    if life_render is not None:
+      life_render.DrawBlocks(screen, root, view_bounds, level, (0, 0))
+      return
+    def DrawBlock(bx, by, population):
+      """Helper method to draw a block as a pixel, from light grey for a
+      single live cell to black for a full block."""
+      shade = 192 - 192 * population // cells_per_block
+      screen.set_at((half_width + bx - center_x, half_height + by - center_y),
+                    (shade, shade, shade))
+    root.DrawBlocks(view_bounds, level, DrawBlock)
+
+
+################################################################################
+class Simulation:
+  """Runs a World forward in a background thread, so that drawing and input
+  never wait for a step, however long it takes.
+
+  Game asks for generations with Request(), and draws whatever Snapshot()
+  returns: the root and generation of the latest finished step. Roots are
+  immutable, so a snapshot stays valid while the next step is worked out.
+  There is back pressure: one step runs while at most one more request waits
+  for it, and anything asked for beyond that is refused, so the requests can
+  never run away from the steps.
+
+  While the thread runs, only it may build nodes (CanonicalNode and its spare
+  node are not safe to share), and the world is its to step. Snapshots are
+  prepared so that drawing them builds none: they are at least
+  LEAF_LEVEL + 2, and the empty nodes up to their level already exist.
+  """
+
+  def __init__(self, world):
+    self._world = world
+    self._condition = threading.Condition()
+    self._snapshot = (Simulation._Drawable(world._root),
+                      world._iteration_count)
+    # The generation requests have asked for, and the one the running step
+    # will reach.
+    self._requested = world._iteration_count
+    self._stepping_to = world._iteration_count
+    # (generation, generations, seconds) for the latest finished step.
+    self._last_step = None
+    self._stopped = False
+    node_store.AddRootSource(self)
+    self._thread = threading.Thread(target=self._Run, name='Simulation')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def LiveRoots(self):
+    """The snapshot being drawn must survive collections by the thread."""
+    return (self._snapshot[0],)
+
+  @classmethod
+  def _Drawable(cls, root):
+    """root, expanded if need be so that it can be drawn without building any
+    nodes (see World.Draw())."""
+    while root._level < LEAF_LEVEL + 2:
+      root = root.Expand()
+    Node.Zero(root._level)
+    return root
+
+  def Snapshot(self):
+    """Returns (root, generation) for the latest finished step."""
+    return self._snapshot
+
+  def Requested(self):
+    """The generation asked for so far."""
+    return self._requested
+
+  def LastStep(self):
+    """Returns (generation, generations, seconds) for the latest finished
+    step: the generation it reached, how many it ran and how long that took,
+    or None before the first."""
+    return self._last_step
+
+  def Request(self, num_generations):
+    """Asks for the world to be run forward num_generations more. Returns
+    False, and asks for nothing, if a request is already waiting."""
+    with self._condition:
+      if self._stopped or self._requested != self._stepping_to:
+        return False
+      self._requested += num_generations
+      self._condition.notify_all()
+      return True
+
+  def WaitUntilIdle(self, timeout=None):
+    """Waits for the snapshot to catch up with the requests. Returns whether
+    it has."""
+    deadline = None if timeout is None else time.time() + timeout
+    with self._condition:
+      while self._snapshot[1] != self._requested:
+        if deadline is None:
+          self._condition.wait()
+          continue
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        self._condition.wait(remaining)
+      return self._snapshot[1] == self._requested
+
+  def Stop(self, wait=True):
+    """Stops the thread once the running step is done, waiting for that with
+    wait. The world may be stepped directly again afterwards."""
+    with self._condition:
+      self._stopped = True
+      self._condition.notify_all()
+    if wait:
+      self._thread.join()
+
+  def _Run(self):
+    world = self._world
+    try:
+      while True:
+        with self._condition:
+          while self._requested == self._stepping_to and not self._stopped:
+            self._condition.wait()
+          if self._stopped:
+            return
+          self._stepping_to = self._requested
+        start = time.time()
+        generations = self._stepping_to - world._iteration_count
+        world.Iterate(generations)
+        snapshot = (Simulation._Drawable(world._root), world._iteration_count)
+        last_step = (snapshot[1], generations, time.time() - start)
+        with self._condition:
+          self._snapshot = snapshot
+          self._last_step = last_step
+          self._condition.notify_all()
+    except:
+      # Stopped without waiting, the program can exit in the middle of a
+      # step, tearing down the modules the step is using.
+      if not self._stopped:
+        raise
+
+
+################################################################################
+class Hyperspeed:
+  """Chooses how many generations each step of an interactive run takes, to
+  get as far as a frame allows without tuning the speed by hand.
+
+  Steps are powers of two, which ForwardN() takes in a single _Forward() at
+  one level, so they reuse the cached results best. The step doubles while
+  one takes under half of budget seconds, and halves once one takes more
+  than that, so it settles where a step just fits in a frame.
+  """
+
+  def __init__(self, budget=1.0 / 30, exponent=0):
+    self.budget = budget
+    self.exponent = exponent
+    # The generation last recorded, and (time, generation) over the last
+    # couple of seconds for Rate().
+    self._generation = None
+    self._samples = collections.deque()
+
+  def Step(self):
+    """The generations to ask for next."""
+    return 1 << self.exponent
+
+  def Record(self, generation, generations, seconds):
+    """Notes a finished step: the generation it reached, how many it ran and
+    how long that took. A step already recorded is ignored."""
+    if generation == self._generation:
+      return
+    self._generation = generation
+    now = time.time()
+    self._samples.append((now, generation))
+    while len(self._samples) > 2 and now - self._samples[1][0] >= 2:
+      self._samples.popleft()
+    if generations != self.Step():
+      # Not a step of ours: one asked for by hand, or several together.
+      return
+    if seconds > self.budget:
+      self.exponent = max(0, self.exponent - 1)
+    elif seconds < self.budget / 2:
+      self.exponent += 1
+
+  def Rate(self):
+    """The generations per second achieved over the last couple of seconds,
+    or 0 until there are two steps to go on."""
+    if len(self._samples) < 2:
+      return 0.0
+    ((start, first), (end, last)) = (self._samples[0], self._samples[-1])
+    if end <= start:
+      return 0.0
+    return (last - first) / (end - start)
 
 
 ################################################################################
 class Game:
-  def __init__(self, size, world):
+  def __init__(self, size, world, background=True, hud=False,
+               stats_file=None, hyperspeed=False):
+    """Shows world in a window of size (width, height). With background, the
+    world is stepped by a Simulation thread, and the window shows the latest
+    generation finished; otherwise each step is taken inside the frame. With
+    hud, life_stats' summary is shown over the view, and with stats_file, the
+    stats are saved there as JSON on quitting. With hyperspeed, the speed is
+    chosen by a Hyperspeed rather than by hand."""
+    import pygame
     # Width and height of the main screen.
     (self._width, self._height) = size
     self._screen = pygame.display.set_mode(size)
@@ -540,56 +2269,178 @@ class Game:
     self._paused = False
     # World to iterate.
     self._world = world
+    self._simulation = Simulation(world) if background else None
+    # The (displayed, requested) generations last shown in the caption.
+    self._caption = None
+    # Whether the stats are shown, the lines shown and the Stats they were
+    # worked out from.
+    self._hud = hud
+    self._hud_lines = []
+    self._hud_stats = None
+    self._hud_font = None
+    # Whether the screen has the stats on it, and so needs drawing afresh.
+    self._hud_drawn = False
+    self._stats_file = stats_file
+    # Chooses the steps while hyperspeed is on, or None.
+    self._hyperspeed = Hyperspeed() if hyperspeed else None
 
   def ProcessEvent(self, event):
     """Handle a single 'event' - like a key press, mouse click, etc."""
+    import pygame
     if event.type == pygame.QUIT:
-      sys.exit()
+      self.Quit()
     elif event.type == pygame.KEYDOWN:
-      if (event.key == K_DOWN or event.key == K_UP or
-          event.key == K_LEFT or event.key == K_RIGHT):
+      if (event.key == pygame.K_DOWN or event.key == pygame.K_UP or
+          event.key == pygame.K_LEFT or event.key == pygame.K_RIGHT):
         # Pan.
         self._world.ShiftView(event.key, max(self._width, self._height) // 20)
-      elif event.key == K_MINUS or event.key == K_KP_MINUS:
+      elif event.key == pygame.K_MINUS or event.key == pygame.K_KP_MINUS:
         # Slow down.
+        self._LeaveHyperspeed()
         if (self._generations_per_update > 1):
           self._generations_per_update >>= 1
         else:
           self._ticks_per_update <<= 1
-      elif event.key == K_EQUALS or event.key == K_KP_PLUS:
+      elif event.key == pygame.K_EQUALS or event.key == pygame.K_KP_PLUS:
         # Speed up.
+        self._LeaveHyperspeed()
         if self._ticks_per_update > 1:
           self._ticks_per_update >>= 1
         else:
           self._generations_per_update <<= 1
-      elif event.key == K_SPACE:
+      elif event.key == pygame.K_SPACE:
         # Pause.
         self._paused = not self._paused
-      elif event.key == K_PAGEDOWN:
+      elif event.key == pygame.K_PAGEDOWN:
         # Zoom in.
         self._world.ZoomIn()
-      elif event.key == K_PAGEUP:
+      elif event.key == pygame.K_PAGEUP:
         # Zoom out.
         self._world.ZoomOut()
-      elif event.key == K_q and (pygame.key.get_mods() & KMOD_CTRL):
+      elif event.key == pygame.K_h:
+        # Show or hide the stats.
+        self._hud = not self._hud
+      elif event.key == pygame.K_f:
+        # Hyperspeed, starting from the speed set by hand.
+        if self._hyperspeed is None:
+          self._hyperspeed = Hyperspeed(
+              exponent=self._generations_per_update.bit_length() - 1)
+        else:
+          self._LeaveHyperspeed()
+      elif (event.key == pygame.K_q and
+            pygame.key.get_mods() & pygame.KMOD_CTRL):
         # Quit.
-        sys.exit()
+        self.Quit()
+
+  def _LeaveHyperspeed(self):
+    """Goes back to the speed set by hand, carrying on at the step that
+    hyperspeed had reached."""
+    if self._hyperspeed is not None:
+      self._generations_per_update = self._hyperspeed.Step()
+      self._ticks_per_update = 1
+      self._hyperspeed = None
+
+  def Quit(self):
+    # Without waiting for a step that may take a while yet.
+    if self._simulation is not None:
+      self._simulation.Stop(wait=False)
+    if self._stats_file is not None:
+      with open(self._stats_file, 'w') as f:
+        self._world.Stats().Dump(f)
+    sys.exit()
 
   def Draw(self):
-    self._screen.fill((255,255,255))  # White
-    self._world.Draw(self._width, self._height, self._screen)
-    pygame.display.flip()
+    """Draws the latest generation. Where the last frame can be built on,
+    only the parts of the screen that have changed are drawn and updated
+    (see World.DrawChanges()), so a frame costs what has changed rather than
+    the population; otherwise, and while the stats are shown over the view,
+    the whole screen is."""
+    import pygame
+    if self._simulation is None:
+      root = None
+      generations = (self._world._iteration_count,) * 2
+    else:
+      (root, generation) = self._simulation.Snapshot()
+      generations = (generation, self._simulation.Requested())
+    rects = None
+    if not self._hud and not self._hud_drawn:
+      rects = self._world.DrawChanges(self._width, self._height, self._screen,
+                                      root)
+    if rects is None:
+      self._screen.fill((255,255,255))  # White
+      self._world.Draw(self._width, self._height, self._screen, root)
+      self._hud_drawn = self._hud
+      if self._hud:
+        self._DrawHud()
+      pygame.display.flip()
+    elif rects:
+      pygame.display.update(rects)
+    caption = generations
+    if self._hyperspeed is not None:
+      caption += (self._hyperspeed.exponent, self._hyperspeed.Rate())
+    if caption != self._caption:
+      # Behind when the steps can't keep up with the speed asked for.
+      self._caption = caption
+      if generations[0] == generations[1]:
+        text = 'Life - generation %d' % generations[0]
+      else:
+        text = 'Life - generation %d of %d' % generations
+      if self._hyperspeed is not None:
+        text += ' - hyperspeed, 2^%d per step, %.4g per second' % caption[2:]
+      pygame.display.set_caption(text)
+
+  def _DrawHud(self):
+    """Draws life_stats' summary over the top left of the view. It is worked
+    out again every half second, from the counts and timings since the last
+    time."""
+    import pygame
+    import life_stats
+    if self._hud_stats is None or time.time() - self._hud_stats.time >= 0.5:
+      stats = life_stats.Stats(self._world)
+      shown = stats if self._hud_stats is None else stats - self._hud_stats
+      self._hud_lines = shown.Summary()
+      self._hud_stats = stats
+    if self._hud_font is None:
+      self._hud_font = pygame.font.Font(None, 20)
+    y = 4
+    for line in self._hud_lines:
+      text = self._hud_font.render(line, True, (0, 0, 0), (255, 255, 224))
+      self._screen.blit(text, (4, y))
+      y += text.get_height()
 
   def Tick(self):
     if self._paused:
       return
     if self._ticks_till_next > 1:
       self._ticks_till_next -= 1
-    else:
+    elif self._hyperspeed is not None:
+      self._HyperspeedTick()
+    elif self._simulation is None:
       self._world.Iterate(self._generations_per_update)
       self._ticks_till_next = self._ticks_per_update
+    elif self._simulation.Request(self._generations_per_update):
+      self._ticks_till_next = self._ticks_per_update
+
+  def _HyperspeedTick(self):
+    """Takes, or asks for, a step of the size Hyperspeed chooses, every
+    frame. Each step is timed by itself: the next is only asked for once the
+    last has finished."""
+    hyperspeed = self._hyperspeed
+    if self._simulation is None:
+      start = time.time()
+      step = hyperspeed.Step()
+      self._world.Iterate(step)
+      hyperspeed.Record(self._world._iteration_count, step,
+                        time.time() - start)
+      return
+    last_step = self._simulation.LastStep()
+    if last_step is not None:
+      hyperspeed.Record(*last_step)
+    if self._simulation.Snapshot()[1] == self._simulation.Requested():
+      self._simulation.Request(hyperspeed.Step())
 
   def RunGameLoop(self):
+    import pygame
     while True:
       # Process any pending events.
       for event in pygame.event.get():
@@ -606,44 +2457,212 @@ class Game:
 
 
 def ParseFile(name):
-  """Load a file. We support pretty lax syntax; ! or # start a comment, . on a
-  line is a dead cell, anything else is live. Line lengths do not need to
-  match. This can load basic .cells and .lif files, although nothing complicated
-  is supported.
+  """Load a file as a list of live positions. RLE, Life 1.05 (with its #P
+  blocks) and Life 1.06 are recognised by their headers; anything else is read
+  with pretty lax syntax: ! or # start a comment, . on a line is a dead cell,
+  anything else is live, and line lengths do not need to match. See life_load,
+  and World.Load() for big patterns.
   """
-  with open(name) as f:
-    result = []
+  import life_load
+  return life_load.Positions(name)
 
-    row = 0
-    for line in f:
-      if not line or line[0] == '!' or line[0] == '#':
-        continue
 
-      col = 0
-      for c in line:
-        if c == '\r' or c == '\n':
-          break
-        if c != '.':
-          result.append((row,col))
-        col += 1
-      row -= 1
-    return result
+def WriteFile(name, positions, comments=()):
+  """Save positions, as returned by ParseFile(), as a plain text pattern that
+  ParseFile() reads back the same (up to where it sits). comments are written
+  first, as ! lines.
+  """
+  with open(name, 'w') as f:
+    for comment in comments:
+      f.write('!%s\n' % comment)
+    if not positions:
+      return
+    top = max(row for (row, col) in positions)
+    bottom = min(row for (row, col) in positions)
+    left = min(col for (row, col) in positions)
+    rows = {}
+    for (row, col) in positions:
+      rows.setdefault(row, []).append(col - left)
+    for row in xrange(top, bottom - 1, -1):
+      cols = rows.get(row, ())
+      line = ['.'] * (max(cols) + 1 if cols else 0)
+      for col in cols:
+        line[col] = 'O'
+      f.write(''.join(line) + '\n')
+
+
+def MakeStepper(engine):
+  """Returns the stepper for World to use for the named engine: 'hashlife',
+  'dense' or 'auto' (see life_dense)."""
+  if engine == 'hashlife':
+    return None
+  import life_dense
+  if engine == 'dense':
+    return life_dense.DenseEngine()
+  elif engine == 'auto':
+    return life_dense.AutoEngine()
+  raise UsageError('Unknown engine %r' % engine)
+
+
+def RunHeadless(name, num_generations, output_dir='.', engine='hashlife',
+                output_format='cells', checkpoint=None, checkpoint_every=None,
+                find_cycles=None):
+  """Runs the pattern in file name forward num_generations without a display,
+  and saves the result, with its population and bounding box, as a pattern in
+  output_dir: a plain text .cells file, or with an output_format of 'mc' a
+  macrocell file, which stays small however many cells there are. Returns the
+  path saved to, the population and the bounding box (see
+  World.BoundingBox()).
+
+  With a checkpoint file, the world is checkpointed there every
+  checkpoint_every generations (or just at the end), and if the file is
+  already there the run resumes from it, with its cached results. The
+  checkpoint records the pattern and num_generations, and resuming from one
+  saved by any other run raises UsageError.
+
+  With find_cycles, the first find_cycles generations are stepped one at a
+  time to look for the pattern settling down (see World.FindCycle()); if it
+  does, the rest of the run is worked out from the cycle at once.
+  """
+  stepper = MakeStepper(engine)
+  with open(name, 'rb') as f:
+    source = f.read()
+  if checkpoint is not None and os.path.exists(checkpoint):
+    world = World.Resume(checkpoint, stepper, source, num_generations)
+  else:
+    world = World.Load(name, stepper)
+  if find_cycles:
+    world.FindCycle(min(find_cycles,
+                        num_generations - world._iteration_count))
+  while world._iteration_count < num_generations:
+    step = num_generations - world._iteration_count
+    if checkpoint_every:
+      step = min(step, checkpoint_every)
+    world.Iterate(step)
+    if checkpoint is not None:
+      world.Checkpoint(checkpoint, source, num_generations)
+  population = world.Population()
+  bounding_box = world.BoundingBox()
+  base = os.path.splitext(os.path.basename(name))[0]
+  path = os.path.join(output_dir, '%s.%d.%s' % (base, num_generations,
+                                                output_format))
+  comments = [
+      'Name: %s after %d generations' % (base, num_generations),
+      'Generations: %d' % num_generations,
+      'Population: %d' % population,
+      'Bounding box: %s' % (' '.join(map(str, bounding_box))
+                            if bounding_box else 'empty'),
+  ]
+  cycle = world.Cycle()
+  if cycle is not None:
+    comments.append('Cycle: period %d, moving (%d, %d), from generation %d' %
+                    (cycle.period, cycle.dx, cycle.dy, cycle.start))
+  if output_format == 'mc':
+    world.Save(path, comments)
+  else:
+    WriteFile(path, world.Cells(), comments)
+  return (path, population, bounding_box)
+
+
+def CheckpointPath(checkpoint, name):
+  """Returns the checkpoint file for pattern file name in a run of several
+  patterns sharing the --checkpoint path checkpoint: ck.bin becomes
+  ck.backrake.bin for backrake.cells."""
+  (root, extension) = os.path.splitext(checkpoint)
+  base = os.path.splitext(os.path.basename(name))[0]
+  return '%s.%s%s' % (root, base, extension)
+
+
+def main(argv=None):
+  parser = optparse.OptionParser(
+      usage='%prog [pattern]\n'
+            '       %prog --generations N [--output-dir DIR] pattern ...')
+  parser.add_option('--generations', type='int', default=None,
+                    help='Run headless: step each pattern N generations, save '
+                    'the results and exit, without opening a window.')
+  parser.add_option('--output-dir', default='.',
+                    help='Where --generations saves the results.')
+  parser.add_option('--checkpoint', default=None,
+                    help='With --generations, checkpoint the run to this '
+                    'file, and resume from it if it is already there. With '
+                    'several patterns, each gets its own file, named after '
+                    'the pattern (ck.bin becomes ck.backrake.bin).')
+  parser.add_option('--checkpoint-every', type='int', default=None,
+                    help='Generations between checkpoints (by default, only '
+                    'at the end).')
+  parser.add_option('--format', default='cells', choices=['cells', 'mc'],
+                    help='What --generations saves: cells (plain text, the '
+                    'default) or mc (macrocell, for huge patterns).')
+  parser.add_option('--engine', default='hashlife',
+                    choices=['hashlife', 'dense', 'auto'],
+                    help='hashlife (the default), dense, or auto to choose '
+                    'between them as the pattern runs.')
+  parser.add_option('--find-cycles', type='int', default=None, metavar='N',
+                    help='With --generations, step the first N generations '
+                    'one at a time to spot the pattern settling into a still '
+                    'life, oscillator or spaceship, and skip ahead if it '
+                    'does.')
+  parser.add_option('--stats', default=None, metavar='FILE',
+                    help='Save what the engine did (see life_stats) to FILE '
+                    'as JSON: on quitting, or with --generations a list with '
+                    'an entry for each pattern.')
+  parser.add_option('--hud', action='store_true', default=False,
+                    help='Show the stats over the view (H toggles them).')
+  parser.add_option('--hyperspeed', action='store_true', default=False,
+                    help='Start with the speed chosen to fit each step in a '
+                    'frame (F toggles it).')
+  (options, args) = parser.parse_args(argv)
 
+  if options.generations is not None:
+    if not args:
+      parser.error('--generations needs at least one pattern file')
+    import life_stats
+    runs = []
+    for name in args:
+      checkpoint = options.checkpoint
+      if checkpoint is not None and len(args) > 1:
+        checkpoint = CheckpointPath(checkpoint, name)
+      life_stats.Reset()
+      try:
+        (path, population, bounding_box) = RunHeadless(
+            name, options.generations, options.output_dir, options.engine,
+            options.format, checkpoint, options.checkpoint_every,
+            options.find_cycles)
+      except UsageError as e:
+        parser.error(str(e))
+      print '%s: population %d, bounding box %s, saved to %s' % (
+          name, population, bounding_box, path)
+      stats = life_stats.Stats().ToDict()
+      stats.update(pattern=name, generation=options.generations,
+                   population=population)
+      runs.append(stats)
+    if options.stats is not None:
+      with open(options.stats, 'w') as f:
+        json.dump(runs, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        f.write('\n')
+    return 0
 
-def main():
+  import pygame
   pygame.init()
   pygame.key.set_repeat(150, 50)
   size = (1200, 1000)
 
-  if len(sys.argv) > 1:
-    initial_state = ParseFile(sys.argv[1])
+  stepper = MakeStepper(options.engine)
+  if args:
+    world = World.Load(args[0], stepper)
   else:
     # Infinite zig-zag
     initial_state = [(-2,-2), (-2,-1), (-2,2), (-1,-2), (-1,1), (0,-2), (0,1),
                      (0,2), (1,0), (2,-2), (2,0), (2,1), (2,2)]
-  game = Game(size, World(initial_state))
+    world = World(initial_state, stepper)
+  game = Game(size, world, hud=options.hud, stats_file=options.stats,
+              hyperspeed=options.hyperspeed)
   game.RunGameLoop()
 
 
 if __name__ == "__main__":
-  main()
+  # Run main() from the module everything else imports as life, not from this
+  # __main__ copy, so that there is only the one node store.
+  import life
+  sys.exit(life.main())
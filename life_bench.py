@@ -0,0 +1,800 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the HashLife engine in life.py.
+
+Run with the names of the benchmarks to run (all of them by default):
+  python life_bench.py [--list] [name ...]
+
+--json FILE saves the results, and --baseline FILE compares them with ones
+saved earlier, e.g. from the commit before a change:
+  python life_bench.py --json before.json examples
+  ...
+  python life_bench.py --baseline before.json examples
+The examples benchmark runs every bundled pattern and a few soups, each in a
+new interpreter, and checks the results against a simple reference simulator
+for the shorter runs, so an optimisation can be shown to be both faster and
+still correct.
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import glob
+import json
+import math
+import optparse
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import life
+import life_dense
+import life_parallel
+import life_stats
+
+try:
+  import resource
+except ImportError:
+  # Not on Windows; peak memory is left out there.
+  resource = None
+
+ZIG_ZAG = [(-2,-2), (-2,-1), (-2,2), (-1,-2), (-1,1), (0,-2), (0,1), (0,2),
+           (1,0), (2,-2), (2,0), (2,1), (2,2)]
+
+
+def ForwardCacheCounters():
+  return (life.numForwardCacheHits, life.numForwardComputed)
+
+
+def ForwardCacheReport(before, seconds):
+  """Summarises the _Forward cache activity since the counters in before."""
+  hits = life.numForwardCacheHits - before[0]
+  computed = life.numForwardComputed - before[1]
+  total = hits + computed
+  return {
+      'seconds': seconds,
+      'forward_hits': hits,
+      'forward_computed': computed,
+      'forward_hit_rate': float(hits) / total if total else 0.0,
+  }
+
+
+def BenchMixedSteps():
+  """Repeats a mix of small and huge steps from the same blinker and zig-zag,
+  steps which used to evict each other's cached results."""
+  blinker = life.Node.CanonicalNode(
+      2,
+      life.Node.CanonicalNode(1, 0, 0, 1, 1),
+      life.Node.CanonicalNode(1, 0, 0, 1, 0),
+      life.Node.Zero(1), life.Node.Zero(1))
+  zig_zag = life.World.FillNode(ZIG_ZAG)
+  def Round():
+    for n in (1, 2**32+1, 2, 2**20):
+      blinker.ForwardN(n)
+    for n in (1000, 1, 999, 4096, 3):
+      zig_zag.ForwardN(n)
+  # The first round does the real work; the later ones should be served from
+  # the cache entirely.
+  Round()
+  before = ForwardCacheCounters()
+  start = time.time()
+  for i in range(5):
+    Round()
+  return ForwardCacheReport(before, time.time() - start)
+
+
+def BenchUiSpeedChanges():
+  """Follows Game's speed controls: _generations_per_update doubles up to 2^12
+  and then halves back down, twice, iterating a few times at each speed."""
+  world = life.World(life.ParseFile('examples/backrake.cells'))
+  speeds = [2**i for i in range(13)]
+  speeds = speeds + speeds[::-1]
+  before = ForwardCacheCounters()
+  start = time.time()
+  for n in speeds + speeds:
+    for i in range(3):
+      world.Iterate(n)
+  return ForwardCacheReport(before, time.time() - start)
+
+
+def BenchZigZag():
+  """TestPerformance's zig-zag, run forward a million generations."""
+  node = life.World.FillNode(ZIG_ZAG)
+  before = ForwardCacheCounters()
+  start = time.time()
+  node.ForwardN(1000000)
+  return ForwardCacheReport(before, time.time() - start)
+
+
+def BenchLevel2BaseCase():
+  """Computes the successor of every possible level-2 node once."""
+  level1 = [life.Node.CanonicalNode(1, (code >> 3) & 1, (code >> 2) & 1,
+                                    (code >> 1) & 1, code & 1)
+            for code in range(16)]
+  nodes = [life.Node.CanonicalNode(2, level1[index >> 12],
+                                   level1[(index >> 8) & 15],
+                                   level1[(index >> 4) & 15],
+                                   level1[index & 15])
+           for index in xrange(65536)]
+  for node in nodes:
+    node._next = None
+  before = ForwardCacheCounters()
+  start = time.time()
+  for node in nodes:
+    node._Forward()
+  return ForwardCacheReport(before, time.time() - start)
+
+
+def BenchDeepLevels():
+  """Runs patterns forward 2^60 generations from cold caches, with the
+  recursive and the iterative _Forward."""
+  result = {}
+  backrake = life.ParseFile('examples/backrake.cells')
+  for (name, positions) in (('zig_zag', ZIG_ZAG), ('backrake', backrake)):
+    node = life.World.FillNode(set(positions))
+    while node._level < 62:
+      node = node.Expand()
+    node = node.Expand().Expand()
+    for (engine, forward) in (('recursive', node._Forward),
+                              ('iterative', node._ForwardIterative)):
+      life.node_store.ForgetResults()
+      start = time.time()
+      forward()
+      result['%s_%s_seconds' % (name, engine)] = time.time() - start
+  return result
+
+
+# Process counts to compare in BenchParallel, set by --processes.
+PARALLEL_PROCESSES = [1, 2, 4]
+
+
+def BenchParallel():
+  """Runs the Cordership gun forward 4096 generations from cold caches,
+  serially and with life_parallel at each of PARALLEL_PROCESSES."""
+  positions = life.ParseFile('examples/3enginecordershipgun.cells')
+  result = {}
+  life.node_store.ForgetResults()
+  start = time.time()
+  life.World(positions).Iterate(4096)
+  serial = time.time() - start
+  result['serial_seconds'] = serial
+  for processes in PARALLEL_PROCESSES:
+    life.node_store.ForgetResults()
+    engine = life_parallel.ParallelEngine(processes=processes)
+    try:
+      start = time.time()
+      life.World(positions, stepper=engine).Iterate(4096)
+      seconds = time.time() - start
+    finally:
+      engine.Close()
+    result['processes_%02d' % processes] = (
+        'seconds=%.2f speedup=%.2f tasks=%d nodes_sent=%d nodes_received=%d' %
+        (seconds, serial / seconds, engine.num_tasks, engine.nodes_sent,
+         engine.nodes_received))
+  return result
+
+
+def ExamplePatterns():
+  """The bundled example patterns, as (name, path) pairs."""
+  here = os.path.dirname(os.path.abspath(__file__))
+  paths = sorted(glob.glob(os.path.join(here, 'examples', '*.cells')))
+  return [(os.path.splitext(os.path.basename(path))[0], path)
+          for path in paths]
+
+
+def BenchNodeMemory():
+  """Runs each bundled example for 1024 generations in a fresh node store and
+  reports what the nodes cost."""
+  result = {}
+  for (name, path) in ExamplePatterns():
+    life.node_store.Collect()
+    world = life.World(life.ParseFile(path))
+    world.Iterate(1024)
+    store = life.node_store
+    result[name] = 'nodes=%d bytes_per_node=%.1f megabytes=%.2f' % (
+        len(store), store.BytesPerNode(), store.MemoryUsage() / 1e6)
+    del world
+  return result
+
+
+def RandomSoup(size, density=0.4, seed=1):
+  """A size x size square of random cells, the same every run."""
+  rand = random.Random(seed)
+  return [(x, y) for x in range(size) for y in range(size)
+          if rand.random() < density]
+
+
+def BenchDenseSoup():
+  """Runs a 256x256 soup forward 400 generations, 4 at a time, with HashLife,
+  the dense engine and the automatic choice between them, each from a fresh
+  node store."""
+  soup = RandomSoup(256)
+  result = {}
+  for (name, make_stepper) in (('hashlife', lambda: None),
+                               ('dense', life_dense.DenseEngine),
+                               ('auto', life_dense.AutoEngine)):
+    life.node_store.Collect()
+    life.node_store.ForgetResults()
+    world = life.World(soup, stepper=make_stepper())
+    start = time.time()
+    for i in range(100):
+      world.Iterate(4)
+    result[name + '_seconds'] = time.time() - start
+    del world
+  return result
+
+
+def BenchFrameTime():
+  """Times World.Draw on a 1200x1000 view full of a 50% soup, at a few zoom
+  levels: cell by cell ('fill'), through the NumPy pixel buffer ('buffer'),
+  and from tiles - all new each frame, as when running a chaotic pattern
+  ('tiles_new'), cached ('tiles_paused'), or cached with the view moving 20
+  pixels a frame ('tiles_panning'). Frames need to be under 33ms for Game's
+  30 frames per second."""
+  import pygame
+  import life_render
+  (width, height) = (1200, 1000)
+  soup = [(x - width // 2, y - height // 2)
+          for (x, y) in RandomSoup(max(width, height), density=0.5)]
+  world = life.World(soup)
+  screen = pygame.Surface((width, height))
+  result = {}
+  for (mode, view_size, cells_per_pixel) in (
+      ('fill', 1, 1), ('buffer', 1, 1), ('buffer', 2, 1), ('buffer', 5, 1),
+      ('buffer', 1, 4), ('tiles_new', 1, 1), ('tiles_new', 1, 4),
+      ('tiles_paused', 1, 1), ('tiles_paused', 5, 1), ('tiles_paused', 1, 4),
+      ('tiles_panning', 1, 1), ('tiles_panning', 5, 1)):
+    world.use_pixel_buffer = mode != 'fill'
+    world.use_tile_cache = mode.startswith('tiles')
+    world._view_size = view_size
+    world._cells_per_pixel = cells_per_pixel
+    world._view_center = [0, 0]
+    world.Draw(width, height, screen)
+    frames = 2 if mode == 'fill' else 10
+    start = time.time()
+    for i in range(frames):
+      if mode == 'tiles_new':
+        life_render.tile_cache.Clear()
+      elif mode == 'tiles_panning':
+        world._view_center[0] += 20 // view_size
+      screen.fill((255, 255, 255))
+      world.Draw(width, height, screen)
+    name = '%s_pixels_%d_cells_%d_ms' % (mode, view_size, cells_per_pixel)
+    result[name] = 1000 * (time.time() - start) / frames
+  return result
+
+
+def BenchBackgroundFrames():
+  """Follows Game's loop for 3 seconds over a 256x256 soup, asking for 64
+  generations a frame, with each step taken inside the frame and with a
+  Simulation thread. Reports the longest and mean gap between frames - the
+  input latency - and how many generations were shown."""
+  import pygame
+  soup = RandomSoup(256)
+  screen = pygame.Surface((1200, 1000))
+  result = {}
+  for background in (False, True):
+    life.node_store.Collect()
+    life.node_store.ForgetResults()
+    world = life.World(soup)
+    simulation = life.Simulation(world) if background else None
+    clock = pygame.time.Clock()
+    gaps = []
+    last = start = time.time()
+    while last - start < 3:
+      clock.tick(30)
+      if simulation is None:
+        world.Iterate(64)
+        root = None
+        generation = world._iteration_count
+      else:
+        simulation.Request(64)
+        (root, generation) = simulation.Snapshot()
+      screen.fill((255, 255, 255))
+      world.Draw(1200, 1000, screen, root)
+      now = time.time()
+      gaps.append(now - last)
+      last = now
+    if simulation is not None:
+      simulation.Stop()
+    name = 'background' if background else 'in_frame'
+    result[name + '_max_frame_ms'] = 1000 * max(gaps)
+    result[name + '_mean_frame_ms'] = 1000 * sum(gaps) / len(gaps)
+    result[name + '_generations'] = generation
+    del world
+  return result
+
+
+def WriteRle(path, size, density=0.4):
+  """Writes a size x size RandomSoup() to path as RLE."""
+  live = set(RandomSoup(size, density))
+  with open(path, 'w') as f:
+    f.write('x = %d, y = %d, rule = B3/S23\n' % (size, size))
+    line = ''
+    for row in range(size):
+      items = []
+      column = 0
+      while column < size:
+        alive = (row, column) in live
+        end = column
+        while end < size and ((row, end) in live) == alive:
+          end += 1
+        count = end - column
+        items.append(('%d' % count if count > 1 else '') +
+                     ('o' if alive else 'b'))
+        column = end
+      items.append('$' if row < size - 1 else '!')
+      for item in items:
+        if len(line) + len(item) > 70:
+          f.write(line + '\n')
+          line = ''
+        line += item
+    f.write(line + '\n')
+
+
+def BenchLoadRle():
+  """Loads a 2048x2048 soup saved as RLE - a few megabytes - with World.Load,
+  and a 512x512 one both that way and through ParseFile's positions and
+  World.FillNode."""
+  import tempfile
+  output_dir = tempfile.mkdtemp()
+  result = {}
+  try:
+    for size in (512, 2048):
+      path = os.path.join(output_dir, 'soup%d.rle' % size)
+      WriteRle(path, size)
+      result['soup_%d_megabytes' % size] = os.path.getsize(path) / 1e6
+      life.node_store.Collect()
+      start = time.time()
+      life.World.Load(path)
+      result['soup_%d_load_seconds' % size] = time.time() - start
+      if size <= 512:
+        life.node_store.Collect()
+        start = time.time()
+        life.World(life.ParseFile(path))
+        result['soup_%d_positions_seconds' % size] = time.time() - start
+  finally:
+    shutil.rmtree(output_dir)
+  return result
+
+
+def BenchCheckpoint():
+  """Runs the Cordership gun 4096 generations from a fresh node store and
+  checkpoints it, then resumes into another fresh store, as a restarted run
+  would, and takes the same steps again."""
+  import tempfile
+  import life_checkpoint
+  output_dir = tempfile.mkdtemp()
+  old_store = life.node_store
+  result = {}
+  try:
+    path = os.path.join(output_dir, 'gun.ckpt')
+    life.node_store = life.NodeStore(life.DEFAULT_MAX_NODES)
+    start = time.time()
+    world = life.World.Load('examples/3enginecordershipgun.cells')
+    world.Iterate(4096)
+    result['cold_seconds'] = time.time() - start
+    start = time.time()
+    world.Checkpoint(path)
+    result['save_seconds'] = time.time() - start
+    result['nodes'] = len(life.node_store)
+    result['megabytes'] = os.path.getsize(path) / 1e6
+    life.node_store = life.NodeStore(life.DEFAULT_MAX_NODES)
+    start = time.time()
+    life.World.Resume(path)
+    result['resume_seconds'] = time.time() - start
+    start = time.time()
+    life.World.Load('examples/3enginecordershipgun.cells').Iterate(4096)
+    result['warm_seconds'] = time.time() - start
+    # Into a store in use, every node is looked up first.
+    start = time.time()
+    life_checkpoint.Load(path)
+    result['merge_seconds'] = time.time() - start
+  finally:
+    life.node_store = old_store
+    shutil.rmtree(output_dir)
+  return result
+
+
+def BenchFillNode():
+  """Builds nodes with World.FillNode from a million cells: a 2000x2000 soup,
+  and cells scattered over a 65536x65536 square, with and without NumPy. For
+  comparison, times the cell by cell recursion FillNode used to do, which
+  looks at every cell in the square, on a 256x256 soup and on 100 cells
+  scattered over 2048x2048."""
+  rand = random.Random(3)
+  dense = set(RandomSoup(2000, density=0.25))
+  sparse = set()
+  while len(sparse) < 1000000:
+    sparse.add((rand.getrandbits(16), rand.getrandbits(16)))
+  result = {'dense_cells': len(dense), 'sparse_cells': len(sparse)}
+  numpy_min = life.NUMPY_FILL_MIN
+  try:
+    for (name, positions) in (('dense', dense), ('sparse', sparse)):
+      for (suffix, minimum) in (('', numpy_min),
+                                ('_python', len(positions) + 1)):
+        life.NUMPY_FILL_MIN = minimum
+        life.node_store.Collect()
+        start = time.time()
+        life.World.FillNode(positions)
+        result['%s%s_seconds' % (name, suffix)] = time.time() - start
+  finally:
+    life.NUMPY_FILL_MIN = numpy_min
+  for (name, positions) in (
+      ('old_dense_256', set(RandomSoup(256, density=0.25))),
+      ('old_sparse_100',
+       set((rand.getrandbits(11), rand.getrandbits(11)) for i in range(100)))):
+    min_x = min(x for (x, y) in positions)
+    max_x = max(x for (x, y) in positions)
+    min_y = min(y for (x, y) in positions)
+    max_y = max(y for (x, y) in positions)
+    levels = int(math.log(max(max_x - min_x, max_y - min_y) + 1, 2)) + 1
+    half = 1 << (levels - 1)
+    center_x = (max_x + min_x) // 2
+    center_y = (max_y + min_y) // 2
+    bounds = (center_x - half + 1, center_x + half,
+              center_y - half + 1, center_y + half)
+    life.node_store.Collect()
+    start = time.time()
+    life.World._NodeFromPositionsAndBounds(positions, levels, bounds)
+    result[name + '_seconds'] = time.time() - start
+    life.node_store.Collect()
+    start = time.time()
+    life.World.FillNode(positions)
+    result[name.replace('old', 'new') + '_seconds'] = time.time() - start
+  return result
+
+
+def BenchCellAccess():
+  """Probes and edits single cells of a 1024x1024 soup: 10000 GetCell calls,
+  and 1000 SetCell calls one at a time, against rebuilding the world from its
+  cells once. Also reads a 256x256 region out as cells and as an array."""
+  rand = random.Random(19)
+  world = life.World(RandomSoup(1024, density=0.3))
+  size = 1 << (world._root._level - 1)
+  probes = [(rand.randint(-size, size - 1), rand.randint(-size, size - 1))
+            for i in range(10000)]
+  result = {}
+  start = time.time()
+  for (x, y) in probes:
+    world.GetCell(x, y)
+  result['get_cell_microseconds'] = (time.time() - start) / len(probes) * 1e6
+  start = time.time()
+  for (x, y) in probes[:1000]:
+    world.SetCell(x, y)
+  result['set_cell_microseconds'] = (time.time() - start) / 1000 * 1e6
+  cells = world.Cells()
+  start = time.time()
+  life.World(cells)
+  result['rebuild_seconds'] = time.time() - start
+  bounds = (-128, 127, -128, 127)
+  start = time.time()
+  list(world.CellsIn(bounds))
+  result['cells_in_256_seconds'] = time.time() - start
+  start = time.time()
+  world.Region(bounds)
+  result['region_256_seconds'] = time.time() - start
+  return result
+
+
+def BenchDirtyRedraw():
+  """Draws 20 generations of a 1200x1000 view, as Game does: each frame from
+  scratch ('full'), and by redrawing only the tiles that changed
+  ('changes'). The view is a field of blocks - a still life of some 300000
+  cells - with a few gliders crossing it, and again as a 50% soup where most
+  of the view changes every generation. Also reports the pixels updated per
+  frame."""
+  import pygame
+  (width, height) = (1200, 1000)
+  gliders = [(x + dx, y + dy) for (x, y) in ((-500, 400), (0, 0), (300, -200))
+             for (dx, dy) in ((1, 0), (2, 1), (0, 2), (1, 2), (2, 2))]
+  blocks = [(x + dx, y + dy)
+            for x in range(-width // 2, width // 2, 5)
+            for y in range(-height // 2, height // 2, 5)
+            if abs(x) > 40 or abs(y) > 40
+            for (dx, dy) in ((0, 0), (0, 1), (1, 0), (1, 1))]
+  soup = [(x - width // 2, y - height // 2)
+          for (x, y) in RandomSoup(max(width, height), density=0.5)]
+  screen = pygame.Surface((width, height))
+  result = {}
+  for (name, positions) in (('blocks', blocks + gliders), ('soup', soup)):
+    world = life.World(positions)
+    world._view_size = 1
+    roots = [life.Simulation._Drawable(world._root)]
+    for i in range(20):
+      world.Iterate(1)
+      roots.append(life.Simulation._Drawable(world._root))
+    for mode in ('full', 'changes'):
+      screen.fill((255, 255, 255))
+      world.Draw(width, height, screen, roots[0])
+      pixels = 0
+      start = time.time()
+      for root in roots[1:]:
+        rects = None
+        if mode == 'changes':
+          rects = world.DrawChanges(width, height, screen, root)
+        if rects is None:
+          screen.fill((255, 255, 255))
+          world.Draw(width, height, screen, root)
+          rects = [screen.get_rect()]
+        pixels += sum(rect.width * rect.height for rect in rects)
+      frames = len(roots) - 1
+      result['%s_%s_ms' % (name, mode)] = (1000 * (time.time() - start) /
+                                           frames)
+      result['%s_%s_pixels' % (name, mode)] = pixels // frames
+    del world
+  return result
+
+
+# The generations each pattern is run for by BenchExamples, set by
+# --generations, and the longest runs checked against ReferenceRun().
+EXAMPLE_GENERATIONS = [100, 1000, 10**6]
+REFERENCE_MAX_GENERATIONS = 1000
+# The soups BenchExamples runs alongside the examples, as (size, density,
+# seed).
+EXAMPLE_SOUPS = [(64, 0.4, 1), (64, 0.4, 2)]
+
+_NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+               if dx or dy]
+
+
+def ReferenceStep(cells):
+  """The set of cells a generation after the set cells, worked out the
+  simplest way there is, to check the engine against."""
+  counts = {}
+  get = counts.get
+  for (x, y) in cells:
+    for (dx, dy) in _NEIGHBOURS:
+      key = (x + dx, y + dy)
+      counts[key] = get(key, 0) + 1
+  return set(cell for (cell, count) in counts.iteritems()
+             if count == 3 or (count == 2 and cell in cells))
+
+
+def ReferenceRun(cells, num_generations):
+  cells = set(cells)
+  for i in xrange(num_generations):
+    cells = ReferenceStep(cells)
+  return cells
+
+
+def _PeakKilobytes():
+  if resource is None:
+    return None
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _RunExample(source, num_generations):
+  """Loads a pattern (or makes a soup, for a list of RandomSoup() arguments),
+  runs it forward, and measures the run. Run by RunExample() in a process of
+  its own, through --case."""
+  start = time.time()
+  if isinstance(source, list):
+    world = life.World(RandomSoup(*source))
+  else:
+    world = life.World.Load(source)
+  load_seconds = time.time() - start
+  initial = None
+  if num_generations <= REFERENCE_MAX_GENERATIONS:
+    initial = world.Cells()
+  life_stats.Reset()
+  rss_before = _PeakKilobytes()
+  start = time.time()
+  world.Iterate(num_generations)
+  seconds = time.time() - start
+  rss_after = _PeakKilobytes()
+  stats = world.Stats(exact_memory=True)
+  result = {
+      'load_seconds': load_seconds,
+      'seconds': seconds,
+      'population': world.Population(),
+      'nodes': stats.nodes,
+      'nodes_constructed': stats.Total('nodes_constructed'),
+      'forward_hit_rate': stats.ForwardHitRate(),
+      'canonical_hit_rate': stats.CanonicalHitRate(),
+      'collections': stats.collections,
+      'memory_bytes': stats.memory_bytes,
+      'peak_kilobytes': rss_after,
+      'peak_growth_kilobytes': (None if rss_after is None
+                                else rss_after - rss_before),
+      # Whether the cells match ReferenceRun(), or None if not checked.
+      'reference': None,
+  }
+  if initial is not None:
+    result['reference'] = (set(world.Cells()) ==
+                           ReferenceRun(initial, num_generations))
+  return result
+
+
+def RunExample(source, num_generations):
+  """Runs _RunExample() in a new Python interpreter, rather than a fork of
+  this one, so that no nodes, cached results or counters carry over from
+  whatever ran here before: the counts are the same run alone or after other
+  benchmarks."""
+  script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+  output = subprocess.check_output(
+      [sys.executable, script, '--case', json.dumps([source,
+                                                     num_generations])])
+  return json.loads(output)
+
+
+def BenchExamples():
+  """Runs each bundled example and each of EXAMPLE_SOUPS for each of
+  EXAMPLE_GENERATIONS, each run in a new interpreter (see RunExample()) so
+  that its counts and memory are its own. Reports the time to load and to
+  run, the population, the nodes built and kept, the cache hit rates, the
+  node store's memory and the process's peak, and for runs of up to
+  REFERENCE_MAX_GENERATIONS whether the cells match ReferenceRun()."""
+  cases = []
+  for (name, path) in ExamplePatterns():
+    cases.append((name, path))
+  for (size, density, seed) in EXAMPLE_SOUPS:
+    cases.append(('soup_%d_%d' % (size, seed), [size, density, seed]))
+  result = {}
+  mismatches = []
+  for (name, source) in cases:
+    for num_generations in EXAMPLE_GENERATIONS:
+      run = RunExample(source, num_generations)
+      prefix = '%s_%d' % (name, num_generations)
+      for (key, value) in run.iteritems():
+        result['%s_%s' % (prefix, key)] = value
+      if run['reference'] is False:
+        mismatches.append(prefix)
+  result['reference_mismatches'] = len(mismatches)
+  if mismatches:
+    print >>sys.stderr, 'Differs from the reference: %s' % ', '.join(
+        mismatches)
+  return result
+
+
+BENCHMARKS = [
+    ('mixed_steps', BenchMixedSteps),
+    ('ui_speed_changes', BenchUiSpeedChanges),
+    ('zig_zag', BenchZigZag),
+    ('level2_base_case', BenchLevel2BaseCase),
+    ('deep_levels', BenchDeepLevels),
+    ('parallel', BenchParallel),
+    ('node_memory', BenchNodeMemory),
+    ('dense_soup', BenchDenseSoup),
+    ('frame_time', BenchFrameTime),
+    ('background_frames', BenchBackgroundFrames),
+    ('load_rle', BenchLoadRle),
+    ('checkpoint', BenchCheckpoint),
+    ('fill_node', BenchFillNode),
+    ('cell_access', BenchCellAccess),
+    ('dirty_redraw', BenchDirtyRedraw),
+    ('examples', BenchExamples),
+]
+
+# Results that must not change from a baseline, and those where more is
+# better; for every other number, less is.
+_EXACT_SUFFIXES = ('_population', '_reference', '_mismatches')
+_HIGHER_SUFFIXES = ('_rate', '_per_second', '_speedup')
+# Changes smaller than these are noise, however large as a fraction.
+_NOISE = [('_seconds', 0.02), ('_ms', 1.0), ('_kilobytes', 1024)]
+
+
+def Revision():
+  """The git commit of the code being measured, or None."""
+  here = os.path.dirname(os.path.abspath(__file__))
+  try:
+    output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=here,
+                                     stderr=open(os.devnull, 'w'))
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return output.strip()
+
+
+def Compare(baseline, results, tolerance=0.2):
+  """Compares results, {benchmark: {key: value}}, with baseline ones in the
+  same form. Returns (lines, errors): a line for every number that has
+  moved by more than tolerance (as a fraction) for better or worse, and the
+  number of results that should not have changed at all but did."""
+  lines = []
+  errors = 0
+  for (name, result) in sorted(results.iteritems()):
+    before = baseline.get(name)
+    if before is None:
+      continue
+    for (key, value) in sorted(result.iteritems()):
+      old = before.get(key)
+      if old is None or value is None:
+        continue
+      if key.endswith(_EXACT_SUFFIXES):
+        if value != old:
+          lines.append('%s %s: %s, was %s - CHANGED' % (name, key, value, old))
+          errors += 1
+        continue
+      if (isinstance(value, bool) or
+          not isinstance(value, (int, long, float)) or not old):
+        continue
+      ratio = float(value) / old
+      if abs(ratio - 1) <= tolerance:
+        continue
+      if any(key.endswith(suffix) and abs(value - old) < noise
+             for (suffix, noise) in _NOISE):
+        continue
+      better = (ratio > 1) == key.endswith(_HIGHER_SUFFIXES)
+      lines.append('%s %s: %.4g, was %.4g (x%.2f, %s)' % (
+          name, key, value, old, ratio, 'better' if better else 'worse'))
+  return (lines, errors)
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [--list] [benchmark ...]')
+  parser.add_option('--list', action='store_true', default=False,
+                    help='List the available benchmarks and exit.')
+  parser.add_option('--processes', default=None,
+                    help='Comma separated process counts for the parallel '
+                    'benchmark, e.g. 4,8,16.')
+  parser.add_option('--generations', default=None,
+                    help='Comma separated generation counts for the examples '
+                    'benchmark, e.g. 100,1000,1000000.')
+  parser.add_option('--json', default=None, metavar='FILE',
+                    help='Save the results to FILE as JSON.')
+  parser.add_option('--baseline', default=None, metavar='FILE',
+                    help='Compare the results with ones saved by --json, '
+                    'and fail if a population or reference check differs.')
+  parser.add_option('--case', default=None, help=optparse.SUPPRESS_HELP)
+  parser.add_option('--tolerance', type='float', default=0.2,
+                    help='With --baseline, the fraction numbers may move by '
+                    'before they are reported (0.2 by default).')
+  (options, args) = parser.parse_args()
+  if options.case is not None:
+    # One run of the examples benchmark, for RunExample().
+    print json.dumps(_RunExample(*json.loads(options.case)))
+    return 0
+  if options.processes:
+    PARALLEL_PROCESSES[:] = [int(p) for p in options.processes.split(',')]
+  if options.generations:
+    EXAMPLE_GENERATIONS[:] = [int(n) for n in options.generations.split(',')]
+  names = [name for (name, unused_func) in BENCHMARKS]
+  if options.list:
+    print '\n'.join(names)
+    return 0
+  for name in args:
+    if name not in names:
+      parser.error('Unknown benchmark %r, try --list' % name)
+
+  results = {}
+  for (name, func) in BENCHMARKS:
+    if args and name not in args:
+      continue
+    result = func()
+    results[name] = result
+    print name
+    for key in sorted(result):
+      print '  %-34s %s' % (key, result[key])
+  status = 0
+  if any(result.get('reference_mismatches') for result in results.values()):
+    status = 1
+  if options.json is not None:
+    with open(options.json, 'w') as f:
+      json.dump({
+          'revision': Revision(),
+          'time': time.time(),
+          'python': platform.python_version(),
+          'platform': platform.platform(),
+          'benchmarks': results,
+      }, f, indent=2, sort_keys=True, separators=(',', ': '))
+      f.write('\n')
+  if options.baseline is not None:
+    with open(options.baseline) as f:
+      baseline = json.load(f)
+    (lines, errors) = Compare(baseline['benchmarks'], results,
+                              options.tolerance)
+    print 'against %s (%s)' % (options.baseline, baseline.get('revision'))
+    if not lines:
+      lines = ['no changes beyond %d%%' % (100 * options.tolerance)]
+    for line in lines:
+      print '  ' + line
+    if errors:
+      status = 1
+  return status
+
+
+if __name__ == "__main__":
+  sys.exit(main())
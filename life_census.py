@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Soup searches for life.py: runs batches of random (or given) starting
+patterns until they settle, and counts the objects they leave behind.
+
+Each soup is stepped by HashLife until its census - what it splits into and
+how many of each - is the same two checks running. Every soup in a process
+shares the one node store, with its cached results, so the debris soups have
+in common is only ever worked out once. With several processes, each worker
+has a node store of its own, kept warm from one batch of soups to the next:
+  python life_census.py --soups 10000 --processes 4 --output census.json
+
+Objects are found by splitting the live cells into groups no closer than
+three cells apart, which can't yet affect each other. Each group is run by
+itself to find its period and whether it moves; one made of pieces that
+never touch as they run, like two blocks a cell apart, counts as the pieces.
+Each object gets a code that is the same in every orientation and phase:
+  xs<population>_<shape>  a still life
+  xp<period>_<shape>      an oscillator
+  xq<period>_<shape>      a spaceship
+where the shape is the width and height of its smallest arrangement and its
+cells as a hex number. Well known objects also have a name (see NAMES).
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import hashlib
+import json
+import multiprocessing
+import optparse
+import random
+import sys
+import time
+
+import life
+
+# Longest period looked for in an object, and the soups' limits.
+MAX_PERIOD = 64
+MAX_GENERATIONS = 1 << 15
+# Generations between checks on whether a soup has settled: a multiple of
+# the common periods (1, 2, 3, 4, 5, 8 and 15), so a settled soup has the same
+# population at every check. Its census is only taken then, or every
+# CENSUS_EVERY checks for the rarer periods, since working out what is still
+# changing is the slow part.
+CHECK_EVERY = 120
+CENSUS_EVERY = 8
+
+# Objects worth calling by name, in ParseFile()'s plain text.
+NAMES = {
+    'block': ['OO', 'OO'],
+    'beehive': ['.OO.', 'O..O', '.OO.'],
+    'loaf': ['.OO.', 'O..O', '.O.O', '..O.'],
+    'boat': ['OO.', 'O.O', '.O.'],
+    'ship': ['OO.', 'O.O', '.OO'],
+    'tub': ['.O.', 'O.O', '.O.'],
+    'pond': ['.OO.', 'O..O', 'O..O', '.OO.'],
+    'long boat': ['OO..', 'O.O.', '.O.O', '..O.'],
+    'barge': ['.O..', 'O.O.', '.O.O', '..O.'],
+    'mango': ['.OO..', 'O..O.', '.O..O', '..OO.'],
+    'blinker': ['OOO'],
+    'toad': ['.OOO', 'OOO.'],
+    'beacon': ['OO..', 'OO..', '..OO', '..OO'],
+    'glider': ['.O.', '..O', 'OOO'],
+    'lightweight spaceship': ['.O..O', 'O....', 'O...O', 'OOOO.'],
+    'middleweight spaceship': ['...O..', '.O...O', 'O.....', 'O....O',
+                               'OOOOO.'],
+    'heavyweight spaceship': ['...OO..', '.O....O', 'O......', 'O.....O',
+                              'OOOOOO.'],
+    'pulsar': ['..OOO...OOO..', '.............', 'O....O.O....O',
+               'O....O.O....O', 'O....O.O....O', '..OOO...OOO..',
+               '.............', '..OOO...OOO..', 'O....O.O....O',
+               'O....O.O....O', 'O....O.O....O', '.............',
+               '..OOO...OOO..'],
+    'pentadecathlon': ['..O....O..', 'OO.OOOO.OO', '..O....O..'],
+}
+
+# Every cell within two of another is in the same object, and every cell
+# next to another in the same piece of one.
+_NEAR = [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3)
+         if dx or dy]
+_TOUCHING = [(dx, dy) for dx in range(-1, 2) for dy in range(-1, 2)
+             if dx or dy]
+
+# The eight ways to turn and flip a shape.
+_ORIENTATIONS = [
+    lambda x, y: (x, y), lambda x, y: (-x, y), lambda x, y: (x, -y),
+    lambda x, y: (-x, -y), lambda x, y: (y, x), lambda x, y: (-y, x),
+    lambda x, y: (y, -x), lambda x, y: (-y, -x),
+]
+
+# The codes of the shapes seen so far, by their cells moved to start at
+# (0,0): see Classify(). Like the node store, it stays warm from one soup to
+# the next.
+_codes = {}
+# Names by code, filled in on first use.
+_names = None
+
+
+def _Normalised(cells):
+  """cells moved so that their bounding box starts at (0,0), as a frozenset."""
+  min_x = min(x for (x, y) in cells)
+  min_y = min(y for (x, y) in cells)
+  return frozenset((x - min_x, y - min_y) for (x, y) in cells)
+
+
+def _ShapeCode(shape):
+  """The smallest encoding of shape over its eight orientations."""
+  best = None
+  for orient in _ORIENTATIONS:
+    cells = _Normalised([orient(x, y) for (x, y) in shape])
+    width = max(x for (x, y) in cells) + 1
+    height = max(y for (x, y) in cells) + 1
+    bits = sum(1 << (y * width + x) for (x, y) in cells)
+    code = (width * height, width, bits)
+    if best is None or code < best:
+      best = code
+  (area, width, bits) = best
+  return '%dx%d_%x' % (width, area // width, bits)
+
+
+def Classify(cells):
+  """Returns the codes of the objects made of cells, a list of (x, y): one
+  code, or one for each piece if it is made of pieces that don't touch as
+  they run. Returns None if by itself it doesn't repeat within MAX_PERIOD
+  generations. Codes are remembered for every phase, so each shape is only
+  run once."""
+  shape = _Normalised(cells)
+  if shape in _codes:
+    return _codes[shape]
+  world = life.World(shape)
+  # Spaceships are only spotted on coming round a third time.
+  cycle = world.FindCycle(2 * MAX_PERIOD)
+  if cycle is None or cycle.period > MAX_PERIOD:
+    _codes[shape] = None
+    return None
+  world = life.World(shape)
+  phases = [shape]
+  for i in range(cycle.period - 1):
+    world.Iterate(1)
+    phases.append(_Normalised(world.Cells()))
+  # The cells may only have settled into the cycle later on.
+  world.Iterate(1)
+  cells = world.Cells()
+  if not cells or _Normalised(cells) != shape:
+    _codes[shape] = None
+    return None
+  codes = _PieceCodes(shape, cycle.period)
+  if codes is None:
+    if cycle.dx or cycle.dy:
+      prefix = 'xq%d' % cycle.period
+    elif cycle.period > 1:
+      prefix = 'xp%d' % cycle.period
+    else:
+      prefix = 'xs%d' % len(shape)
+    codes = ('%s_%s' % (prefix, min(_ShapeCode(phase) for phase in phases)),)
+  for phase in phases:
+    _codes[phase] = codes
+  return codes
+
+
+def _PieceCodes(shape, period):
+  """The codes of the pieces of shape, a periodic object, if it has several
+  and running them apart gives the same cells as running them together for
+  a period; otherwise None."""
+  pieces = _Groups(shape, _TOUCHING)
+  if len(pieces) == 1:
+    return None
+  codes = ()
+  for piece in pieces:
+    piece_codes = Classify(piece)
+    if piece_codes is None:
+      return None
+    codes += piece_codes
+  # World() centers its cells, so they are set in the same place instead.
+  together = life.World([])
+  together.SetCells(shape)
+  apart = []
+  for piece in pieces:
+    apart.append(life.World([]))
+    apart[-1].SetCells(piece)
+  for i in range(period):
+    together.Iterate(1)
+    cells = set()
+    for world in apart:
+      world.Iterate(1)
+      cells.update(world.Cells())
+    if cells != set(together.Cells()):
+      return None
+  return tuple(sorted(codes))
+
+
+def Name(code):
+  """The name of the object with code, from NAMES, or the code itself."""
+  global _names
+  if _names is None:
+    _names = {}
+    for (name, rows) in NAMES.iteritems():
+      (code_for_name,) = Classify([(x, y) for (y, row) in enumerate(rows)
+                                   for (x, cell) in enumerate(row)
+                                   if cell == 'O'])
+      _names[code_for_name] = name
+  return _names.get(code, code)
+
+
+def Objects(cells):
+  """Splits cells, a list of (x, y), into lists of those within two cells of
+  each other, which can't yet have any effect on the rest."""
+  return _Groups(cells, _NEAR)
+
+
+def _Groups(cells, near):
+  """Splits cells into lists joined by the offsets in near."""
+  # Union-find over the cells.
+  parents = dict((cell, cell) for cell in cells)
+  def Find(cell):
+    root = cell
+    while parents[root] != root:
+      root = parents[root]
+    while parents[cell] != root:
+      (parents[cell], cell) = (root, parents[cell])
+    return root
+  for (x, y) in cells:
+    for (dx, dy) in near:
+      other = (x + dx, y + dy)
+      if other in parents:
+        (a, b) = (Find((x, y)), Find(other))
+        if a != b:
+          parents[a] = b
+  groups = {}
+  for cell in cells:
+    groups.setdefault(Find(cell), []).append(cell)
+  return groups.values()
+
+
+def WorldCensus(world):
+  """Counts the objects in world by code, or returns None if some of them
+  don't repeat by themselves yet."""
+  counts = {}
+  for cells in Objects(world.Cells()):
+    codes = Classify(cells)
+    if codes is None:
+      return None
+    for code in codes:
+      counts[code] = counts.get(code, 0) + 1
+  return counts
+
+
+def Settle(world, max_generations=MAX_GENERATIONS):
+  """Runs world CHECK_EVERY generations at a time until its census is the
+  same at two checks running. Returns the census, or None if it hasn't
+  settled by max_generations."""
+  previous = None
+  population = None
+  checks = 0
+  while world._iteration_count < max_generations:
+    world.Iterate(CHECK_EVERY)
+    checks += 1
+    counts = None
+    if world.Population() == population or checks % CENSUS_EVERY == 0:
+      counts = WorldCensus(world)
+      if counts is not None and counts == previous:
+        return counts
+    previous = counts
+    population = world.Population()
+  return None
+
+
+def RandomSoup(seed, index, size=16, density=0.5):
+  """Soup index of the search seed: a size x size square of random cells,
+  the same on every machine."""
+  digest = hashlib.sha256('%s/%d' % (seed, index)).hexdigest()
+  rand = random.Random(int(digest, 16))
+  return [(x, y) for x in range(size) for y in range(size)
+          if rand.random() < density]
+
+
+def RandomSoups(seed, count, size=16, density=0.5, start=0):
+  """Soup descriptions for Run(): count of RandomSoup()."""
+  return [('%s/%d' % (seed, index), (seed, index, size, density))
+          for index in xrange(start, start + count)]
+
+
+def _World(soup):
+  """The world for a soup description from RandomSoups(), or a pattern file
+  name."""
+  if isinstance(soup, tuple):
+    return life.World(RandomSoup(*soup))
+  return life.World.Load(soup)
+
+
+class Census:
+  """The objects left by a batch of soups; see the module docstring.
+
+  counts maps each object's code to how many were left in all, and
+  first_soups to the first soup found to leave one. unsettled lists the
+  soups that hadn't settled by the generation limit.
+  """
+
+  def __init__(self):
+    self.soups = 0
+    self.generations = 0
+    self.counts = {}
+    self.first_soups = {}
+    self.unsettled = []
+    self.seconds = 0.0
+
+  def Add(self, name, world, max_generations=MAX_GENERATIONS):
+    """Settles a soup's world and counts what it leaves."""
+    counts = Settle(world, max_generations)
+    self.soups += 1
+    self.generations += world._iteration_count
+    if counts is None:
+      self.unsettled.append(name)
+      return
+    for (code, count) in counts.iteritems():
+      self.counts[code] = self.counts.get(code, 0) + count
+      self.first_soups.setdefault(code, name)
+
+  def Merge(self, other):
+    """Adds in another Census, e.g. from another worker."""
+    self.soups += other.soups
+    self.generations += other.generations
+    for (code, count) in other.counts.iteritems():
+      self.counts[code] = self.counts.get(code, 0) + count
+    for (code, name) in other.first_soups.iteritems():
+      first = self.first_soups.get(code)
+      if first is None or _SoupOrder(name) < _SoupOrder(first):
+        self.first_soups[code] = name
+    self.unsettled.extend(other.unsettled)
+    self.unsettled.sort(key=_SoupOrder)
+
+  def SoupsPerSecond(self):
+    return self.soups / self.seconds if self.seconds else 0.0
+
+  def ToDict(self):
+    """The census as a dict ready for JSON, with a row per object, the most
+    common first."""
+    objects = [{'code': code, 'name': Name(code), 'count': count,
+                'first_soup': self.first_soups[code]}
+               for (code, count) in self.counts.iteritems()]
+    objects.sort(key=lambda row: (-row['count'], row['code']))
+    return {
+        'soups': self.soups,
+        'generations': self.generations,
+        'seconds': self.seconds,
+        'soups_per_second': self.SoupsPerSecond(),
+        'objects': objects,
+        'unsettled': self.unsettled,
+    }
+
+  def Dump(self, f):
+    """Writes ToDict() to the file f as JSON."""
+    json.dump(self.ToDict(), f, indent=2, sort_keys=True,
+              separators=(',', ': '))
+    f.write('\n')
+
+  def Summary(self, top=10):
+    """A few lines on the census, with the top most common objects."""
+    lines = ['%d soups in %.1f seconds, %.1f per second, %d unsettled' %
+             (self.soups, self.seconds, self.SoupsPerSecond(),
+              len(self.unsettled))]
+    for row in self.ToDict()['objects'][:top]:
+      lines.append('%8d %s' % (row['count'], row['name']))
+    return lines
+
+
+def _SoupOrder(name):
+  """Sorts soups from RandomSoups() by their index rather than as text."""
+  (seed, slash, index) = name.rpartition('/')
+  if slash and index.isdigit():
+    return (seed, int(index))
+  return (name, -1)
+
+
+def _CensusInWorker(task):
+  """Runs in a worker process: a Census of a batch of soups."""
+  (soups, max_generations) = task
+  census = Census()
+  for (name, soup) in soups:
+    census.Add(name, _World(soup), max_generations)
+  return census
+
+
+def Run(soups, processes=1, batch_size=16, max_generations=MAX_GENERATIONS):
+  """Takes a Census of soups: (name, description) pairs from RandomSoups(),
+  or pattern file names. With more than one process they are handed out in
+  batches of batch_size to a pool of workers."""
+  soups = [soup if isinstance(soup, tuple) else (soup, soup)
+           for soup in soups]
+  start = time.time()
+  census = Census()
+  if processes == 1:
+    census.Merge(_CensusInWorker((soups, max_generations)))
+  else:
+    pool = multiprocessing.Pool(processes)
+    try:
+      tasks = [(soups[i:i + batch_size], max_generations)
+               for i in xrange(0, len(soups), batch_size)]
+      for result in pool.imap_unordered(_CensusInWorker, tasks):
+        census.Merge(result)
+    finally:
+      pool.terminate()
+      pool.join()
+  census.seconds = time.time() - start
+  return census
+
+
+def main(argv=None):
+  parser = optparse.OptionParser(
+      usage='%prog [--soups N] [options] [pattern ...]')
+  parser.add_option('--soups', type='int', default=None,
+                    help='Random soups to run (1000 by default, none with '
+                    'pattern files given).')
+  parser.add_option('--seed', default='census',
+                    help='Names the random soups: the same seed gives the '
+                    'same soups.')
+  parser.add_option('--size', type='int', default=16,
+                    help='Width and height of the random soups.')
+  parser.add_option('--density', type='float', default=0.5,
+                    help='The fraction of random soup cells that are live.')
+  parser.add_option('--processes', type='int', default=None,
+                    help='Worker processes (one per CPU by default).')
+  parser.add_option('--max-generations', type='int', default=MAX_GENERATIONS,
+                    help='Give up on soups that have not settled by then.')
+  parser.add_option('--output', default=None, metavar='FILE',
+                    help='Save the census to FILE as JSON.')
+  (options, args) = parser.parse_args(argv)
+  count = options.soups
+  if count is None:
+    count = 0 if args else 1000
+  soups = list(args) + RandomSoups(options.seed, count, options.size,
+                                   options.density)
+  if not soups:
+    parser.error('No soups to run')
+  processes = options.processes or multiprocessing.cpu_count()
+  census = Run(soups, processes, max_generations=options.max_generations)
+  print '\n'.join(census.Summary())
+  if options.output is not None:
+    with open(options.output, 'w') as f:
+      census.Dump(f)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
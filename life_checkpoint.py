@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints for long runs of life.py: the whole node store, with every cached
+_Forward() result, the root and the generation, in one binary file.
+
+A restarted run that resumes from a checkpoint starts warm, with every step it
+had already worked out still cached, instead of paying for them all again:
+  world.Checkpoint('run.ckpt')
+  ...
+  world = life.World.Resume('run.ckpt')
+
+The file is little endian and made of columns, so that each one is read from
+the memory mapped file with a single copy rather than parsed:
+  header    magic, version, node count, result count, root, generation, the
+            SHA-256 of the source pattern and the generation the run is
+            stepping to (see Save())
+  levels    a uint16 per node
+  children  four uint32s per node: the positions of its nw, ne, sw and se
+            children, or for a leaf its bits, low 32 first
+  results   three columns: the node, the result node, and the level of the
+            step (see Node._Forward()) as a uint16
+Nodes are numbered by their position, children always before their parents.
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import life
+
+MAGIC = 'LIFECKPT'
+VERSION = 2
+
+# Magic, version, node count, result count, root, and the generation in two
+# halves: it may not fit in 64 bits. Then the source's digest (zeros for none),
+# whether there is a target, and the target in two halves.
+_HEADER = struct.Struct('<8sIIIIQQ32sIQQ')
+
+_NO_SOURCE = '\0' * 32
+
+
+def _Column(typecode, values):
+  column = array.array(typecode, values)
+  if sys.byteorder != 'little':
+    column.byteswap()
+  return column
+
+
+def _ReadColumn(typecode, data, start, count):
+  """Reads count values from data[start:], returning them and the end."""
+  column = array.array(typecode)
+  end = start + count * column.itemsize
+  column.fromstring(data[start:end])
+  if sys.byteorder != 'little':
+    column.byteswap()
+  return (column, end)
+
+
+def _Padding(size):
+  return '\0' * (-size % 4)
+
+
+def _Digest(source):
+  if source is None:
+    return _NO_SOURCE
+  return hashlib.sha256(source).digest()
+
+
+def _Halves(n):
+  return (n & ((1 << 64) - 1), n >> 64)
+
+
+def Save(name, root, generation=0, store=None, source=None, target=None):
+  """Writes every node in store (life.node_store by default), the results
+  cached on them, root and generation to the file name. The file is written
+  alongside and renamed into place, so a crash leaves the old checkpoint.
+
+  source identifies the pattern the run started from (its contents, say) and
+  target is the generation the run is stepping to; only their digest and
+  value are kept, for Load() to check that it is resuming the same run."""
+  if store is None:
+    store = life.node_store
+  # Sorted by level, children always come before their parents.
+  nodes = []
+  for level in range(1, life.LEAF_LEVEL + 1):
+    nodes.extend(store._leaves[level].itervalues())
+  by_level = {}
+  for node in store._nodes:
+    by_level.setdefault(node._level, []).append(node)
+  for level in sorted(by_level):
+    nodes.extend(by_level[level])
+  positions = dict((id(node), i) for (i, node) in enumerate(nodes))
+  if id(root) not in positions:
+    raise life.UsageError('The root to checkpoint is not in the node store')
+
+  levels = _Column('H', [node._level for node in nodes])
+  children = array.array('I')
+  result_nodes = []
+  result_levels = []
+  results = []
+  mask = (1 << 32) - 1
+  for (i, node) in enumerate(nodes):
+    if node._level <= life.LEAF_LEVEL:
+      bits = node._bits
+      children.extend((bits & mask, bits >> 32, 0, 0))
+    else:
+      children.extend((positions[id(node._nw)], positions[id(node._ne)],
+                       positions[id(node._sw)], positions[id(node._se)]))
+    cached = []
+    if node._next is not None:
+      cached.append((node._level, node._next))
+    if node._nextByLevel is not None:
+      cached.extend(node._nextByLevel.iteritems())
+    for (at_level, result) in cached:
+      position = positions.get(id(result))
+      if position is not None:
+        result_nodes.append(i)
+        result_levels.append(at_level)
+        results.append(position)
+  if sys.byteorder != 'little':
+    children.byteswap()
+
+  temporary = name + '.tmp'
+  with open(temporary, 'wb') as f:
+    (generation_low, generation_high) = _Halves(generation)
+    (target_low, target_high) = _Halves(target or 0)
+    f.write(_HEADER.pack(MAGIC, VERSION, len(nodes), len(results),
+                         positions[id(root)], generation_low, generation_high,
+                         _Digest(source), target is not None, target_low,
+                         target_high))
+    f.write(levels.tostring())
+    f.write(_Padding(2 * len(levels)))
+    f.write(children.tostring())
+    f.write(_Column('I', result_nodes).tostring())
+    f.write(_Column('I', results).tostring())
+    f.write(_Column('H', result_levels).tostring())
+  if os.name == 'nt' and os.path.exists(name):
+    os.remove(name)
+  os.rename(temporary, name)
+  return len(nodes)
+
+
+def Load(name, store=None, source=None, target=None):
+  """Reads a checkpoint from Save() into store (life.node_store by default),
+  returning the root and the generation.
+
+  Given a source or target, raises UsageError unless the checkpoint was saved
+  with the same ones, rather than resuming some other run.
+
+  Into an empty store the nodes go straight in, each added once without
+  looking for an equal node first, since the checkpoint's nodes are already
+  unique. Otherwise each is made canonical as usual, so a checkpoint can also
+  be merged into a store that is in use.
+  """
+  if store is None:
+    store = life.node_store
+  with open(name, 'rb') as f:
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    (magic, version, num_nodes, num_results, root, generation_low,
+     generation_high, saved_source, has_target, target_low,
+     target_high) = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+      raise life.UsageError('%s is not a version %d checkpoint' %
+                            (name, VERSION))
+    if source is not None and saved_source != _Digest(source):
+      raise life.UsageError('%s was saved from a different pattern' % name)
+    saved_target = target_low | (target_high << 64) if has_target else None
+    if target is not None and saved_target != target:
+      raise life.UsageError('%s was saved by a run to generation %s, not %d' %
+                            (name, saved_target, target))
+    (levels, end) = _ReadColumn('H', data, _HEADER.size, num_nodes)
+    end += -end % 4
+    (children, end) = _ReadColumn('I', data, end, 4 * num_nodes)
+    (result_nodes, end) = _ReadColumn('I', data, end, num_results)
+    (results, end) = _ReadColumn('I', data, end, num_results)
+    (result_levels, end) = _ReadColumn('H', data, end, num_results)
+  finally:
+    data.close()
+
+  fresh = not store._nodes
+  table = store._nodes
+  Node = life.Node
+  nodes = [None] * num_nodes
+  for i in xrange(num_nodes):
+    level = levels[i]
+    j = 4 * i
+    if level <= life.LEAF_LEVEL:
+      nodes[i] = store.CanonicalLeaf(level,
+                                     children[j] | (children[j + 1] << 32))
+      continue
+    node = Node(level, nodes[children[j]], nodes[children[j + 1]],
+                nodes[children[j + 2]], nodes[children[j + 3]],
+                really_use_constructor=True)
+    if fresh:
+      table[node] = node
+    else:
+      node = store.Canonical(node)
+    nodes[i] = node
+  for k in xrange(num_results):
+    node = nodes[result_nodes[k]]
+    at_level = result_levels[k]
+    if node._CachedForward(at_level) is None:
+      node._CacheNext(at_level, nodes[results[k]])
+  return (nodes[root], generation_low | (generation_high << 64))
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+A dense grid engine for life.py, stepping every cell of a NumPy array at once.
+
+HashLife wins on regular patterns, where the same nodes come up again and
+again. On soups and other chaotic patterns almost every node is new, and
+hashing them costs far more than it saves; there, stepping the cells directly
+is much faster. DenseEngine does that, and AutoEngine switches between the two
+as the pattern changes. Both are steppers, so they sit behind the usual World
+interface:
+  world = life.World(positions, stepper=life_dense.AutoEngine())
+
+The NumPy helpers for blocks of cells live here too: Rasterise() for reading a
+rectangle of a node out into an array (see World.Region()), and the bulk node
+building World.FillNode() uses.
+
+Needs NumPy.
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import itertools
+
+import numpy
+
+import life
+
+# The grid is made of whole blocks (see life.LeafBlocks), so converting to and
+# from nodes never needs to shift cells between blocks.
+BLOCK = 8
+
+# Bit positions of the cells in a packed block, as laid out in a Leaf.
+_BLOCK_SHIFTS = numpy.arange(BLOCK * BLOCK, dtype=numpy.uint64)
+
+# Each byte with its bits in reverse order. A block's row of cells is a byte
+# with the first column in the lowest bit, and numpy.unpackbits() wants it in
+# the highest.
+_REVERSED_BYTES = numpy.array([int('{0:08b}'.format(i)[::-1], 2)
+                               for i in range(256)], dtype=numpy.uint8)
+
+
+def UnpackBlocks(bits):
+  """Returns the packed blocks in the list bits as an array of booleans,
+  indexed [block, y, x] with y counting up from the bottom of the block."""
+  rows = _REVERSED_BYTES[numpy.array(bits, dtype='<u8').view(numpy.uint8)]
+  cells = numpy.unpackbits(rows.reshape(-1, BLOCK), axis=1).view(bool)
+  # Leaves count rows down from the top.
+  return cells.reshape(-1, BLOCK, BLOCK)[:, ::-1, :]
+
+
+def Rasterise(node, bounds, level=0):
+  """Returns the cells of node within bounds, (min_x, max_x, min_y, max_y) in
+  the coordinates of Node.Draw(), as an array of booleans indexed
+  [x - min_x, y - min_y] (the order pygame.surfarray uses).
+
+  With a level of 1 to LEAF_LEVEL, returns the population of each
+  2^level x 2^level block instead, as for Node.DrawBlocks(), and bounds are in
+  blocks."""
+  assert 0 <= level <= life.LEAF_LEVEL
+  (min_x, max_x, min_y, max_y) = bounds
+  across = BLOCK >> level  # Blocks across a leaf.
+  leaf_bounds = (min_x // across, max_x // across,
+                 min_y // across, max_y // across)
+  (bxs, bys, bits) = life.LeafColumns(node, leaf_bounds)
+  width = (leaf_bounds[1] - leaf_bounds[0] + 1) * across
+  height = (leaf_bounds[3] - leaf_bounds[2] + 1) * across
+  # A block holds at most 64 cells, so a byte is enough either way.
+  result = numpy.zeros((width, height), dtype=bool if level == 0 else 'u1')
+  if bits:
+    values = UnpackBlocks(bits)
+    if level > 0:
+      # Add up the cells of each block a row and a column at a time, in bytes
+      # (sum() would work in 64 bits, and take several times as long).
+      size = 1 << level
+      cells = values.view(numpy.uint8).reshape(-1, across, size, across, size)
+      rows = cells[:, :, :, :, 0].copy()
+      for x in range(1, size):
+        rows += cells[:, :, :, :, x]
+      values = rows[:, :, 0, :].copy()
+      for y in range(1, size):
+        values += rows[:, :, y, :]
+    view = result.reshape(width // across, across, height // across, across)
+    view[numpy.array(bxs) - leaf_bounds[0], :,
+         numpy.array(bys) - leaf_bounds[2], :] = values.transpose(0, 2, 1)
+  x0 = min_x - leaf_bounds[0] * across
+  y0 = min_y - leaf_bounds[2] * across
+  return result[x0:x0 + max_x - min_x + 1, y0:y0 + max_y - min_y + 1]
+
+
+class DenseGrid(object):
+  """A rectangle of cells held as a NumPy array of booleans, cells[y-y0, x-x0],
+  in the coordinates Node.Draw() uses. The rectangle grows as the pattern
+  does, and shrinks back when it is mostly empty.
+  """
+
+  def __init__(self, cells, x0, y0):
+    assert x0 % BLOCK == 0 and y0 % BLOCK == 0
+    assert cells.shape[0] % BLOCK == 0 and cells.shape[1] % BLOCK == 0
+    self.cells = cells
+    self.x0 = x0
+    self.y0 = y0
+
+  @classmethod
+  def FromNode(cls, node):
+    """Returns a grid holding the cells of node."""
+    (bxs, bys, bits) = life.LeafColumns(node)
+    if not bits:
+      return cls(numpy.zeros((2*BLOCK, 2*BLOCK), dtype=bool), -BLOCK, -BLOCK)
+    # One block of margin all round, so the first steps need not grow.
+    min_bx = min(bxs) - 1
+    max_bx = max(bxs) + 1
+    min_by = min(bys) - 1
+    max_by = max(bys) + 1
+    cells = numpy.zeros(((max_by - min_by + 1) * BLOCK,
+                         (max_bx - min_bx + 1) * BLOCK), dtype=bool)
+    rows = numpy.array(bys) - min_by
+    cols = numpy.array(bxs) - min_bx
+    view = cells.reshape(cells.shape[0] // BLOCK, BLOCK,
+                         cells.shape[1] // BLOCK, BLOCK)
+    view[rows, :, cols, :] = UnpackBlocks(bits)
+    return cls(cells, min_bx * BLOCK, min_by * BLOCK)
+
+  def ToNode(self):
+    """Returns the node, centered on (0,0), holding the cells of the grid."""
+    (height, width) = self.cells.shape
+    blocks = self.cells.reshape(height // BLOCK, BLOCK, width // BLOCK, BLOCK)
+    blocks = blocks.transpose(0, 2, 1, 3)[:, :, ::-1, :]
+    blocks = blocks.reshape(height // BLOCK, width // BLOCK, BLOCK * BLOCK)
+    (rows, cols) = numpy.nonzero(blocks.any(axis=2))
+    bits = (blocks[rows, cols].astype(numpy.uint64) << _BLOCK_SHIFTS).sum(
+        axis=1, dtype=numpy.uint64)
+    bx0 = self.x0 // BLOCK
+    by0 = self.y0 // BLOCK
+    return life.NodeFromLeafBlocks(dict(
+        ((bx0 + int(col), by0 + int(row)), int(value))
+        for (row, col, value) in zip(rows, cols, bits)))
+
+  def Population(self):
+    return int(self.cells.sum())
+
+  def Step(self, num_generations=1):
+    """Runs the grid forward num_generations, one generation at a time."""
+    for i in xrange(num_generations):
+      self._Fit()
+      cells = self.cells
+      counts = cells.view(numpy.uint8)
+      neighbours = (counts[:-2, :-2] + counts[:-2, 1:-1] + counts[:-2, 2:] +
+                    counts[1:-1, :-2] + counts[1:-1, 2:] +
+                    counts[2:, :-2] + counts[2:, 1:-1] + counts[2:, 2:])
+      result = numpy.zeros_like(cells)
+      result[1:-1, 1:-1] = (neighbours == 3) | (
+          (neighbours == 2) & cells[1:-1, 1:-1])
+      self.cells = result
+
+  def _Fit(self):
+    """Makes sure the two cells round the edge are empty, so the edge cells
+    stay empty for a generation and the cells inside have all their
+    neighbours. Grows the grid by half again on each side that is too close,
+    and shrinks it when it is under a quarter full of live area."""
+    cells = self.cells
+    (height, width) = cells.shape
+    grow = [0, 0, 0, 0]  # Below, above, left, right.
+    if cells[:2].any():
+      grow[0] = _RoundUp(height // 2)
+    if cells[-2:].any():
+      grow[1] = _RoundUp(height // 2)
+    if cells[:, :2].any():
+      grow[2] = _RoundUp(width // 2)
+    if cells[:, -2:].any():
+      grow[3] = _RoundUp(width // 2)
+    if any(grow):
+      self.cells = numpy.pad(cells, ((grow[0], grow[1]), (grow[2], grow[3])),
+                             'constant')
+      self.x0 -= grow[2]
+      self.y0 -= grow[0]
+      return
+
+    (rows, cols) = (numpy.nonzero(cells.any(axis=1))[0],
+                    numpy.nonzero(cells.any(axis=0))[0])
+    if not len(rows):
+      return
+    # The live area, in whole blocks with one block of margin.
+    top = max(0, (rows[0] // BLOCK - 1) * BLOCK)
+    bottom = min(height, (rows[-1] // BLOCK + 2) * BLOCK)
+    left = max(0, (cols[0] // BLOCK - 1) * BLOCK)
+    right = min(width, (cols[-1] // BLOCK + 2) * BLOCK)
+    if 4 * (bottom - top) * (right - left) < height * width:
+      self.cells = cells[top:bottom, left:right].copy()
+      self.x0 += left
+      self.y0 += top
+
+
+def _RoundUp(size):
+  """Rounds size up to a whole number of blocks, and at least one."""
+  return max(BLOCK, -(-size // BLOCK) * BLOCK)
+
+
+class DenseEngine:
+  """Runs worlds forward on a DenseGrid. Use as
+  World(positions, stepper=DenseEngine()).
+
+  The grid is kept between calls, so as long as it is handed back the node it
+  last returned, the only node work per call is building the result.
+  """
+
+  def __init__(self):
+    self._grid = None
+    self._last_node = None
+
+  def Grid(self, node):
+    """Returns the grid for node, reusing the last one if it still matches."""
+    if self._grid is None or node is not self._last_node:
+      self._grid = DenseGrid.FromNode(node)
+      self._last_node = node
+    return self._grid
+
+  def ForwardN(self, node, n):
+    """Returns node forward n generations; see Node.ForwardN()."""
+    grid = self.Grid(node)
+    grid.Step(n)
+    self._last_node = grid.ToNode()
+    return self._last_node
+
+
+class AutoEngine:
+  """Runs worlds forward with HashLife or a DenseEngine, whichever suits the
+  pattern. Use as World(positions, stepper=AutoEngine()).
+
+  HashLife pays off when most canonical node lookups find a node that is
+  already there. Each HashLife step measures that as the ratio
+  numAlreadyInCache / numNodesConstructed over the step; when it falls below
+  min_reuse the next recheck_every steps go to the dense engine, and then
+  HashLife gets another try. Patterns spread over more than max_cells cells
+  always use HashLife, since the dense engine's cost grows with the area.
+
+  The dense engine works a generation at a time, while HashLife's steps get
+  cheaper per generation the bigger they are, so only steps of up to
+  max_work cells times generations go to the dense engine; bigger ones stay
+  with HashLife, without using up the dense steps.
+  """
+
+  def __init__(self, min_reuse=2.0, max_cells=1 << 22, recheck_every=64,
+               max_work=1 << 26):
+    self._min_reuse = min_reuse
+    self._max_cells = max_cells
+    self._max_work = max_work
+    self._recheck_every = recheck_every
+    self._dense = DenseEngine()
+    self._dense_steps_left = 0
+    # The engine used for the last step, 'hashlife' or 'dense', and the ratio
+    # measured on the last HashLife step.
+    self.current = 'hashlife'
+    self.reuse = None
+
+  def ForwardN(self, node, n):
+    """Returns node forward n generations; see Node.ForwardN()."""
+    if self._dense_steps_left > 0:
+      size = self._dense.Grid(node).cells.size
+      if size > self._max_cells:
+        self._dense_steps_left = 0
+      elif size * n <= self._max_work:
+        self._dense_steps_left -= 1
+        self.current = 'dense'
+        return self._dense.ForwardN(node, n)
+
+    self.current = 'hashlife'
+    hits = life.numAlreadyInCache
+    constructed = life.numNodesConstructed
+    result = node.ForwardN(n)
+    constructed = life.numNodesConstructed - constructed
+    if constructed:
+      self.reuse = float(life.numAlreadyInCache - hits) / constructed
+      if self.reuse < self._min_reuse:
+        self._dense_steps_left = self._recheck_every
+    return result
+
+
+def PositionArray(positions):
+  """Returns (x, y) positions as an n x 2 array."""
+  return numpy.fromiter(itertools.chain.from_iterable(positions),
+                        dtype=numpy.int64,
+                        count=2 * len(positions)).reshape(-1, 2)
+
+
+def _GroupBlocks(bxs, bys):
+  """Sorts blocks so that equal (bx, by) are together, returning the order
+  and where each run of equal blocks starts in it."""
+  min_bx = bxs.min()
+  min_by = bys.min()
+  span = int(bys.max() - min_by) + 1
+  if span * (int(bxs.max() - min_bx) + 1) < 1 << 62:
+    # One key per block sorts several times faster than lexsort().
+    keys = (bxs - min_bx) * span + (bys - min_by)
+    order = numpy.argsort(keys)
+    keys = keys[order]
+    changed = keys[1:] != keys[:-1]
+  else:
+    order = numpy.lexsort((bys, bxs))
+    (bxs, bys) = (bxs[order], bys[order])
+    changed = (bxs[1:] != bxs[:-1]) | (bys[1:] != bys[:-1])
+  return (order, numpy.flatnonzero(numpy.concatenate(([True], changed))))
+
+
+def BlockColumns(xs, ys):
+  """life.PositionBlocks() for arrays of x and y, returning arrays of bx, by
+  and bits with each block once: the cells are sorted by block and each
+  block's bits ORed together in one go."""
+  bxs = xs >> 3
+  bys = ys >> 3
+  shifts = ((7 - (ys & 7)) * BLOCK + (xs & 7)).astype(numpy.uint64)
+  bits = numpy.left_shift(numpy.uint64(1), shifts)
+  (order, starts) = _GroupBlocks(bxs, bys)
+  return (bxs[order][starts], bys[order][starts],
+          numpy.bitwise_or.reduceat(bits[order], starts))
+
+
+def NodeFromBlockColumns(bxs, bys, bits):
+  """life.NodeFromLeafBlocks() for arrays of bx, by and bits, each block once.
+
+  Each level up, the nodes are grouped into their parents with NumPy and the
+  parents with the same children are found the same way, so that only the
+  distinct ones are built in Python. A sparse pattern's nodes repeat over and
+  over, and most are never built more than once.
+  """
+  live = bits != 0
+  (bxs, bys, bits) = (bxs[live], bys[live], bits[live])
+  if not len(bits):
+    return life.Node.Zero(1)
+  level = life.LEAF_LEVEL
+  # The nodes at this level, with Zero last, and each block's index into them.
+  (values, codes) = numpy.unique(bits, return_inverse=True)
+  nodes = [life.node_store.CanonicalLeaf(level, value)
+           for value in values.tolist()]
+  nodes.append(life.Node.Zero(level))
+  extent = int(max((-1 - bxs).max(), bxs.max(), (-1 - bys).max(), bys.max()))
+  while extent > 0:
+    quadrants = (1 - (bys & 1)) * 2 + (bxs & 1)
+    (bxs, bys) = (bxs >> 1, bys >> 1)
+    (order, starts) = _GroupBlocks(bxs, bys)
+    parents = numpy.zeros(len(order), dtype=numpy.int64)
+    parents[starts] = 1
+    parents = numpy.cumsum(parents) - 1
+    children = numpy.empty((len(starts), 4), dtype=numpy.int64)
+    children.fill(len(nodes) - 1)
+    children[parents, quadrants[order]] = codes[order]
+    (bxs, bys) = (bxs[order][starts], bys[order][starts])
+    rows = children.view(numpy.dtype((numpy.void, 32))).ravel()
+    (unused, first, codes) = numpy.unique(rows, return_index=True,
+                                          return_inverse=True)
+    level += 1
+    nodes = [life.Node.CanonicalNode(level, *[nodes[i] for i in row])
+             for row in children[first].tolist()]
+    nodes.append(life.Node.Zero(level))
+    extent >>= 1
+  quadrants = dict(zip(zip(bxs.tolist(), bys.tolist()), codes.tolist()))
+  zero = len(nodes) - 1
+  root = life.Node.CanonicalNode(
+      level + 1, *[nodes[quadrants.get(key, zero)]
+                   for key in ((-1, 0), (0, 0), (-1, -1), (0, -1))])
+  return root.Compact()
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Pattern files for life.py: RLE, Life 1.05, Life 1.06, plain text and Golly's
+macrocell format.
+
+The file is read a line at a time, and each format's reader turns the lines
+into runs of live cells. NodeFromRuns() ORs each run straight into the 8x8
+blocks of the leaves it crosses, and builds the node from those with
+life.NodeFromLeafBlocks(). There is never a cell-by-cell list, so memory
+follows the number of live blocks rather than cells, and big RLE files load
+in seconds:
+  world = life.World.Load('pattern.rle')
+
+Cells land where ParseFile() has always put them: the file's rows run along
+x, the first at x = 0, and its columns along y.
+
+Macrocell files hold the tree itself, each node once, so they are read and
+written node by node instead (see ReadMacrocell() and WriteMacrocell()). A
+pattern run 2^40 generations saves and loads in time and space that follow
+its unique nodes, however many cells it has.
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import itertools
+import re
+
+import life
+
+# The cells of each column of a block, as laid out in a Leaf at LEAF_LEVEL.
+_COLUMN_BITS = [0x0101010101010101 << column for column in range(8)]
+
+_RLE_ITEM = re.compile(r'(\d*)([^\d\s])')
+_LIVE_RUN = re.compile(r'[^.]+')
+_INTEGERS = re.compile(r'-?\d+')
+
+
+def DetectFormat(lines):
+  """Works out the format of a pattern from its first lines: 'macrocell',
+  'rle', 'life105', 'life106' or 'plaintext'. Returns (format, lines), where
+  lines still includes the ones looked at."""
+  lines = iter(lines)
+  head = []
+  kind = 'plaintext'
+  for line in lines:
+    head.append(line)
+    stripped = line.strip()
+    if stripped.startswith('[M2]'):
+      kind = 'macrocell'
+      break
+    if stripped.startswith('#Life 1.06'):
+      kind = 'life106'
+      break
+    if stripped.startswith('#Life 1.05'):
+      kind = 'life105'
+      break
+    if stripped and stripped[0] not in '#!':
+      if re.match(r'x\s*=', stripped):
+        kind = 'rle'
+      break
+  return (kind, itertools.chain(head, lines))
+
+
+def ReadRuns(f):
+  """Yields the live cells of the pattern in the file f as runs along its
+  rows, (column, row, length), with rows counting down the file. Not for
+  macrocell files."""
+  (kind, lines) = DetectFormat(f)
+  if kind == 'macrocell':
+    raise life.UsageError('Macrocell files hold nodes, not runs of cells')
+  return _READERS[kind](lines)
+
+
+def _CheckRule(rule):
+  """Raises UsageError for any rule but Life's, in either notation."""
+  rule = rule.strip().upper().replace(' ', '')
+  if rule not in ('', 'B3/S23', 'S23/B3', '23/3'):
+    raise life.UsageError('Only Life (B3/S23) is supported, not %s' % rule)
+
+
+def _PlaintextRuns(lines):
+  """ParseFile()'s lax syntax: ! or # start a comment, . is a dead cell, and
+  anything else is live."""
+  row = 0
+  for line in lines:
+    if not line or line[0] == '!' or line[0] == '#':
+      continue
+    for match in _LIVE_RUN.finditer(line.rstrip('\r\n')):
+      yield (match.start(), row, match.end() - match.start())
+    row += 1
+
+
+def _Life105Runs(lines):
+  """Life 1.05: blocks of . and * rows, each starting at the offset given by
+  the #P line before it."""
+  (column, row) = (0, 0)
+  for line in lines:
+    if line.startswith('#P'):
+      (column, row) = [int(value) for value in _INTEGERS.findall(line)[:2]]
+      continue
+    if line.startswith('#R'):
+      _CheckRule(line[2:])
+      continue
+    if not line or line[0] == '#' or line[0] == '!':
+      continue
+    for match in _LIVE_RUN.finditer(line.rstrip('\r\n')):
+      yield (column + match.start(), row, match.end() - match.start())
+    row += 1
+
+
+def _Life106Runs(lines):
+  """Life 1.06: a live cell's x and y per line."""
+  for line in lines:
+    if not line or line[0] == '#':
+      continue
+    values = _INTEGERS.findall(line)
+    if len(values) >= 2:
+      yield (int(values[0]), int(values[1]), 1)
+
+
+def _RleRuns(lines):
+  """RLE: after the x = ..., y = ... header, runs of b (dead) and o (or any
+  other letter, live) cells, $ ending rows and ! the pattern. #P or #R comments
+  give the position of the top left corner."""
+  (column, row) = (0, 0)
+  (left, count) = (0, '')
+  for line in lines:
+    if line.startswith('#'):
+      if line[1:2] in ('P', 'R'):
+        values = _INTEGERS.findall(line)
+        if len(values) >= 2:
+          (left, row) = (int(values[0]), int(values[1]))
+          column = left
+      continue
+    stripped = line.strip()
+    if re.match(r'x\s*=', stripped):
+      rule = re.search(r'rule\s*=\s*([^,]*)', stripped)
+      if rule:
+        _CheckRule(rule.group(1))
+      continue
+    # A run count can be split across lines; carry it on to the next.
+    for (digits, tag) in _RLE_ITEM.findall(count + stripped):
+      length = int(digits) if digits else 1
+      if tag == 'b' or tag == '.':
+        column += length
+      elif tag == '$':
+        row += length
+        column = left
+      elif tag == '!':
+        return
+      else:
+        yield (column, row, length)
+        column += length
+    match = re.search(r'\d+$', stripped)
+    count = match.group(0) if match else ''
+
+
+_READERS = {
+    'plaintext': _PlaintextRuns,
+    'life105': _Life105Runs,
+    'life106': _Life106Runs,
+    'rle': _RleRuns,
+}
+
+
+def Positions(name):
+  """The live cells of the pattern in the file name, as ParseFile() returns
+  them."""
+  with open(name) as f:
+    (kind, lines) = DetectFormat(f)
+    if kind == 'macrocell':
+      world = life.World([])
+      (world._root, unused_generation) = ReadMacrocell(lines)
+      return world.Cells()
+    return [(-row, column + i)
+            for (column, row, length) in _READERS[kind](lines)
+            for i in xrange(length)]
+
+
+def Load(name):
+  """Reads the pattern in the file name into a node, centered to within a
+  block on (0,0), without ever listing its cells. Returns the node and the
+  generation it is at, which only macrocell files record."""
+  with open(name) as f:
+    (kind, lines) = DetectFormat(f)
+    if kind == 'macrocell':
+      return ReadMacrocell(lines)
+    return (NodeFromRuns(_READERS[kind](lines)), 0)
+
+
+def LoadNode(name):
+  """Reads the pattern in the file name into a node; see Load()."""
+  return Load(name)[0]
+
+
+def NodeFromRuns(runs):
+  """Builds the node for runs from ReadRuns(), centered to within a block on
+  (0,0)."""
+  blocks = RunsToBlocks(runs)
+  if not blocks:
+    return life.Node.Zero(1)
+  bxs = [bx for (bx, by) in blocks]
+  bys = [by for (bx, by) in blocks]
+  shift_x = (min(bxs) + max(bxs) + 1) // 2
+  shift_y = (min(bys) + max(bys) + 1) // 2
+  return life.NodeFromLeafBlocks(dict(
+      ((bx - shift_x, by - shift_y), bits)
+      for ((bx, by), bits) in blocks.iteritems()))
+
+
+def RunsToBlocks(runs):
+  """ORs runs from ReadRuns() into a dict of (bx, by) -> bits, as taken by
+  life.NodeFromLeafBlocks(). A run along a row of the file is a run along a
+  column of cells here, so each block it crosses takes a single mask."""
+  blocks = {}
+  get = blocks.get
+  for (column, row, length) in runs:
+    x = -row
+    key_x = x >> 3
+    column_bits = _COLUMN_BITS[x & 7]
+    y = column
+    end = column + length
+    while y < end:
+      block_end = min(end, (y | 7) + 1)
+      # Leaf rows count down from the top of the block.
+      top = 8 - (block_end - (y & ~7))
+      rows = ((1 << ((block_end - y) * 8)) - 1) << (top * 8)
+      key = (key_x, y >> 3)
+      blocks[key] = get(key, 0) | (column_bits & rows)
+      y = block_end
+  return blocks
+
+
+# Golly's y runs down the screen, and its rows are columns here just as for
+# the other formats, so macrocell nodes are mirrored across their diagonal on
+# the way in and out: Golly's nw quadrant is the se one here, and its cell at
+# (row, column) of a leaf is at (7 - column, 7 - row). Mirroring twice gets
+# back the same node.
+_MIRRORED_ROWS = [[sum(1 << ((7 - column) * 8 + 7 - row) for column in range(8)
+                       if (byte >> column) & 1)
+                   for byte in range(256)]
+                  for row in range(8)]
+
+# A leaf row in a macrocell file: * live, . dead, with no trailing dead cells.
+_ROW_TEXT = [''.join('*' if (byte >> column) & 1 else '.'
+                     for column in range(byte.bit_length()))
+             for byte in range(256)]
+_ROW_BYTES = dict((text, byte) for (byte, text) in enumerate(_ROW_TEXT))
+
+
+def _MirroredBits(bits):
+  result = 0
+  for row in range(8):
+    byte = (bits >> (row * 8)) & 255
+    if byte:
+      result |= _MIRRORED_ROWS[row][byte]
+  return result
+
+
+def ReadMacrocell(lines):
+  """Reads a node from the lines of a macrocell file, as written by Golly or
+  WriteMacrocell(). Each line is a node, made canonical as it is read, so
+  this takes time and space in proportion to the unique nodes. Returns the
+  node and its generation."""
+  # Nodes are numbered from 1 in the order of their lines; 0 is empty.
+  nodes = [None]
+  generation = 0
+  for line in lines:
+    if line.startswith('#'):
+      if line.startswith('#R'):
+        _CheckRule(line[2:])
+      elif line.startswith('#G'):
+        generation = int(line[2:])
+      continue
+    stripped = line.strip()
+    if not stripped or stripped[0] == '[':
+      continue
+    if stripped[0] in '.*$':
+      bits = 0
+      for (row, text) in enumerate(stripped.split('$')[:8]):
+        byte = _ROW_BYTES.get(text)
+        if byte is None:
+          byte = sum(1 << column for (column, cell) in enumerate(text)
+                     if cell == '*')
+        bits |= byte << (row * 8)
+      nodes.append(life.node_store.CanonicalLeaf(life.LEAF_LEVEL,
+                                                 _MirroredBits(bits)))
+      continue
+    (level, nw, ne, sw, se) = [int(value) for value in stripped.split()]
+    zero = life.Node.Zero(level - 1)
+    nodes.append(life.Node.CanonicalNode(
+        level, *[nodes[index] if index else zero
+                 for index in (se, ne, sw, nw)]))
+  if len(nodes) == 1:
+    return (life.Node.Zero(1), generation)
+  return (nodes[-1], generation)
+
+
+def WriteMacrocell(f, node, generation=0, comments=()):
+  """Writes node to the file f in Golly's macrocell format, each unique node
+  once with its children before it, so the file follows the number of unique
+  nodes rather than cells. Returns the number of nodes written."""
+  f.write('[M2] (life.py)\n#R B3/S23\n')
+  if generation:
+    f.write('#G %d\n' % generation)
+  for comment in comments:
+    f.write('#C %s\n' % comment)
+  while node._level < life.LEAF_LEVEL:
+    node = node.Expand()
+  if node.IsZero():
+    return 0
+  numbers = {}
+  stack = [node]
+  while stack:
+    node = stack[-1]
+    if id(node) in numbers:
+      stack.pop()
+      continue
+    if node._level == life.LEAF_LEVEL:
+      bits = _MirroredBits(node._bits)
+      rows = [_ROW_TEXT[(bits >> (row * 8)) & 255] for row in range(8)]
+      while not rows[-1]:
+        rows.pop()
+      line = '$'.join(rows) + '$\n'
+    else:
+      children = (node._se, node._ne, node._sw, node._nw)
+      pending = [child for child in children
+                 if id(child) not in numbers and not child.IsZero()]
+      if pending:
+        stack.extend(pending)
+        continue
+      line = '%d %d %d %d %d\n' % ((node._level,) + tuple(
+          numbers.get(id(child), 0) for child in children))
+    stack.pop()
+    numbers[id(node)] = len(numbers) + 1
+    f.write(line)
+  return len(numbers)
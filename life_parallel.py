@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel stepping for the HashLife engine in life.py.
+
+Every process has its own node store, so nodes travel between processes as
+flattened entries (see life.FlattenNodes) and are made canonical again on
+arrival. Each worker process lives as long as the engine does and shares a
+numbered table of nodes with it (see _Table), so that a node is only ever
+sent to a worker once: after that, the engine and the worker both refer to it
+by its number. The results a worker sends back join the table too, and the
+results cached on the worker's nodes stay warm from one step to the next.
+
+This is an experiment, not a way to run faster: on the single core it has been
+measured on, it only adds the cost of shipping nodes around (see
+ParallelEngine).
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import multiprocessing
+
+import life
+
+
+class _Table:
+  """The nodes the engine and one worker have shared, numbered in the order
+  they were first sent either way. Both ends keep a table, adding the same
+  nodes in the same order, so the numbers agree."""
+
+  def __init__(self):
+    self.Clear()
+
+  def __len__(self):
+    return len(self.nodes)
+
+  def Clear(self):
+    self.nodes = []
+    self._positions = {}
+
+  def LiveRoots(self):
+    return self.nodes
+
+  def Add(self, roots):
+    """Adds every node reachable from roots that isn't in the table yet.
+    Returns entries like those of life.FlattenNodes() for just the new nodes,
+    with children numbered in the table, and the number of each root."""
+    positions = self._positions
+    entries = []
+    for root in roots:
+      stack = [root]
+      while stack:
+        node = stack[-1]
+        if id(node) in positions:
+          stack.pop()
+          continue
+        if node._level <= life.LEAF_LEVEL:
+          entry = (node._level, node._bits)
+        else:
+          children = (node._nw, node._ne, node._sw, node._se)
+          pending = [child for child in children if id(child) not in positions]
+          if pending:
+            stack.extend(pending)
+            continue
+          entry = (node._level,) + tuple(positions[id(child)]
+                                         for child in children)
+        stack.pop()
+        positions[id(node)] = len(self.nodes)
+        self.nodes.append(node)
+        entries.append(entry)
+    return (entries, [positions[id(root)] for root in roots])
+
+  def Extend(self, entries):
+    """Adds the nodes for entries from the other end's Add()."""
+    nodes = self.nodes
+    for entry in entries:
+      if len(entry) == 2:
+        node = life.node_store.CanonicalLeaf(entry[0], entry[1])
+      else:
+        (level, nw, ne, sw, se) = entry
+        node = life.Node.CanonicalNode(level, nodes[nw], nodes[ne], nodes[sw],
+                                       nodes[se])
+      self._positions.setdefault(id(node), len(nodes))
+      nodes.append(node)
+
+
+def _Worker(connection):
+  """Runs in a worker process: answers each (forget, entries, tasks) message
+  from the engine, tasks being (number, atLevel) pairs, with the entries and
+  numbers of the results. None ends it."""
+  table = _Table()
+  # The shared nodes must stay canonical here for the numbers to mean the same
+  # at both ends.
+  life.node_store.AddRootSource(table)
+  while True:
+    message = connection.recv()
+    if message is None:
+      break
+    (forget, entries, tasks) = message
+    if forget:
+      table.Clear()
+    table.Extend(entries)
+    results = [table.nodes[number]._ForwardAnyDepth(atLevel)
+               for (number, atLevel) in tasks]
+    connection.send(table.Add(results))
+    life.node_store.MaybeCollect()
+  connection.close()
+
+
+class _WorkerProcess:
+  """The engine's end of a worker: the process, the pipe to it, and the
+  table of nodes shared with it."""
+
+  def __init__(self):
+    (self.connection, child) = multiprocessing.Pipe()
+    self.process = multiprocessing.Process(target=_Worker, args=(child,))
+    self.process.daemon = True
+    self.process.start()
+    child.close()
+    self.table = _Table()
+    # Whether the worker is to clear its table before the next message.
+    self.forget = False
+
+  def Forget(self):
+    self.table.Clear()
+    self.forget = True
+
+  def Send(self, nodes, atLevel):
+    """Sends nodes to be run forward, and any of them the worker lacks.
+    Returns how many nodes were sent."""
+    (entries, numbers) = self.table.Add(nodes)
+    self.connection.send((self.forget, entries,
+                          [(number, atLevel) for number in numbers]))
+    self.forget = False
+    return len(entries)
+
+  def Receive(self):
+    """Returns the results for the last Send(), and how many nodes came
+    back."""
+    (entries, numbers) = self.connection.recv()
+    self.table.Extend(entries)
+    return ([self.table.nodes[number] for number in numbers], len(entries))
+
+  def Close(self):
+    self.connection.send(None)
+    self.process.join()
+
+
+class ParallelEngine:
+  """Runs worlds forward with the top of each step spread over worker
+  processes. Use as World(positions, stepper=ParallelEngine()).
+
+  When a node above cutoff_level is run forward, the futures of its nine
+  sub-squares are computed by the workers, and then (at full speed) those of
+  the four squares they make up. At and below the cutoff, and inside the
+  workers, everything is serial, so the cutoff should be high enough that
+  each piece of work is worth more than shipping its nodes. The same
+  sub-square goes to the same worker each time, so that parts of the pattern
+  that haven't changed are not sent again.
+
+  The engine holds on to the nodes it has shared, up to max_shared_nodes per
+  worker, and forgets them all whenever the node store is collected, since
+  they may no longer be canonical.
+
+  Not yet a performance option, so not offered by life.py's --engine: on one
+  core, BenchParallel in life_bench runs it slower than the serial engine at
+  every process count, and it has not been measured on more.
+  """
+
+  def __init__(self, processes=None, cutoff_level=12,
+               max_shared_nodes=1 << 18):
+    self._processes = processes or multiprocessing.cpu_count()
+    self._cutoff_level = cutoff_level
+    self._max_shared_nodes = max_shared_nodes
+    self._workers = []
+    # The node store and its collection count when the tables were filled.
+    self._store = None
+    # Counters, for seeing what parallelism costs.
+    self.num_tasks = 0
+    self.nodes_sent = 0
+    self.nodes_received = 0
+
+  def Close(self):
+    """Shuts down the worker processes. They restart if needed again."""
+    for worker in self._workers:
+      worker.Close()
+    self._workers = []
+
+  def ForwardN(self, node, n):
+    """Returns node forward n generations; see Node.ForwardN()."""
+    return node.ForwardN(n, forward=self._Forward)
+
+  def _Forward(self, node, atLevel):
+    if node._level <= self._cutoff_level:
+      return node._ForwardAnyDepth(atLevel)
+    if atLevel is None or atLevel > node._level:
+      atLevel = node._level
+    result = node._CachedForward(atLevel)
+    if result is not None:
+      return result
+
+    futures = self._ForwardAll(node._SubSquares(), atLevel)
+    if atLevel != node._level:
+      squares = life.Node._MergedCenters(futures)
+    else:
+      squares = self._ForwardAll(
+          life.Node._CenterSquares(node._level-1, futures), None)
+    result = life.Node.CanonicalNode(node._level-1, *squares)
+    node._CacheNext(atLevel, result)
+    return result
+
+  def _ForwardAll(self, nodes, atLevel):
+    """Runs each of nodes forward in the workers, returning the results."""
+    if not self._workers:
+      self._workers = [_WorkerProcess() for i in range(self._processes)]
+    store = (life.node_store, life.node_store.num_collections)
+    for worker in self._workers:
+      if store != self._store or len(worker.table) > self._max_shared_nodes:
+        worker.Forget()
+    self._store = store
+    # The nth node goes to the same worker every time.
+    batches = [nodes[i::len(self._workers)] for i in range(len(self._workers))]
+    busy = []
+    for (worker, batch) in zip(self._workers, batches):
+      if batch:
+        self.nodes_sent += worker.Send(batch, atLevel)
+        busy.append(worker)
+    self.num_tasks += len(nodes)
+    answers = []
+    for worker in busy:
+      (results, received) = worker.Receive()
+      self.nodes_received += received
+      answers.append(results)
+    results = [None] * len(nodes)
+    for (i, answer) in enumerate(answers):
+      results[i::len(self._workers)] = answer
+    return results
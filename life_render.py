@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Drawing for life.py through a NumPy pixel buffer.
+
+Instead of a screen.fill() per live cell, the leaves in view are rasterised
+into an array with a handful of NumPy operations (life_dense.Rasterise()), and
+the whole view goes to SDL as a single blit, scaled up to the zoom level on the
+way. World.Draw() uses this whenever NumPy is installed.
+
+From one generation to the next, DrawChangedTiles() redraws only the tiles
+whose nodes have changed, found by walking the old and new roots together,
+and Game passes the rectangles it returns to pygame.display.update().
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import numpy
+import pygame
+import pygame.surfarray
+
+import life
+import life_dense
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+
+def DrawCells(screen, cells, position, pixels=1):
+  """Draws an array of booleans from life_dense.Rasterise() onto screen in one
+  blit, live cells black and dead ones white, with each cell pixels across and
+  cells[0, 0] at position."""
+  colours = numpy.array([screen.map_rgb(WHITE), screen.map_rgb(BLACK)],
+                        dtype=numpy.uint32)
+  _Blit(screen, colours[cells.view(numpy.uint8)], position, pixels)
+
+
+def DrawBlocks(screen, node, bounds, level, position):
+  """Draws node at a pixel per 2^level x 2^level block, as World does when
+  zoomed out, with the blocks within bounds (see Node.DrawBlocks()) in one
+  blit and block (bounds[0], bounds[2]) at position. Each pixel is shaded by
+  its population, from light grey for a single live cell to black for a full
+  block.
+
+  Up to LEAF_LEVEL, the populations come from the leaves with NumPy. Above
+  it, each block is a node of its own, and its population is cached."""
+  greys = numpy.array([screen.map_rgb((shade, shade, shade))
+                       for shade in range(256)], dtype=numpy.uint32)
+  if level <= life.LEAF_LEVEL:
+    # Few enough populations to look each one's colour up.
+    full = 1 << (2 * level)
+    colours = greys[[255] + [192 - 192 * population // full
+                             for population in range(1, full + 1)]]
+    _Blit(screen, colours[life_dense.Rasterise(node, bounds, level)], position,
+          1)
+    return
+  populations = numpy.zeros(
+      (bounds[1] - bounds[0] + 1, bounds[3] - bounds[2] + 1), dtype=int)
+  def DrawBlock(bx, by, population):
+    populations[bx - bounds[0], by - bounds[2]] = population
+  node.DrawBlocks(bounds, level, DrawBlock)
+  shades = numpy.where(populations,
+                       192 - ((192 * populations) >> (2 * level)), 255)
+  _Blit(screen, greys[shades], position, 1)
+
+
+def _Blit(screen, pixels, position, scale):
+  """Blits an array of mapped colours onto screen, scale pixels across each."""
+  buffer = pygame.Surface(pixels.shape, 0, screen)
+  pygame.surfarray.blit_array(buffer, pixels)
+  if scale > 1:
+    buffer = pygame.transform.scale(
+        buffer, (pixels.shape[0] * scale, pixels.shape[1] * scale))
+  screen.blit(buffer, position)
+
+
+class TileCache:
+  """Remembers rendered tiles - the surfaces for whole nodes at a given zoom -
+  so views of the same nodes can be put together from blits.
+
+  Nodes are canonical and never change, so a tile never goes stale; it is
+  only dropped to stay within max_bytes. Whenever that is exceeded the least
+  recently used tiles are dropped, down to three quarters of the budget. A
+  tile holds on to its node, so the node's id can't be reused while it is
+  cached.
+  """
+
+  def __init__(self, max_bytes=64 << 20):
+    self._max_bytes = max_bytes
+    # (id(node), zoom) -> [last used, surface, node, bytes]
+    self._tiles = {}
+    self._bytes = 0
+    self._clock = 0
+    # Counters, for seeing how well the cache works.
+    self.hits = 0
+    self.misses = 0
+    self.evicted = 0
+
+  def __len__(self):
+    return len(self._tiles)
+
+  def Bytes(self):
+    return self._bytes
+
+  def SetBudget(self, max_bytes):
+    self._max_bytes = max_bytes
+    self._Evict()
+
+  def Clear(self):
+    self._tiles.clear()
+    self._bytes = 0
+
+  def Get(self, node, zoom, render):
+    """Returns the tile for node at zoom, calling render(node) for a new
+    surface if it isn't cached."""
+    self._clock += 1
+    key = (id(node), zoom)
+    entry = self._tiles.get(key)
+    if entry is not None:
+      self.hits += 1
+      entry[0] = self._clock
+      return entry[1]
+    self.misses += 1
+    surface = render(node)
+    size = surface.get_bytesize() * surface.get_width() * surface.get_height()
+    self._tiles[key] = [self._clock, surface, node, size]
+    self._bytes += size
+    if self._bytes > self._max_bytes:
+      self._Evict()
+    return surface
+
+  def _Evict(self):
+    if self._bytes <= self._max_bytes:
+      return
+    target = self._max_bytes * 3 // 4
+    for (key, entry) in sorted(self._tiles.iteritems(),
+                               key=lambda item: item[1][0]):
+      if self._bytes <= target:
+        break
+      del self._tiles[key]
+      self._bytes -= entry[3]
+      self.evicted += 1
+
+
+# The tile cache World.Draw() uses, shared like life.node_store since the nodes
+# are.
+tile_cache = TileCache()
+
+# Tiles are the nodes that come out about this many pixels across.
+TILE_PIXELS = 128
+
+
+def _TileLayout(node, view_center, pixels, level, size):
+  """Works out the tiles for DrawTiles(): returns the tile level, the screen
+  position of the south west corner of tile (0, 0), the pixels across a tile
+  and the bounds of the tiles on screen, or None when all of node fits in a
+  pixel or two and there are no tiles."""
+  (width, height) = size
+  # The tile level, and the pixels across a tile.
+  if level == 0:
+    tile_level = life.LEAF_LEVEL + 1
+    while (1 << tile_level) * pixels < TILE_PIXELS:
+      tile_level += 1
+  else:
+    tile_level = level + max(1, TILE_PIXELS.bit_length() - 1)
+  if tile_level >= node._level:
+    tile_level = max(node._level - 1, life.LEAF_LEVEL + 1)
+  # The screen position of the south west corner of tile (0, 0), in the
+  # same way as World.Draw().
+  if level == 0:
+    origin_x = width // 2 - view_center[0] * pixels
+    origin_y = height // 2 - view_center[1] * pixels
+  else:
+    origin_x = width // 2 - (view_center[0] >> level)
+    origin_y = height // 2 - (view_center[1] >> level)
+  if tile_level <= level:
+    return None
+  if level == 0:
+    tile_pixels = (1 << tile_level) * pixels
+  else:
+    tile_pixels = 1 << (tile_level - level)
+  bounds = ((-origin_x) // tile_pixels, (width - 1 - origin_x) // tile_pixels,
+            (-origin_y) // tile_pixels, (height - 1 - origin_y) // tile_pixels)
+  return (tile_level, (origin_x, origin_y), tile_pixels, bounds)
+
+
+def _TileRenderer(screen, tile_level, tile_pixels, pixels, level):
+  """Returns render(tile) for TileCache.Get(): a new surface for tile."""
+  half = 1 << (tile_level - 1 - level)
+  def Render(tile):
+    surface = pygame.Surface((tile_pixels, tile_pixels), 0, screen)
+    if level == 0:
+      DrawCells(surface,
+                life_dense.Rasterise(tile, (-half, half - 1, -half, half - 1)),
+                (0, 0), pixels)
+    else:
+      DrawBlocks(surface, tile, (-half, half - 1, -half, half - 1), level,
+                 (0, 0))
+    return surface
+  return Render
+
+
+def DrawTiles(screen, node, view_center, pixels, level, size, cache=None):
+  """Draws node (centered on (0,0)) onto screen from cached tiles, with
+  view_center at the middle of a screen of size (width, height). Either
+  pixels is the number of pixels across a cell, or level is above 0 and each
+  pixel is a 2^level x 2^level block of cells. Empty tiles are not drawn, so
+  screen should already be white.
+
+  Tiles are never bigger than the quadrants of node, so for a node of at
+  least LEAF_LEVEL + 2 no nodes are built, and the drawing is safe alongside a
+  Simulation thread."""
+  if cache is None:
+    cache = tile_cache
+  (width, height) = size
+  layout = _TileLayout(node, view_center, pixels, level, size)
+  if layout is None:
+    # All of node fits in a pixel or two; no tiles for that.
+    origin_x = width // 2 - (view_center[0] >> level)
+    origin_y = height // 2 - (view_center[1] >> level)
+    DrawBlocks(screen, node, (-origin_x, width - 1 - origin_x,
+                              -origin_y, height - 1 - origin_y),
+               level, (0, 0))
+    return
+  (tile_level, (origin_x, origin_y), tile_pixels, bounds) = layout
+  (txs, tys, tiles) = life.NodeColumns(node, tile_level, bounds)
+  zoom = (pixels, level)
+  render = _TileRenderer(screen, tile_level, tile_pixels, pixels, level)
+  for (tx, ty, tile) in zip(txs, tys, tiles):
+    screen.blit(cache.Get(tile, zoom, render),
+                (origin_x + tx * tile_pixels, origin_y + ty * tile_pixels))
+
+
+def DrawChangedTiles(screen, old, new, view_center, pixels, level, size,
+                     cache=None):
+  """Brings a screen showing old, as drawn by DrawTiles() with the same
+  view, up to date with new, a node of the same level: only the tiles that
+  differ (see life.ChangedNodes()) are cleared and drawn again. Returns the
+  rectangles of the screen changed, for pygame.display.update(), or None if
+  the screen has to be drawn from scratch instead.
+
+  Identical subtrees are skipped without looking inside, so the work follows
+  the changes on screen rather than the population."""
+  if cache is None:
+    cache = tile_cache
+  if old._level != new._level:
+    return None
+  layout = _TileLayout(new, view_center, pixels, level, size)
+  if layout is None:
+    return None
+  (tile_level, (origin_x, origin_y), tile_pixels, bounds) = layout
+  (txs, tys, tiles) = life.ChangedNodes(old, new, tile_level, bounds)
+  zoom = (pixels, level)
+  render = _TileRenderer(screen, tile_level, tile_pixels, pixels, level)
+  zero = life.Node.Zero(tile_level)
+  screen_rect = screen.get_rect()
+  rects = []
+  for (tx, ty, tile) in zip(txs, tys, tiles):
+    position = (origin_x + tx * tile_pixels, origin_y + ty * tile_pixels)
+    # Clipped first: some versions of pygame fill too much for a rectangle
+    # starting off the screen.
+    rect = pygame.Rect(position, (tile_pixels, tile_pixels)).clip(screen_rect)
+    screen.fill(WHITE, rect)
+    if tile is not zero:
+      screen.blit(cache.Get(tile, zoom, render), position)
+    rects.append(rect)
+  return rects
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation for life.py: what the engine has been doing, to see why a
+pattern is slow.
+
+As it runs, life.py counts by the level of the node the nodes it constructs,
+the lookups in the node store that find a canonical node (hits) and that have
+to add one (misses), and the _Forward() results it finds cached (hits) and has
+to work out. It also times World.Iterate(), World.Draw() and World.FillNode().
+Stats gathers all of that, with the state of a world and the node store, at
+one moment:
+  stats = world.Stats()
+  print '\n'.join(stats.Summary())
+  stats.Dump(open('stats.json', 'w'))
+Subtracting one Stats from a later one gives what happened in between. The
+window shows a summary with --hud (or the H key), and --stats FILE saves the
+stats as JSON when a run ends.
+
+A pattern whose forward hit rate falls, or whose computed results pile up at
+the low levels, has stopped repeating itself; one whose nodes pile up near the
+budget spends its time collecting (see life.NodeStore).
+
+Released under the LGPL (or most other licenses on demand) - contact me if you
+need appropriate headers stuck on.
+"""
+import copy
+import json
+import sys
+import time
+
+import life
+
+# The counters kept by level, and the dicts in life that hold them.
+COUNTERS = [
+    ('nodes_constructed', 'nodesConstructedByLevel'),
+    ('canonical_hits', 'canonicalHitsByLevel'),
+    ('canonical_misses', 'canonicalMissesByLevel'),
+    ('forward_hits', 'forwardHitsByLevel'),
+    ('forward_computed', 'forwardComputedByLevel'),
+]
+
+
+def Reset():
+  """Zeroes the counters and timings, e.g. before each of several runs."""
+  for (name, source) in COUNTERS:
+    getattr(life, source).clear()
+  life.timings.clear()
+  life.timedCalls.clear()
+
+
+def EstimateMemory(store=None):
+  """Estimates the bytes used by store (life.node_store by default), as
+  NodeStore.MemoryUsage() does, but from a single node of each table rather
+  than every node, so it is cheap enough for every frame. Cached results for
+  slower steps (Node._nextByLevel) are not counted."""
+  if store is None:
+    store = life.node_store
+  total = 0
+  for table in [store._nodes] + store._leaves[1:]:
+    total += sys.getsizeof(table)
+    if table:
+      # Nodes have slots, so all but their cached results are the same size.
+      node = next(table.itervalues())
+      size = sys.getsizeof(node)
+      if node._level <= life.LEAF_LEVEL:
+        size += sys.getsizeof(node._bits)
+      total += len(table) * size
+  return total
+
+
+def _HitRate(hits, misses):
+  total = hits + misses
+  return float(hits) / total if total else 0.0
+
+
+class Stats:
+  """The counters, timings and state of the engine at one moment; see the
+  module docstring.
+
+  by_level maps each counter name in COUNTERS to a dict of level -> count.
+  seconds and calls map 'forward', 'draw' and 'fill_node' to the seconds spent
+  and the calls made. With a world, generation, population and root_level
+  describe it; without one they are None.
+  """
+
+  def __init__(self, world=None, store=None, exact_memory=False):
+    if store is None:
+      store = life.node_store
+    self.time = time.time()
+    self.by_level = dict((name, dict(getattr(life, source)))
+                         for (name, source) in COUNTERS)
+    self.seconds = dict(life.timings)
+    self.calls = dict(life.timedCalls)
+    self.nodes = len(store)
+    self.budget = store.Budget()
+    self.collections = store.num_collections
+    self.collected = store.total_freed
+    self.exact_memory = exact_memory
+    if exact_memory:
+      self.memory_bytes = store.MemoryUsage()
+    else:
+      self.memory_bytes = EstimateMemory(store)
+    self.generation = None
+    self.population = None
+    self.root_level = None
+    if world is not None:
+      # Read once: a Simulation may be replacing it.
+      root = world._root
+      self.generation = world._iteration_count
+      self.population = root.Population()
+      self.root_level = root._level
+
+  def __sub__(self, earlier):
+    """What happened between earlier and this: the counters and timings are
+    differences, and the state is this one's."""
+    result = copy.copy(self)
+    result.by_level = {}
+    for (name, counts) in self.by_level.iteritems():
+      before = earlier.by_level.get(name, {})
+      result.by_level[name] = dict(
+          (level, count - before.get(level, 0))
+          for (level, count) in counts.iteritems()
+          if count != before.get(level, 0))
+    result.seconds = dict((name, seconds - earlier.seconds.get(name, 0.0))
+                          for (name, seconds) in self.seconds.iteritems())
+    result.calls = dict((name, calls - earlier.calls.get(name, 0))
+                        for (name, calls) in self.calls.iteritems())
+    result.collections = self.collections - earlier.collections
+    result.collected = self.collected - earlier.collected
+    return result
+
+  def Total(self, name):
+    """The count for the counter name, over every level."""
+    return sum(self.by_level[name].itervalues())
+
+  def ForwardHitRate(self):
+    return _HitRate(self.Total('forward_hits'), self.Total('forward_computed'))
+
+  def CanonicalHitRate(self):
+    return _HitRate(self.Total('canonical_hits'),
+                    self.Total('canonical_misses'))
+
+  def MeanSeconds(self, name):
+    """The average seconds per call to name, or 0 without any."""
+    calls = self.calls.get(name, 0)
+    return self.seconds.get(name, 0.0) / calls if calls else 0.0
+
+  def ToDict(self):
+    """The stats as a dict ready for JSON, with a row per level."""
+    levels = sorted(set(level for counts in self.by_level.itervalues()
+                        for level in counts))
+    rows = []
+    for level in levels:
+      row = {'level': level}
+      for (name, source) in COUNTERS:
+        row[name] = self.by_level[name].get(level, 0)
+      rows.append(row)
+    return {
+        'time': self.time,
+        'generation': self.generation,
+        'population': self.population,
+        'root_level': self.root_level,
+        'nodes': self.nodes,
+        'node_budget': self.budget,
+        'memory_bytes': self.memory_bytes,
+        'memory_exact': self.exact_memory,
+        'collections': self.collections,
+        'collected_nodes': self.collected,
+        'seconds': self.seconds,
+        'calls': self.calls,
+        'totals': dict((name, self.Total(name))
+                       for (name, source) in COUNTERS),
+        'forward_hit_rate': self.ForwardHitRate(),
+        'canonical_hit_rate': self.CanonicalHitRate(),
+        'levels': rows,
+    }
+
+  def Dump(self, f):
+    """Writes ToDict() to the file f as JSON."""
+    json.dump(self.ToDict(), f, indent=2, sort_keys=True,
+              separators=(',', ': '))
+    f.write('\n')
+
+  def Summary(self):
+    """A few lines on the state and the caches, as the HUD shows."""
+    lines = []
+    if self.generation is not None:
+      lines.append('generation %d, population %d, level %d' %
+                   (self.generation, self.population, self.root_level))
+    lines.append('%d nodes, %.1f MB%s, %d collections' %
+                 (self.nodes, self.memory_bytes / 1e6,
+                  '' if self.exact_memory else ' (estimated)',
+                  self.collections))
+    computed = self.by_level['forward_computed']
+    busiest = ''
+    if computed:
+      level = max(computed, key=computed.get)
+      busiest = ', most at level %d' % level
+    lines.append('forward: %.1f%% of %d from the cache, %d computed%s' %
+                 (100 * self.ForwardHitRate(),
+                  self.Total('forward_hits') + self.Total('forward_computed'),
+                  self.Total('forward_computed'), busiest))
+    lines.append('canonical: %.1f%% of %d found, %d nodes constructed' %
+                 (100 * self.CanonicalHitRate(),
+                  self.Total('canonical_hits') +
+                  self.Total('canonical_misses'),
+                  self.Total('nodes_constructed')))
+    lines.append('step %.1f ms, draw %.1f ms, fill %.1f ms (per call)' %
+                 (1000 * self.MeanSeconds('forward'),
+                  1000 * self.MeanSeconds('draw'),
+                  1000 * self.MeanSeconds('fill_node')))
+    return lines
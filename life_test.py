@@ -7,7 +7,9 @@ Released under the LGPL (or most other licenses on demand) - contact me if you
 need appropriate headers stuck on.
 """
 
+import os
 import sys
+import life
 from life import *
 
 def TestNoNodeConstructor():
@@ -49,6 +51,37 @@ def TestFillNode():
       Node.CanonicalNode(1, 1, 0, 0, 0))
   blink2 = World.FillNode(((0,0), (1, 0), (2, 0)))
   assert blink == blink2
+
+  # Built from blocks, the node is the one the cell by cell recursion gives,
+  # and with NumPy it is the same again.
+  import random
+  rand = random.Random(11)
+  soup = set((x, y) for x in range(-30, 70) for y in range(40)
+             if rand.random() < 0.3)
+  for positions in (soup, set([(7, -9), (100, 60)])):
+    min_x = min(x for (x, y) in positions)
+    max_x = max(x for (x, y) in positions)
+    min_y = min(y for (x, y) in positions)
+    max_y = max(y for (x, y) in positions)
+    levels = int(math.log(max(max_x - min_x, max_y - min_y) + 1, 2)) + 1
+    half = 1 << (levels - 1)
+    center_x = (max_x + min_x) // 2
+    center_y = (max_y + min_y) // 2
+    bounds = (center_x - half + 1, center_x + half,
+              center_y - half + 1, center_y + half)
+    node = World.FillNode(positions)
+    assert node is World._NodeFromPositionsAndBounds(positions, levels, bounds)
+  sparse = set((rand.randint(-50000, 50000), rand.randint(-30000, 100))
+               for i in range(5000))
+  assert len(sparse) >= life.NUMPY_FILL_MIN
+  node = World.FillNode(sparse)
+  numpy_min = life.NUMPY_FILL_MIN
+  life.NUMPY_FILL_MIN = len(sparse) + 1
+  try:
+    assert World.FillNode(sparse) is node
+  finally:
+    life.NUMPY_FILL_MIN = numpy_min
+  assert node.Population() == len(sparse)
   return True
 
 def TestInnerBounds():
@@ -81,6 +114,959 @@ def TestBlinker():
   assert b_lots == b_1
   return True
 
+def TestLevel2Table():
+  # Compare the table against counting neighbours by hand.
+  level1 = [Node.CanonicalNode(1, (c >> 3) & 1, (c >> 2) & 1, (c >> 1) & 1,
+                               c & 1) for c in range(16)]
+  for index in range(0, 65536, 97):
+    node = Node.CanonicalNode(2, level1[index >> 12], level1[(index >> 8) & 15],
+                              level1[(index >> 4) & 15], level1[index & 15])
+    cells = _LiveCells(node)
+    expected = []
+    for (x, y) in ((-1, 0), (0, 0), (-1, -1), (0, -1)):
+      count = len([1 for (cx, cy) in cells
+                   if max(abs(cx - x), abs(cy - y)) == 1])
+      expected.append(1 if count == 3 or (count == 2 and (x, y) in cells)
+                      else 0)
+    assert node._Forward() == Node.CanonicalNode(1, *expected)
+  return True
+
+def TestForwardCacheByLevel():
+  # Alternating step sizes shouldn't evict each other's cached results.
+  n = World.FillNode([(-2,-2), (-2,-1), (-2,2), (-1,-2), (-1,1), (0,-2), (0,1),
+                      (0,2), (1,0), (2,-2), (2,0), (2,1), (2,2)])
+  first = [n.ForwardN(steps) for steps in (1, 1000, 3, 2**20)]
+  computed = life.numForwardComputed
+  second = [n.ForwardN(steps) for steps in (1, 1000, 3, 2**20)]
+  assert life.numForwardComputed == computed
+  assert first == second
+  return True
+
+def TestNodeMemory():
+  box = Node.CanonicalNode(1, 1, 1, 1, 1)
+  assert not hasattr(box, '__dict__')
+  assert 0 < node_store.BytesPerNode() < 300
+  assert node_store.MemoryUsage() > len(node_store) * box.SizeOf()
+  return True
+
+def _NaiveStep(cells):
+  counts = {}
+  for (x, y) in cells:
+    for dx in (-1, 0, 1):
+      for dy in (-1, 0, 1):
+        if dx or dy:
+          counts[(x+dx, y+dy)] = counts.get((x+dx, y+dy), 0) + 1
+  return set(cell for (cell, count) in counts.items()
+             if count == 3 or (count == 2 and cell in cells))
+
+def TestPackedLeaves():
+  import random
+  rand = random.Random(5)
+  for i in range(20):
+    leaves = [node_store.CanonicalLeaf(3, rand.getrandbits(64))
+              for j in range(4)]
+    for leaf in leaves:
+      assert isinstance(leaf, Leaf)
+      assert Node.CanonicalNode(3, leaf._nw, leaf._ne, leaf._sw,
+                                leaf._se) is leaf
+      assert leaf.Expand()._nw._se == leaf._nw
+    assert (Node.MergeCenter(*leaves) ==
+            Node.CanonicalNode(3, leaves[0]._se, leaves[1]._sw, leaves[2]._ne,
+                               leaves[3]._nw))
+    node = Node.CanonicalNode(4, *leaves)
+    cells = set(_LiveCells(node))
+    for atLevel in (2, 3, 4):
+      expected = cells
+      for generation in range(2**(atLevel-2)):
+        expected = _NaiveStep(expected)
+      expected = sorted((x, y) for (x, y) in expected
+                        if -4 <= x < 4 and -4 <= y < 4)
+      assert _LiveCells(node._Forward(atLevel)) == expected
+  return True
+
+def _LiveCells(node):
+  cells = []
+  half = 2**(node._level-1)
+  node.Draw((-half, half-1, -half, half-1), lambda x, y: cells.append((x, y)))
+  return sorted(cells)
+
+def TestNodeStoreCollection():
+  initial_state = [(-2,-2), (-2,-1), (-2,2), (-1,-2), (-1,1), (0,-2), (0,1),
+                     (0,2), (1,0), (2,-2), (2,0), (2,1), (2,2)]
+  expected = World(initial_state)
+  for i in range(20):
+    expected.Iterate(37)
+  expected_cells = _LiveCells(expected._root)
+
+  old_budget = node_store.Budget()
+  try:
+    node_store.SetBudget(500)
+    collections = node_store.num_collections
+    world = World(initial_state)
+    for i in range(20):
+      world.Iterate(37)
+      assert len(node_store) <= max(500, 2 * node_store.history[-1].nodes_after)
+    assert node_store.num_collections > collections
+    assert world._root.IsCanonical()
+    assert _LiveCells(world._root) == expected_cells
+    stats = node_store.Collect()
+    assert stats.nodes_after <= stats.nodes_before
+    assert Node.Zero(5).IsCanonical()
+  finally:
+    node_store.SetBudget(old_budget)
+  return True
+
+def TestForwardIterative():
+  n = World.FillNode(set(ParseFile('examples/backrake.cells')))
+  while n._level < 10:
+    n = n.Expand()
+  node_store.ForgetResults()
+  expected = [n._Forward(atLevel) for atLevel in (10, 5, 3)]
+  node_store.ForgetResults()
+  assert [n._ForwardIterative(atLevel) for atLevel in (10, 5, 3)] == expected
+
+  # Deep enough that the recursive version would hit the recursion limit.
+  b = Node.CanonicalNode(
+       2,
+       Node.CanonicalNode(1, 0, 0, 1, 1),
+       Node.CanonicalNode(1, 0, 0, 1, 0),
+       Node.Zero(1), Node.Zero(1))
+  limit = sys.getrecursionlimit()
+  try:
+    sys.setrecursionlimit(200)
+    assert b.ForwardN(2**300 + 1) == b.ForwardN(1)
+  finally:
+    sys.setrecursionlimit(limit)
+  return True
+
+def TestFlattenNodes():
+  n = World.FillNode(set(ParseFile('examples/backrake.cells')))
+  n2 = n.ForwardN(100)
+  (entries, roots) = FlattenNodes([n, n2])
+  assert len(entries) == len(set(entries))
+  nodes = UnflattenNodes(entries)
+  assert nodes[roots[0]] is n
+  assert nodes[roots[1]] is n2
+  return True
+
+def TestParallelEngine():
+  import life_parallel
+  positions = ParseFile('examples/backrake.cells')
+  expected = World(positions)
+  engine = life_parallel.ParallelEngine(processes=2, cutoff_level=6)
+  try:
+    world = World(positions, stepper=engine)
+    for n in (1, 100, 1000):
+      # The parallel world goes first, so it doesn't find the results cached.
+      world.Iterate(n)
+      expected.Iterate(n)
+      assert world._root == expected._root
+    assert engine.num_tasks > 0
+    # Each node is sent to a worker once: run again from scratch, the same
+    # nodes go to the same workers, who have them already.
+    (tasks, sent) = (engine.num_tasks, engine.nodes_sent)
+    life.node_store.ForgetResults()
+    again = World(positions, stepper=engine)
+    for n in (1, 100, 1000):
+      again.Iterate(n)
+    assert again._root == expected._root
+    assert engine.num_tasks > tasks and engine.nodes_sent == sent
+    # After a collection the shared nodes are forgotten, and sent again.
+    life.node_store.Collect()
+    world.Iterate(100)
+    expected.Iterate(100)
+    assert world._root == expected._root
+    assert engine.nodes_sent > sent
+  finally:
+    engine.Close()
+  return True
+
+def TestLeafBlocks():
+  positions = ParseFile('examples/backrake.cells')
+  node = World.FillNode(set(positions))
+  assert NodeFromLeafBlocks(dict(LeafBlocks(node))) is node.Compact()
+  blocks = dict(LeafBlocks(NodeFromLeafBlocks({(-3, 1): 1, (0, -1): 1 << 63})))
+  assert blocks == {(-3, 1): 1, (0, -1): 1 << 63}
+  assert NodeFromLeafBlocks({}).IsZero()
+  return True
+
+def TestDenseEngine():
+  import random
+  import life_dense
+  rand = random.Random(8)
+  soup = [(x, y) for x in range(-20, 20) for y in range(-20, 20)
+          if rand.random() < 0.4]
+  backrake = ParseFile('examples/backrake.cells')
+  for positions in (soup, backrake, []):
+    expected = World(positions)
+    engine = life_dense.DenseEngine()
+    world = World(positions, stepper=engine)
+    for n in (1, 7, 100):
+      world.Iterate(n)
+      expected.Iterate(n)
+      assert world._root is expected._root
+  auto = life_dense.AutoEngine(recheck_every=2)
+  world = World(soup, stepper=auto)
+  expected = World(soup)
+  for i in range(6):
+    world.Iterate(3)
+    expected.Iterate(3)
+    assert world._root is expected._root
+  assert auto.reuse is not None
+  # A big step stays with HashLife even when reuse is low, and leaves the
+  # dense engine the small steps after it. A new soup, so nothing is cached.
+  soup = [(x, y) for x in range(-20, 20) for y in range(-20, 20)
+          if rand.random() < 0.4]
+  auto = life_dense.AutoEngine(max_work=1 << 20)
+  world = World(soup, stepper=auto)
+  world.Iterate(1)
+  assert auto.reuse < 2.0
+  world.Iterate(1)
+  assert auto.current == 'dense'
+  world.Iterate(1000)
+  assert auto.current == 'hashlife'
+  world.Iterate(1)
+  assert auto.current == 'dense'
+  expected = World(soup)
+  expected.Iterate(1003)
+  assert world._root is expected._root
+  return True
+
+def TestHeadless():
+  import shutil
+  import tempfile
+  # Nothing so far needed a display.
+  assert 'pygame' not in sys.modules
+  output_dir = tempfile.mkdtemp()
+  try:
+    (path, population, bounding_box) = RunHeadless(
+        'examples/backrake.cells', 100, output_dir)
+    world = World.Load('examples/backrake.cells')
+    world.Iterate(100)
+    assert population == world.Population() > 0
+    assert bounding_box == world.BoundingBox()
+    assert '!Population: %d\n' % population in open(path).readlines()
+    # Saving and loading may move the pattern, but not change it.
+    (min_x, min_y) = bounding_box[:2]
+    reloaded = World(ParseFile(path))
+    (reloaded_x, reloaded_y) = reloaded.BoundingBox()[:2]
+    assert (sorted((x - min_x, y - min_y) for (x, y) in world.Cells()) ==
+            sorted((x - reloaded_x, y - reloaded_y)
+                   for (x, y) in reloaded.Cells()))
+    main(['--generations', '5', '--engine', 'dense', '--output-dir',
+          output_dir, 'examples/backrake.cells'])
+    assert os.path.exists(os.path.join(output_dir, 'backrake.5.cells'))
+    main(['--generations', '1000000', '--format', 'mc', '--output-dir',
+          output_dir, 'examples/backrake.cells'])
+    saved = World.Load(os.path.join(output_dir, 'backrake.1000000.mc'))
+    assert saved._iteration_count == 1000000 and saved.Population() > 0
+  finally:
+    shutil.rmtree(output_dir)
+  return True
+
+def TestPopulationAndBounds():
+  assert Node.Zero(7).Population() == 0
+  assert Node.Zero(7).Bounds() is None
+  glider = [(0, 0), (1, 0), (2, 0), (2, 1), (1, 2)]
+  for positions in ([(5, -3)], glider, ParseFile('examples/backrake.cells')):
+    node = World.FillNode(set(positions))
+    for n in (0, 1, 30, 1000):
+      result = node.ForwardN(n) if n else node
+      cells = _LiveCells(result)
+      assert result.Population() == len(cells)
+      if not cells:
+        assert result.Bounds() is None
+        continue
+      assert result.Bounds() == (min(x for (x, y) in cells),
+                                 min(y for (x, y) in cells),
+                                 max(x for (x, y) in cells),
+                                 max(y for (x, y) in cells))
+  # A glider 2^40 generations on is far away, but still five cells.
+  world = World(glider)
+  world.Iterate(2**40)
+  assert world.Population() == 5
+  assert world.BoundingBox() == (2**38 - 2, -2**38 - 2, 2**38, -2**38)
+  return True
+
+def TestDrawBlocks():
+  node = World.FillNode(set(ParseFile('examples/backrake.cells'))).ForwardN(300)
+  cells = _LiveCells(node)
+  for level in (1, 2, 5, node._level + 1):
+    expected = {}
+    for (x, y) in cells:
+      if -3 <= x >> level <= 2 and -8 <= y >> level <= 1:
+        block = (x >> level, y >> level)
+        expected[block] = expected.get(block, 0) + 1
+    blocks = {}
+    def DrawBlock(bx, by, population):
+      assert (bx, by) not in blocks
+      blocks[(bx, by)] = population
+    node.DrawBlocks((-3, 2, -8, 1), level, DrawBlock)
+    assert blocks == expected
+  # Zooming out past one pixel per cell, and back in.
+  import pygame
+  world = World(ParseFile('examples/backrake.cells'))
+  world._view_size = 2
+  for i in range(4):
+    world.ZoomOut()
+  assert (world._view_size, world._cells_per_pixel) == (1, 8)
+  screen = pygame.Surface((64, 48))
+  screen.fill((255, 255, 255))
+  world.Draw(64, 48, screen)
+  assert screen.get_at((32, 24))[:3] != (255, 255, 255)
+  for i in range(4):
+    world.ZoomIn()
+  assert (world._view_size, world._cells_per_pixel) == (2, 1)
+  return True
+
+def TestPixelBuffer():
+  import pygame
+  world = World(ParseFile('examples/backrake.cells'))
+  world.Iterate(200)
+  def Render(use_pixel_buffer, use_tile_cache=False):
+    screen = pygame.Surface((120, 90))
+    screen.fill((255, 255, 255))
+    world.use_pixel_buffer = use_pixel_buffer
+    world.use_tile_cache = use_tile_cache
+    world.Draw(120, 90, screen)
+    return pygame.image.tostring(screen, 'RGB')
+  cells = world.Cells()
+  for (view_size, cells_per_pixel, (x, y)) in ((1, 1, (0, 0)),
+                                               (3, 1, cells[0]),
+                                               (5, 1, cells[-1]),
+                                               (1, 2, cells[0]),
+                                               (1, 4, (9, 9)),
+                                               (1, 16, (-50, 0))):
+    world._view_size = view_size
+    world._cells_per_pixel = cells_per_pixel
+    world._view_center = [x + 3, y - 2]
+    buffered = Render(True)
+    assert buffered == Render(False)
+    assert buffered != '\xff' * len(buffered)
+    # Drawn from tiles, both when they are new and when they are cached.
+    assert Render(True, True) == buffered
+    assert Render(True, True) == buffered
+  return True
+
+def TestTileCache():
+  import life_render
+  import pygame
+  cache = life_render.TileCache(max_bytes=3 * 64 * 64 * 4)
+  tiles = [World.FillNode(set([(i, 0), (0, i)])) for i in range(1, 5)]
+  def Render(tile):
+    return pygame.Surface((64, 64), 0, 32)
+  for tile in tiles[:3]:
+    cache.Get(tile, (1, 0), Render)
+  assert len(cache) == 3 and cache.misses == 3
+  # Using the first tile again makes the second the least recently used.
+  cache.Get(tiles[0], (1, 0), Render)
+  assert cache.hits == 1
+  cache.Get(tiles[3], (1, 0), Render)
+  assert cache.Bytes() <= 3 * 64 * 64 * 4 and cache.evicted == 2
+  cache.Get(tiles[0], (2, 0), Render)
+  assert cache.misses == 5
+  cache.Get(tiles[3], (1, 0), Render)
+  assert cache.hits == 2
+  return True
+
+def TestSimulation():
+  import pygame
+  positions = ParseFile('examples/backrake.cells')
+  world = World(positions)
+  expected = World(positions)
+  simulation = Simulation(world)
+  try:
+    # While the thread can't take the first request, a second is refused.
+    with simulation._condition:
+      assert simulation.Request(7)
+      assert not simulation.Request(7)
+    assert simulation.WaitUntilIdle(30)
+    for n in (1, 32, 1000):
+      assert simulation.Request(n)
+      assert simulation.WaitUntilIdle(30)
+    expected.Iterate(7 + 1 + 32 + 1000)
+    (root, generation) = simulation.Snapshot()
+    assert generation == simulation.Requested() == 7 + 1 + 32 + 1000
+    cells = []
+    size = 2**(root._level-1)
+    root.Draw((-size, size-1, -size, size-1),
+              lambda x, y: cells.append((x, y)))
+    assert sorted(cells) == sorted(expected.Cells())
+  finally:
+    simulation.Stop()
+  assert not simulation.Request(1)
+
+  # Drawing a snapshot, even of a tiny pattern, builds no nodes, so it can
+  # go on alongside the thread.
+  world = World([(0, 0), (1, 0), (2, 0)])
+  simulation = Simulation(world)
+  simulation.Stop()
+  (root, generation) = simulation.Snapshot()
+  def Render(root, use_pixel_buffer, use_tile_cache):
+    screen = pygame.Surface((40, 30))
+    screen.fill((255, 255, 255))
+    world.use_pixel_buffer = use_pixel_buffer
+    world.use_tile_cache = use_tile_cache
+    world.Draw(40, 30, screen, root)
+    return pygame.image.tostring(screen, 'RGB')
+  for (view_size, cells_per_pixel) in ((5, 1), (1, 1), (1, 2), (1, 64)):
+    world._view_size = view_size
+    world._cells_per_pixel = cells_per_pixel
+    for (use_pixel_buffer, use_tile_cache) in ((False, False), (True, False),
+                                               (True, True)):
+      constructed = (life.numNodesConstructed, len(node_store))
+      drawn = Render(root, use_pixel_buffer, use_tile_cache)
+      assert constructed == (life.numNodesConstructed, len(node_store))
+      assert drawn == Render(None, use_pixel_buffer, use_tile_cache)
+      assert drawn != '\xff' * len(drawn)
+  return True
+
+def TestLoad():
+  import shutil
+  import tempfile
+  glider = [(0, 1), (-1, 2), (-2, 0), (-2, 1), (-2, 2)]
+  def Normalised(cells):
+    min_x = min(x for (x, y) in cells)
+    min_y = min(y for (x, y) in cells)
+    return sorted((x - min_x, y - min_y) for (x, y) in cells)
+  output_dir = tempfile.mkdtemp()
+  try:
+    for (name, text) in (
+        ('glider.cells', '!Name: Glider\n.O.\n..O\nOOO\n'),
+        ('glider.rle', '#N Glider\nx = 3, y = 3, rule = B3/S23\nbo$2bo$3o!\n'),
+        # A run count split across lines.
+        ('split.rle', '#C Glider\n#R 0 0\nx = 3, y = 3\nb\no$2\nbo$3o!\n'),
+        ('glider.lif', '#Life 1.06\n1 0\n2 1\n0 2\n1 2\n2 2\n'),
+        ('blocks.lif', '#Life 1.05\n#N\n#P 0 0\n.*\n#P 2 1\n*\n#P 0 2\n***\n')):
+      path = os.path.join(output_dir, name)
+      with open(path, 'w') as f:
+        f.write(text)
+      assert sorted(ParseFile(path)) == sorted(glider)
+      assert Normalised(World.Load(path).Cells()) == Normalised(glider)
+    path = os.path.join(output_dir, 'highlife.rle')
+    with open(path, 'w') as f:
+      f.write('x = 3, y = 3, rule = B36/S23\nbo$2bo$3o!\n')
+    try:
+      World.Load(path)
+      assert False
+    except UsageError:
+      pass
+  finally:
+    shutil.rmtree(output_dir)
+
+  # The #P blocks of a Life 1.05 file are placed at their offsets.
+  positions = ParseFile('examples/3enginecordershipgun.cells')
+  assert (-(-129 + 7), -139 + 23) in positions
+  for name in ('examples/backrake.cells', 'examples/17c45reaction.cells',
+               'examples/3enginecordershipgun.cells'):
+    world = World.Load(name)
+    assert world._root.IsCanonical()
+    assert (Normalised(world.Cells()) ==
+            Normalised(World(ParseFile(name)).Cells()))
+  return True
+
+def TestMacrocell():
+  import shutil
+  import StringIO
+  import tempfile
+  import life_load
+  def Normalised(node):
+    world = World([])
+    world._root = node
+    cells = world.Cells()
+    min_x = min(x for (x, y) in cells)
+    min_y = min(y for (x, y) in cells)
+    return sorted((x - min_x, y - min_y) for (x, y) in cells)
+  # A glider as Golly saves it comes out as its RLE does.
+  (glider, generation) = life_load.ReadMacrocell(StringIO.StringIO(
+      '[M2] (golly 2.8)\n#R B3/S23\n.*$..*$***$\n4 0 0 0 1\n'))
+  rle = life_load.NodeFromRuns(life_load.ReadRuns(StringIO.StringIO(
+      'x = 3, y = 3, rule = B3/S23\nbo$2bo$3o!\n')))
+  assert Normalised(glider) == Normalised(rle)
+  assert generation == 0
+
+  # A result 2^40 generations on is saved and read back node for node.
+  output_dir = tempfile.mkdtemp()
+  try:
+    world = World.Load('examples/backrake.cells')
+    world.Iterate(2**40)
+    path = os.path.join(output_dir, 'backrake.mc')
+    world.Save(path, ['After 2^40 generations'])
+    unique = set()
+    stack = [world._root]
+    while stack:
+      node = stack.pop()
+      if id(node) not in unique and not node.IsZero():
+        unique.add(id(node))
+        if node._level > LEAF_LEVEL:
+          stack.extend((node._nw, node._ne, node._sw, node._se))
+    with open(path) as f:
+      lines = f.readlines()
+    assert lines[:4] == ['[M2] (life.py)\n', '#R B3/S23\n',
+                         '#G %d\n' % 2**40, '#C After 2^40 generations\n']
+    assert len(lines) == 4 + len(unique)
+    reloaded = World.Load(path)
+    assert reloaded._root is world._root
+    assert reloaded._iteration_count == 2**40
+  finally:
+    shutil.rmtree(output_dir)
+  return True
+
+def TestCheckpoint():
+  import shutil
+  import tempfile
+  import life_checkpoint
+  output_dir = tempfile.mkdtemp()
+  old_store = life.node_store
+  try:
+    world = World.Load('examples/backrake.cells')
+    world.Iterate(1000)
+    path = os.path.join(output_dir, 'backrake.ckpt')
+    world.Checkpoint(path)
+    # Resume as a restarted process would, into an empty store.
+    life.node_store = NodeStore(DEFAULT_MAX_NODES)
+    resumed = World.Resume(path)
+    assert len(life.node_store) == len(old_store)
+    assert resumed._iteration_count == 1000
+    assert sorted(resumed.Cells()) == sorted(world.Cells())
+    # The steps already taken are all cached.
+    computed = life.numForwardComputed
+    World.Load('examples/backrake.cells').Iterate(1000)
+    assert life.numForwardComputed == computed
+    # Merged into a store already in use, nodes stay unique.
+    (root, generation) = life_checkpoint.Load(path)
+    assert root is resumed._root and generation == 1000
+    resumed.Iterate(500)
+    cells = sorted(resumed.Cells())
+  finally:
+    life.node_store = old_store
+    shutil.rmtree(output_dir)
+  world.Iterate(500)
+  assert sorted(world.Cells()) == cells
+  return True
+
+def TestCheckpointSeveralPatterns():
+  import shutil
+  import tempfile
+  output_dir = tempfile.mkdtemp()
+  names = ['examples/backrake.cells', 'examples/17c45reaction.cells']
+  try:
+    checkpoint = os.path.join(output_dir, 'ck.bin')
+    for _ in range(2):
+      # The second time round, each pattern resumes from its own checkpoint.
+      main(['--generations', '100', '--checkpoint', checkpoint,
+            '--output-dir', output_dir] + names)
+      for name in names:
+        expected = World.Load(name)
+        expected.Iterate(100)
+        base = os.path.splitext(os.path.basename(name))[0]
+        saved = World(ParseFile(os.path.join(output_dir,
+                                             '%s.100.cells' % base)))
+        assert saved.Population() == expected.Population()
+        assert os.path.exists(os.path.join(output_dir, 'ck.%s.bin' % base))
+    assert not os.path.exists(checkpoint)
+    # A checkpoint only resumes the run that saved it.
+    saved = os.path.join(output_dir, 'ck.backrake.bin')
+    for (source, target) in ((open(names[1], 'rb').read(), 100),
+                             (open(names[0], 'rb').read(), 200)):
+      try:
+        World.Resume(saved, source=source, target=target)
+        assert False, 'Resumed a different run'
+      except UsageError:
+        pass
+    try:
+      RunHeadless(names[1], 100, output_dir, checkpoint=saved)
+      assert False, 'Resumed a different pattern'
+    except UsageError:
+      pass
+  finally:
+    shutil.rmtree(output_dir)
+  return True
+
+def TestCellAccess():
+  import random
+  import numpy
+  rand = random.Random(19)
+  soup = [(x, y) for x in range(-20, 60) for y in range(-30, 10)
+          if rand.random() < 0.35]
+  world = World(soup)
+  cells = set(world.Cells())
+  size = 1 << (world._root._level - 1)
+  for x in range(-size - 2, size + 2):
+    for y in range(-size - 2, size + 2):
+      assert world.GetCell(x, y) == ((x, y) in cells)
+
+  # Only the path down to the cell is rebuilt.
+  root = world._root
+  world.SetCell(5, 6)
+  cells.add((5, 6))
+  assert world._root._sw is root._sw and world._root._se is root._se
+  assert world._root._nw is root._nw
+  world.SetCell(5, 6, alive=False)
+  assert world._root is root
+  cells.discard((5, 6))
+
+  # Batches of both, and cells well outside the root.
+  born = [(rand.randint(-size, size - 1), rand.randint(-size, size - 1))
+          for i in range(200)] + [(-1000, 3), (70, 2000)]
+  died = rand.sample(sorted(cells), 100) + [(5000, 5000)]
+  world.SetCells(born)
+  world.SetCells(died, alive=False)
+  cells = (cells | set(born)) - set(died)
+  assert set(world.Cells()) == cells
+  assert world.Population() == len(cells)
+  assert world.GetCell(-1000, 3) and world.GetCell(70, 2000)
+  try:
+    world._root.SetCell(1 << 20, 0)
+    assert False, 'Expected a UsageError'
+  except UsageError:
+    pass
+
+  bounds = (-13, 29, -17, 6)
+  inside = set((x, y) for (x, y) in cells
+               if bounds[0] <= x <= bounds[1] and bounds[2] <= y <= bounds[3])
+  assert set(world.CellsIn(bounds)) == inside
+  region = world.Region(bounds)
+  assert region.shape == (bounds[1] - bounds[0] + 1, bounds[3] - bounds[2] + 1)
+  assert set((x + bounds[0], y + bounds[2])
+             for (x, y) in zip(*numpy.nonzero(region))) == inside
+  return True
+
+def TestStats():
+  import json
+  import StringIO
+  import life_stats
+  life_stats.Reset()
+  before = (life.numNodesConstructed, life.numForwardCacheHits,
+            life.numForwardComputed, life.numAlreadyInCache)
+  world = World(ParseFile('examples/backrake.cells'))
+  world.Iterate(100)
+  first = world.Stats()
+  world.Iterate(1000)
+  stats = world.Stats(exact_memory=True)
+
+  # The counts by level add up to the totals life.py has always kept.
+  assert stats.Total('nodes_constructed') == (life.numNodesConstructed -
+                                              before[0])
+  assert stats.Total('forward_hits') == life.numForwardCacheHits - before[1]
+  assert stats.Total('forward_computed') == life.numForwardComputed - before[2]
+  assert stats.Total('canonical_hits') == life.numAlreadyInCache - before[3]
+  assert stats.calls == {'fill_node': 1, 'forward': 2}
+  assert stats.generation == 1100
+  assert stats.population == world.Population()
+  assert stats.memory_bytes == node_store.MemoryUsage()
+  estimate = life_stats.EstimateMemory()
+  assert stats.memory_bytes / 2 < estimate < stats.memory_bytes * 2
+
+  since = stats - first
+  assert since.calls == {'fill_node': 0, 'forward': 1}
+  assert (since.Total('forward_computed') ==
+          stats.Total('forward_computed') - first.Total('forward_computed'))
+  assert len(since.Summary()) == 5
+
+  f = StringIO.StringIO()
+  stats.Dump(f)
+  dumped = json.loads(f.getvalue())
+  assert dumped['generation'] == 1100
+  assert dumped['totals']['forward_computed'] == stats.Total(
+      'forward_computed')
+  assert sum(row['nodes_constructed'] for row in dumped['levels']) == (
+      stats.Total('nodes_constructed'))
+  life_stats.Reset()
+  assert life_stats.Stats().Total('forward_hits') == 0
+  return True
+
+def TestCycles():
+  import random
+  # Moving a node, even a long way, and back.
+  rand = random.Random(21)
+  soup = [(x, y) for x in range(30) for y in range(20) if rand.random() < 0.4]
+  node = World.FillNode(soup)
+  cells = set(World(soup).Cells())
+  for (dx, dy) in ((0, 0), (3, 0), (0, -5), (13, -7), (-8, 16), (1 << 40, 9)):
+    moved = life.TranslatedNode(node, dx, dy)
+    assert moved.Population() == len(cells)
+    assert life.TranslatedNode(moved, -dx, -dy) is node.Compact()
+    if dx < 1000:
+      world = World([])
+      world._root = moved
+      assert set(world.Cells()) == set((x + dx, y + dy) for (x, y) in cells)
+
+  # A still life, an oscillator and a spaceship.
+  block = [(0, 0), (0, 1), (1, 0), (1, 1)]
+  blinker = [(0, 0), (1, 0), (2, 0)]
+  glider = [(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)]
+  for (positions, period, moves) in ((block, 1, False), (blinker, 2, False),
+                                     (glider, 4, True)):
+    world = World(positions)
+    world.Iterate(3)
+    cycle = world.FindCycle(20)
+    assert cycle.period == period
+    assert ((cycle.dx, cycle.dy) != (0, 0)) == moves
+    assert max(abs(cycle.dx), abs(cycle.dy)) <= 1
+    expected = World(positions)
+    expected.Iterate(world._iteration_count)
+    for n in (1, 7, 100, 1001):
+      world.Iterate(n)
+      expected.Iterate(n)
+      assert world._iteration_count == expected._iteration_count
+      assert sorted(world.Cells()) == sorted(expected.Cells())
+    # Far ahead, at once.
+    computed = life.numForwardComputed
+    world.Iterate(10**12)
+    assert life.numForwardComputed - computed < 1000
+    assert world.Population() == len(positions)
+    if moves:
+      (min_x, min_y, max_x, max_y) = world.BoundingBox()
+      assert max(abs(min_x), abs(min_y)) > 10**11
+
+  # A settled pattern seen across a huge step: the period is found quickly,
+  # both by trying the short ones and, past the history, by cutting the step
+  # down by its prime factors.
+  import time
+  settled = block + [(10, 10), (10, 11), (10, 12)]
+  history = World.cycle_history
+  try:
+    for World.cycle_history in (history, 1):
+      start = time.time()
+      world = World(settled)
+      world.Iterate(2**60)
+      assert time.time() - start < 0.5
+      assert world.Cycle().period == 2 and world.Population() == 7
+  finally:
+    World.cycle_history = history
+  assert life._PrimeFactors(2**60) == [2]
+  assert life._PrimeFactors(360) == [2, 3, 5]
+  assert life._PrimeFactors(7 * 65537 ** 2, limit=100) == [7, 65537 ** 2]
+
+  # A pattern that keeps growing never repeats, and edits forget what was
+  # seen.
+  world = World(ParseFile('examples/backrake.cells'))
+  assert world.FindCycle(200) is None
+  world = World(blinker)
+  assert world.FindCycle(10) is not None
+  world.SetCell(10, 10)
+  assert world.Cycle() is None
+
+  # Headless runs note the cycle.
+  import shutil
+  import tempfile
+  output_dir = tempfile.mkdtemp()
+  try:
+    pattern = os.path.join(output_dir, 'glider.cells')
+    with open(pattern, 'w') as f:
+      f.write('.O.\n..O\nOOO\n')
+    (path, population, bounding_box) = RunHeadless(
+        pattern, 10**15, output_dir, find_cycles=100)
+    assert population == 5
+    assert 'Cycle: period 4' in open(path).read()
+  finally:
+    shutil.rmtree(output_dir)
+
+  # The history holds no nodes: a collection after chaotic steps keeps as many
+  # as with it turned off.
+  soup = [(x, y) for x in range(128) for y in range(128)
+          if rand.random() < 0.4]
+  old_store = life.node_store
+  history = World.cycle_history
+  kept = []
+  try:
+    for World.cycle_history in (0, history):
+      life.node_store = NodeStore(DEFAULT_MAX_NODES)
+      world = World(soup)
+      for i in range(100):
+        world.Iterate(1)
+      assert world.Cycle() is None
+      life.node_store.Collect()
+      kept.append(len(life.node_store))
+    # With none, nothing is found.
+    World.cycle_history = 0
+    assert World(blinker).FindCycle(10) is None
+  finally:
+    life.node_store = old_store
+    World.cycle_history = history
+  assert kept[1] <= kept[0] * 1.05
+  return True
+
+def TestHyperspeed():
+  import collections
+  hyperspeed = life.Hyperspeed(budget=0.1)
+  assert hyperspeed.Step() == 1 and hyperspeed.Rate() == 0
+  # Cheap steps double, dear ones halve, and ones in between stay put.
+  generation = 0
+  for (seconds, step) in ((0.01, 2), (0.01, 4), (0.01, 8), (0.2, 4),
+                          (0.07, 4), (0.2, 2), (0.2, 1), (0.2, 1)):
+    generation += hyperspeed.Step()
+    hyperspeed.Record(generation, hyperspeed.Step(), seconds)
+    assert hyperspeed.Step() == step
+  # Steps seen twice, or not its own, change nothing.
+  hyperspeed.Record(generation, 1, 0.01)
+  hyperspeed.Record(generation + 5, 5, 0.01)
+  assert hyperspeed.Step() == 1
+  hyperspeed._samples = collections.deque([(10.0, 0), (12.0, 1000)])
+  assert hyperspeed.Rate() == 500
+
+  # Stepping as a Game does in the background, the steps grow to fill the
+  # budget and land on the generations asked for.
+  world = World(ParseFile('examples/backrake.cells'))
+  simulation = Simulation(world)
+  hyperspeed = life.Hyperspeed(budget=10)
+  try:
+    for i in range(8):
+      assert simulation.Request(hyperspeed.Step())
+      assert simulation.WaitUntilIdle(30)
+      hyperspeed.Record(*simulation.LastStep())
+    (generation, generations, seconds) = simulation.LastStep()
+    assert generation == simulation.Requested() == 255
+    assert generations == 128 and hyperspeed.Step() == 256
+  finally:
+    simulation.Stop()
+  expected = World(ParseFile('examples/backrake.cells'))
+  expected.Iterate(255)
+  assert sorted(world.Cells()) == sorted(expected.Cells())
+  return True
+
+def TestDirtyRedraw():
+  import pygame
+  import random
+  rand = random.Random(23)
+  soup = [(x, y) for x in range(-20, 20) for y in range(-15, 15)
+          if rand.random() < 0.35]
+  # The changes between generations, found without looking inside what
+  # is the same, match a comparison of every node.
+  old = Simulation._Drawable(World.FillNode(soup))
+  new = old.ForwardN(5)
+  while new._level < old._level:
+    new = new.Expand()
+  while old._level < new._level:
+    old = old.Expand()
+  for level in (LEAF_LEVEL, LEAF_LEVEL + 1):
+    before = dict(((nx, ny), node) for (nx, ny, node)
+                  in zip(*NodeColumns(old, level)))
+    after = dict(((nx, ny), node) for (nx, ny, node)
+                 in zip(*NodeColumns(new, level)))
+    changed = set(key for key in set(before) | set(after)
+                  if before.get(key) is not after.get(key))
+    (nxs, nys, nodes) = life.ChangedNodes(old, new, level)
+    assert set(zip(nxs, nys)) == changed
+    for (nx, ny, node) in zip(nxs, nys, nodes):
+      assert node is after.get((nx, ny), Node.Zero(level))
+    assert life.ChangedNodes(new, new, level) == ([], [], [])
+  try:
+    life.ChangedNodes(old, new.Expand(), LEAF_LEVEL)
+    assert False
+  except UsageError:
+    pass
+
+  # A screen brought up to date a frame at a time matches one drawn from
+  # scratch, at several zooms, and only what changed is updated.
+  def Drawn(world, screen, root):
+    screen.fill((255, 255, 255))
+    world.Draw(160, 120, screen, root)
+    return pygame.image.tostring(screen, 'RGB')
+  world = World(ParseFile('examples/backrake.cells'))
+  world.Iterate(50)
+  for (view_size, cells_per_pixel) in ((5, 1), (1, 1), (1, 4)):
+    world._view_size = view_size
+    world._cells_per_pixel = cells_per_pixel
+    screen = pygame.Surface((160, 120))
+    fresh = pygame.Surface((160, 120))
+    root = Simulation._Drawable(world._root)
+    assert world.DrawChanges(160, 120, screen, root) is None
+    Drawn(world, screen, root)
+    assert world.DrawChanges(160, 120, screen, root) == []
+    for i in range(6):
+      previous = root
+      root = Simulation._Drawable(root.ForwardN(1))
+      rects = world.DrawChanges(160, 120, screen, root)
+      if root._level != previous._level:
+        assert rects is None
+        Drawn(world, screen, root)
+        continue
+      assert rects is not None
+      for rect in rects:
+        assert screen.get_rect().contains(rect)
+      other = World([])
+      other._view_size = view_size
+      other._cells_per_pixel = cells_per_pixel
+      assert (pygame.image.tostring(screen, 'RGB') ==
+              Drawn(other, fresh, root))
+    # A changed view starts afresh.
+    world.ShiftView(pygame.K_LEFT, 20)
+    assert world.DrawChanges(160, 120, screen, root) is None
+    world._view_center = [0, 0]
+  return True
+
+def TestCensus():
+  import json
+  import life_census
+  import StringIO
+  # Objects get the same code in every orientation and phase, and pieces that
+  # never touch count apart.
+  glider = [(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)]
+  world = World(glider)
+  for i in range(4):
+    world.Iterate(1)
+    cells = world.Cells()
+    for (sx, sy) in ((1, 1), (-1, 1), (1, -1)):
+      codes = life_census.Classify([(sx * y, sy * x) for (x, y) in cells])
+      assert [life_census.Name(code) for code in codes] == ['glider']
+  assert life_census.Classify([(0, 0), (0, 1), (0, 2)]) == ('xp2_1x3_7',)
+  block = [(0, 0), (0, 1), (1, 0), (1, 1)]
+  bi_block = block + [(x + 3, y) for (x, y) in block]
+  assert life_census.Classify(bi_block) == ('xs4_2x2_f',) * 2
+  # Blocks any closer interact, and a lone cell dies.
+  assert life_census.Classify(block + [(x + 2, y) for (x, y) in block]) is None
+  assert life_census.Classify([(5, 5)]) is None
+  assert len(life_census.Objects(bi_block + [(20, 20), (21, 20)])) == 2
+  assert (life_census.WorldCensus(World(bi_block + [(20, 0), (21, 0),
+                                                   (22, 0)])) ==
+          {'xs4_2x2_f': 2, 'xp2_1x3_7': 1})
+  for (name, rows) in life_census.NAMES.iteritems():
+    (code,) = life_census.Classify([(x, y) for (y, row) in enumerate(rows)
+                                    for (x, cell) in enumerate(row)
+                                    if cell == 'O'])
+    assert life_census.Name(code) == name
+
+  # Soups are the same each time, settle to the same census however they are
+  # shared out, and pattern files are soups too.
+  assert (life_census.RandomSoup('test', 3, 8) ==
+          life_census.RandomSoup('test', 3, 8))
+  assert (life_census.RandomSoup('test', 3, 8) !=
+          life_census.RandomSoup('test', 4, 8))
+  soups = life_census.RandomSoups('test', 6, size=8)
+  census = life_census.Run(soups)
+  assert census.soups == 6 and census.generations > 0
+  assert census.SoupsPerSecond() > 0
+  pooled = life_census.Run(soups, processes=2, batch_size=2)
+  assert (pooled.counts, pooled.first_soups, pooled.unsettled) == (
+      census.counts, census.first_soups, census.unsettled)
+  census = life_census.Run(['examples/backrake.cells'] + soups[:2],
+                           max_generations=1000)
+  assert census.unsettled == ['examples/backrake.cells']
+  f = StringIO.StringIO()
+  census.Dump(f)
+  data = json.loads(f.getvalue())
+  assert data['soups'] == 3
+  assert (sum(row['count'] for row in data['objects']) ==
+          sum(census.counts.values()))
+  assert census.Summary()[0].startswith('3 soups')
+  return True
+
+def TestBenchExamplesIsolated():
+  import life_bench
+  case = ('examples/17c45reaction.cells', 100)
+  alone = life_bench.RunExample(*case)
+  # Warm this process up: none of it may show in the next run.
+  World.Load(case[0]).Iterate(case[1])
+  World.Load('examples/backrake.cells').Iterate(1000)
+  after = life_bench.RunExample(*case)
+  for key in ('population', 'nodes', 'nodes_constructed', 'forward_hit_rate',
+              'canonical_hit_rate', 'reference'):
+    assert alone[key] == after[key], key
+  assert alone['reference'] is True
+  return True
+
 def TestPerformance():
   initial_state = [(-2,-2), (-2,-1), (-2,2), (-1,-2), (-1,1), (0,-2), (0,1),
                      (0,2), (1,0), (2,-2), (2,0), (2,1), (2,2)]
@@ -95,6 +1081,32 @@ if __name__ == "__main__":
       TestFillNode() and
       TestInnerBounds() and
       TestBlinker() and
+      TestLevel2Table() and
+      TestPackedLeaves() and
+      TestForwardCacheByLevel() and
+      TestNodeStoreCollection() and
+      TestNodeMemory() and
+      TestForwardIterative() and
+      TestFlattenNodes() and
+      TestParallelEngine() and
+      TestLeafBlocks() and
+      TestDenseEngine() and
+      TestHeadless() and
+      TestPopulationAndBounds() and
+      TestDrawBlocks() and
+      TestPixelBuffer() and
+      TestTileCache() and
+      TestSimulation() and
+      TestLoad() and
+      TestMacrocell() and
+      TestCheckpoint() and TestCheckpointSeveralPatterns() and
+      TestCellAccess() and
+      TestStats() and
+      TestCycles() and
+      TestHyperspeed() and
+      TestDirtyRedraw() and
+      TestCensus() and
+      TestBenchExamplesIsolated() and
       TestPerformance()):
     print "All Tests Passed"
     sys.exit(0)